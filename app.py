@@ -1,11 +1,35 @@
+import time
+
+# زمان شروع اجرای اسکریپت (برای گزارش زمان راه‌اندازی)
+SCRIPT_START = time.perf_counter()
+
 import streamlit as st
 import os
+import uuid
+import importlib
+import logging
 from dotenv import load_dotenv
-from modules import DocumentProcessor, VectorDatabase, LLMClient, FileManager, ChatHistory
+# فقط کلاس‌های سبک در ابتدا import می‌شوند؛ کلاس‌هایی که به torch، faiss یا PyMuPDF وابسته‌اند
+# در نخ بارگذاری پس‌زمینه import می‌شوند تا اولین نمایش صفحه منتظر آن‌ها نماند
+from modules import LLMClient, FileManager, ChatHistory, ResponseCache, ContextBuilder, Reranker, BackgroundLoader
+from modules.chat_history import DEFAULT_SESSION
+
+IMPORT_SECONDS = time.perf_counter() - SCRIPT_START
 
 # بارگذاری متغیرهای محیطی از فایل .env
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# تعداد گفتگوهای هر صفحه تاریخچه
+HISTORY_PAGE_SIZE = 10
+
+# فاصله به‌روزرسانی وضعیت کارهای پردازش فایل (ثانیه)
+JOB_POLL_SECONDS = 2
+
+# فاصله به‌روزرسانی وضعیت بارگذاری مدل و ایندکس (ثانیه)
+WARMUP_POLL_SECONDS = 1
+
 # تنظیمات صفحه
 st.set_page_config(
     page_title="DocuBrain - هوش اسناد و بازیابی",
@@ -123,45 +147,268 @@ document.addEventListener('keydown', function(e) {
 </script>
 """, unsafe_allow_html=True)
 
-def initialize_session_state():
-    """مقداردهی اولیه session state"""
-    if 'doc_processor' not in st.session_state:
-        st.session_state.doc_processor = DocumentProcessor()
-    
-    if 'vector_db' not in st.session_state:
-        st.session_state.vector_db = VectorDatabase()
+@st.cache_resource
+def get_startup_report():
+    """زمان‌بندی مراحل راه‌اندازی پروسه سرور (ثانیه) و خطاهای بارگذاری پس‌زمینه"""
+    return {'timings': {'imports': IMPORT_SECONDS}, 'errors': []}
+
+def load_vector_db(report):
+    """نصب بسته ایندکس (در صورت تنظیم INDEX_BUNDLE) و بارگذاری مدل و پایگاه داده برداری
+
+    در نخ پس‌زمینه اجرا می‌شود؛ بنابراین خطاها به جای نمایش مستقیم در گزارش راه‌اندازی (report) ثبت می‌شوند.
+    """
+    timings = report['timings']
+    
+    step_start = time.perf_counter()
+    # وابستگی‌های سنگین (faiss و PyMuPDF) یک‌بار در همین نخ import می‌شوند؛ ماژول‌هایی که بعداً در نخ اصلی
+    # استفاده می‌شوند فقط برای بارگذاری زودهنگام import می‌شوند
+    for module_name in ("modules.document_processor", "modules.semantic_cache", "modules.job_queue"):
+        importlib.import_module(module_name)
+    from modules import VectorDatabase
+    from modules.index_bundle import install_bundle
+    from modules.vector_database import DEFAULT_MODEL_NAME
+    timings['heavy_imports'] = time.perf_counter() - step_start
+    
+    bundle_path = os.getenv("INDEX_BUNDLE")
+    if bundle_path:
+        # بسته ایندکس ساخته‌شده با cli.py پیش از بارگذاری پایگاه داده نصب می‌شود (فقط یک‌بار برای هر بسته)
+        step_start = time.perf_counter()
+        try:
+            install_bundle(bundle_path, "data", DEFAULT_MODEL_NAME)
+        except Exception as e:
+            report['errors'].append(f"خطا در نصب بسته ایندکس: {str(e)}")
+        timings['bundle_install'] = time.perf_counter() - step_start
+    
+    try:
+        vector_db = VectorDatabase()
+    except Exception as e:
+        report['errors'].append(f"خطا در بارگذاری پایگاه داده: {str(e)}")
+        raise
+    timings['model_load'] = vector_db.load_timings['model_seconds']
+    timings['index_load'] = vector_db.load_timings['index_seconds']
+    return vector_db
+
+@st.cache_resource
+def get_shared_loader():
+    """بارگذاری پس‌زمینه مدل و پایگاه داده برداری (در اولین بازدید صفحه در هر پروسه سرور شروع می‌شود)"""
+    report = get_startup_report()
+    return BackgroundLoader(lambda: load_vector_db(report), name="vector-db-warmup")
+
+def get_shared_vector_db():
+    """پایگاه داده برداری مشترک بین تمام نشست‌ها (یک نمونه در هر پروسه سرور؛ تا پایان بارگذاری منتظر می‌ماند)"""
+    return get_shared_loader().result()
+
+@st.cache_resource
+def get_shared_response_cache():
+    """کش پاسخ‌های مدل زبانی مشترک بین تمام نشست‌ها"""
+    return ResponseCache()
+
+@st.cache_resource
+def get_shared_semantic_cache():
+    """کش معنایی پرسش‌ها مشترک بین تمام نشست‌ها"""
+    from modules import SemanticCache
     
+    vector_db = get_shared_vector_db()
+    return SemanticCache(vector_db.embedding_engine.dimension, model_name=vector_db.model_name)
+
+@st.cache_resource
+def get_shared_job_queue():
+    """صف پس‌زمینه پردازش فایل‌ها مشترک بین تمام نشست‌ها (نخ‌های کارگر با بسته شدن صفحه متوقف نمی‌شوند)"""
+    from modules import JobQueue
+    
+    vector_db = get_shared_vector_db()
+    return JobQueue(
+        create_document_processor(vector_db),
+        vector_db,
+        FileManager(
+            response_cache=get_shared_response_cache(),
+            semantic_cache=get_shared_semantic_cache(),
+            vector_db=vector_db
+        )
+    )
+
+def create_document_processor(vector_db):
+    """پردازشگر اسناد با توکنایزر مدل embedding (دو توکن برای توکن‌های ویژه کنار گذاشته می‌شود)"""
+    from modules import DocumentProcessor
+    
+    embedding_model = vector_db.model
+    return DocumentProcessor(
+        tokenizer=embedding_model.tokenizer,
+        model_max_tokens=embedding_model.max_seq_length - 2
+    )
+
+@st.cache_resource
+def get_shared_reranker():
+    """بازچین cross-encoder مشترک بین تمام نشست‌ها (مدل در اولین استفاده بارگذاری می‌شود)"""
+    return Reranker()
+
+def initialize_session_state():
+    """مقداردهی اولیه بخش‌هایی از session state که به مدل embedding نیاز ندارند"""
     if 'llm_client' not in st.session_state:
-        st.session_state.llm_client = LLMClient()
-    
-    if 'file_manager' not in st.session_state:
-        st.session_state.file_manager = FileManager()
+        st.session_state.llm_client = LLMClient(response_cache=get_shared_response_cache())
     
     if 'chat_history' not in st.session_state:
-        st.session_state.chat_history = ChatHistory()
+        # کلید نشست در آدرس صفحه نگه داشته می‌شود تا تاریخچه کاربر پس از بارگذاری مجدد صفحه حفظ شود
+        session_id = st.query_params.get("session")
+        if not session_id:
+            # هر بازدید بدون کلید نشست یک نشست جدید و خصوصی می‌گیرد
+            session_id = uuid.uuid4().hex
+            st.query_params["session"] = session_id
+        st.session_state.chat_history = ChatHistory(session_id=session_id)
+        # تاریخچه قالب قبلی به نشست default منتقل شده است و فقط با پیوند صریح ?session=default باز می‌شود
+        st.session_state.legacy_history_count = (
+            ChatHistory(session_id=DEFAULT_SESSION).count() if session_id != DEFAULT_SESSION else 0
+        )
     
     if 'current_question' not in st.session_state:
         st.session_state.current_question = ""
 
+def initialize_model_state():
+    """مقداردهی اولیه بخش‌هایی از session state که به مدل و پایگاه داده برداری نیاز دارند (پس از بارگذاری)"""
+    if 'vector_db' not in st.session_state:
+        # همه نشست‌ها از یک مدل و ایندکس مشترک می‌خوانند و تغییرات هر نشست بلافاصله برای بقیه قابل مشاهده است
+        st.session_state.vector_db = get_shared_vector_db()
+    
+    if 'doc_processor' not in st.session_state:
+        # طول چانک‌ها با توکنایزر همان مدل embedding سنجیده می‌شود
+        st.session_state.doc_processor = create_document_processor(st.session_state.vector_db)
+    
+    if 'context_builder' not in st.session_state:
+        # بودجه متن مرجع با همان توکنایزر چانک‌ها سنجیده می‌شود
+        st.session_state.context_builder = ContextBuilder(count_tokens=st.session_state.doc_processor.count_tokens)
+    
+    if 'file_manager' not in st.session_state:
+        st.session_state.file_manager = FileManager(
+            response_cache=get_shared_response_cache(),
+            semantic_cache=get_shared_semantic_cache(),
+            vector_db=st.session_state.vector_db
+        )
+
+def get_available_files():
+    """فایل‌های آپلودشده و فایل‌های ایندکس‌شده از خط فرمان یا بسته ایندکس (که در پوشه data کپی نشده‌اند)"""
+    return sorted(set(st.session_state.file_manager.get_uploaded_files())
+                  | set(st.session_state.vector_db.get_file_names()))
+
+def format_page_range(metadata):
+    """متن شماره صفحات یک منبع (چانک‌های قدیمی اطلاعات صفحه ندارند)"""
+    if 'page_start' not in metadata:
+        return ""
+    if metadata['page_start'] == metadata['page_end']:
+        return f" - صفحه {metadata['page_start']}"
+    return f" - صفحات {metadata['page_start']} تا {metadata['page_end']}"
+
+def format_stage_timings(timings, rerank_stats=None):
+    """متن زمان مراحل پاسخ‌گویی به میلی‌ثانیه"""
+    stage_names = {
+        'embed': 'embedding پرسش',
+        'retrieve': 'جستجو',
+        'rerank': 'بازچینی',
+        'context': 'ساخت متن مرجع',
+        'generate': 'تولید پاسخ'
+    }
+    parts = [f"{name} {timings[stage] * 1000:.0f}" for stage, name in stage_names.items() if stage in timings]
+    text = "⏱️ زمان مراحل (ms): " + "، ".join(parts)
+    if rerank_stats:
+        text += f" — بازچینی {rerank_stats['scored']} از {rerank_stats['candidates']} نامزد"
+        if rerank_stats['budget_exhausted']:
+            text += " (بودجه زمانی تمام شد)"
+        if rerank_stats['load_seconds'] >= 1:
+            text += f"، بارگذاری مدل {rerank_stats['load_seconds']:.1f} ثانیه"
+    return text
+
+def format_startup_timings(timings):
+    """متن زمان مراحل راه‌اندازی پروسه سرور به ثانیه"""
+    stage_names = {
+        'imports': 'import اسکریپت',
+        'first_paint': 'اولین نمایش صفحه',
+        'heavy_imports': 'import وابستگی‌های سنگین',
+        'bundle_install': 'نصب بسته ایندکس',
+        'model_load': 'بارگذاری مدل',
+        'index_load': 'بارگذاری ایندکس',
+        'warmup': 'کل بارگذاری پس‌زمینه'
+    }
+    parts = [f"{name} {timings[stage]:.2f}" for stage, name in stage_names.items() if stage in timings]
+    return "⏱️ زمان راه‌اندازی (ثانیه): " + "، ".join(parts)
+
+@st.fragment(run_every=WARMUP_POLL_SECONDS)
+def render_warmup_status():
+    """نمایش وضعیت بارگذاری مدل و ایندکس؛ پس از پایان بارگذاری کل صفحه دوباره اجرا می‌شود"""
+    loader = get_shared_loader()
+    if loader.ready:
+        st.rerun()
+    st.info(f"⏳ در حال بارگذاری مدل embedding و پایگاه داده برداری... ({loader.elapsed:.0f} ثانیه)")
+    st.caption("تاریخچه گفتگوها در این مدت در دسترس است؛ بارگذاری و پرسش از فایل‌ها پس از پایان بارگذاری فعال می‌شود.")
+
+def finish_warmup(loader):
+    """ثبت زمان کل بارگذاری پس‌زمینه و نمایش خطاهای آن؛ خروجی: آیا پایگاه داده برداری آماده است"""
+    report = get_startup_report()
+    if 'warmup' not in report['timings']:
+        report['timings']['warmup'] = loader.seconds
+        logger.info(format_startup_timings(report['timings']))
+    for error in report['errors']:
+        st.error(error)
+    if loader.error is not None:
+        # خطای بارگذاری پایگاه داده در load_vector_db به گزارش اضافه شده است
+        if not report['errors']:
+            st.error(f"خطا در بارگذاری پایگاه داده: {str(loader.error)}")
+        return False
+    return True
+
 def render_chat_history():
     """نمایش تاریخچه چت"""
     st.markdown('<h3 class="rtl">💬 تاریخچه گفتگو</h3>', unsafe_allow_html=True)
     
-    messages = st.session_state.chat_history.get_messages()
+    chat_history = st.session_state.chat_history
+    total = chat_history.count()
+    
+    if st.session_state.get('legacy_history_count'):
+        st.caption(f"[📂 باز کردن تاریخچه قبلی ({st.session_state.legacy_history_count} گفتگو)](?session={DEFAULT_SESSION})")
     
-    if not messages:
+    if not total:
         st.info("هنوز هیچ گفتگویی انجام نشده است.")
         return
     
-    # دکمه پاک کردن تاریخچه
-    col1, col2 = st.columns([1, 4])
+    # جستجو در گفتگوهای قبلی (تمام‌متن و/یا بر اساس فایل منبع)
+    col1, col2 = st.columns([3, 2])
+    with col1:
+        search_query = st.text_input("🔎 جستجو در گفتگوها", key="history_search")
+    with col2:
+        all_files = "همه فایل‌ها"
+        source_file = st.selectbox("فایل منبع", [all_files] + chat_history.get_source_files(), key="history_source_file")
+    if search_query.strip() or source_file != all_files:
+        messages = chat_history.search(search_query, None if source_file == all_files else source_file)
+        st.caption(f"{len(messages)} گفتگوی یافت‌شده")
+        render_messages(messages)
+        return
+    
+    # صفحه‌بندی: فقط پیام‌های صفحه جاری از پایگاه داده خوانده می‌شوند
+    page_count = (total + HISTORY_PAGE_SIZE - 1) // HISTORY_PAGE_SIZE
+    page = min(st.session_state.get('history_page', 0), page_count - 1)
+    
+    # دکمه پاک کردن تاریخچه و جابجایی بین صفحات
+    col1, col2, col3, col4 = st.columns([1, 1, 2, 1])
     with col1:
         if st.button("🗑️ پاک کردن تاریخچه", type="secondary"):
-            st.session_state.chat_history.clear_history()
+            chat_history.clear_history()
+            st.session_state.history_page = 0
+            st.rerun()
+    with col2:
+        if st.button("⬅️ قدیمی‌تر", disabled=page >= page_count - 1):
+            st.session_state.history_page = page + 1
+            st.rerun()
+    with col3:
+        st.caption(f"صفحه {page + 1} از {page_count} ({total} گفتگو)")
+    with col4:
+        if st.button("جدیدتر ➡️", disabled=page == 0):
+            st.session_state.history_page = page - 1
             st.rerun()
     
-    # نمایش پیام‌ها
-    for message in reversed(messages[-10:]):  # نمایش 10 پیام آخر
+    # نمایش پیام‌ها (از جدیدترین)
+    render_messages(chat_history.get_page(page, HISTORY_PAGE_SIZE))
+
+def render_messages(messages):
+    """نمایش پیام‌های تاریخچه"""
+    for message in messages:
         timestamp = st.session_state.chat_history.format_timestamp(message['timestamp'])
         
         # پیام کاربر
@@ -173,14 +420,20 @@ def render_chat_history():
         """, unsafe_allow_html=True)
         
         # پاسخ دستیار
+        timing_info = ""
+        if message.get('metrics', {}).get('cached'):
+            timing_info = " - ⚡ از کش"
+        elif message.get('metrics', {}).get('ttft') is not None:
+            timing_info = f" - ⏱️ اولین توکن: {message['metrics']['ttft']:.1f} ثانیه"
+        
         sources_info = ""
         if message.get('sources'):
-            source_files = list(set([s['metadata']['file_name'] for s in message['sources']]))
+            source_files = list(set([s['file_name'] for s in message['sources']]))
             sources_info = f"<div class='sources-section'>📚 منابع: {', '.join(source_files)}</div>"
         
         st.markdown(f"""
         <div class="chat-message assistant-message rtl">
-            <div class="message-timestamp">🤖 دستیار - {timestamp}</div>
+            <div class="message-timestamp">🤖 دستیار - {timestamp}{timing_info}</div>
             <div class="message-content"><strong>پاسخ:</strong> {message['answer']}</div>
             {sources_info}
         </div>
@@ -188,6 +441,71 @@ def render_chat_history():
         
         st.markdown("---")
 
+def process_all_files(uploaded_files):
+    """ثبت کار پس‌زمینه پردازش گروهی چند فایل (استخراج موازی صفحات و تولید embedding دسته‌ای)"""
+    files_to_ingest = []
+    for uploaded_file in uploaded_files:
+        unique_filename, file_path, already_known = st.session_state.file_manager.save_uploaded_file(uploaded_file)
+        if already_known:
+            st.info(f"ℹ️ فایل {uploaded_file.name} قبلاً با نام {unique_filename} پردازش شده است و دوباره ایندکس نمی‌شود.")
+        elif file_path:
+            files_to_ingest.append((unique_filename, file_path))
+    
+    if not files_to_ingest:
+        return
+    
+    job_id = get_shared_job_queue().submit(files_to_ingest)
+    st.info(f"⏳ پردازش {len(files_to_ingest)} فایل در پس‌زمینه آغاز شد (کار #{job_id}). می‌توانید به کار خود ادامه دهید.")
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def render_ingestion_jobs():
+    """نمایش وضعیت کارهای پردازش فایل (به صورت دوره‌ای و بدون مسدود کردن صفحه به‌روز می‌شود)"""
+    jobs = get_shared_job_queue().list_jobs()
+    if not jobs:
+        return
+    
+    st.markdown('<p class="rtl">⚙️ کارهای پردازش فایل:</p>', unsafe_allow_html=True)
+    status_labels = {'queued': '⏳ در صف', 'running': '🔄 در حال پردازش', 'done': '✅ انجام شد', 'failed': '❌ ناموفق'}
+    finished = st.session_state.setdefault('finished_jobs', None)
+    newly_finished = False
+    for job in jobs:
+        names = "، ".join(file_name for file_name, _ in job['files'])
+        label = f"کار #{job['id']} - {status_labels[job['status']]}: {names}"
+        if job['status'] in ('queued', 'running'):
+            progress = job['pages'] / job['total_pages'] if job['total_pages'] else 0.0
+            st.progress(min(progress, 1.0), text=f"{label} ({job['pages']} از {job['total_pages'] or '?'} صفحه، {job['chunks']} چانک)")
+            continue
+        
+        if finished is not None and job['id'] not in finished:
+            newly_finished = True
+        with st.expander(label):
+            if job['error']:
+                st.error(job['error'])
+            stats = job['result']
+            if stats and stats['ingested']:
+                text = f"{len(stats['ingested'])} فایل، {stats['pages']} صفحه، {stats['chunks']} چانک، {stats['cache_hits']} embedding از کش"
+                if stats.get('seconds'):
+                    text += (
+                        f" - سرعت: {stats['pages_per_second']:.1f} صفحه و {stats['chunks_per_second']:.1f} چانک در ثانیه "
+                        f"با {stats['workers']} پروسه (تولید embedding: {stats['embed_chunks_per_second']:.1f} چانک در ثانیه)"
+                    )
+                st.success(text)
+                show_truncation_warning(stats)
+    
+    st.session_state.finished_jobs = {job['id'] for job in jobs if job['status'] in ('done', 'failed')}
+    if newly_finished:
+        # فهرست فایل‌های قابل جستجو در کل صفحه به‌روز می‌شود
+        st.rerun()
+
+def show_truncation_warning(stats):
+    """هشدار در صورت طولانی‌تر بودن چانک‌ها از سقف ورودی مدل embedding"""
+    if stats.get('truncated_tokens'):
+        st.warning(
+            f"⚠️ {stats['truncated_chunks']} چانک از سقف ورودی مدل embedding طولانی‌تر است؛ "
+            f"{stats['truncated_tokens']} توکن ({stats['truncated_tokens'] / stats['tokens'] * 100:.1f}٪ متن) "
+            f"در embedding نادیده گرفته شد. برای جلوگیری از آن از CHUNK_MODE=tokens استفاده کنید."
+        )
+
 def render_file_management():
     """نمایش بخش مدیریت فایل‌ها"""
     st.markdown('<div class="upload-section">', unsafe_allow_html=True)
@@ -201,33 +519,30 @@ def render_file_management():
     )
     
     if uploaded_files:
+        if len(uploaded_files) > 1 and st.button(f"⚡ پردازش همه ({len(uploaded_files)} فایل)", type="primary"):
+            process_all_files(uploaded_files)
+        
         for uploaded_file in uploaded_files:
             if st.button(f"پردازش {uploaded_file.name}", key=f"process_{uploaded_file.name}"):
-                with st.spinner(f"در حال پردازش {uploaded_file.name}..."):
-                    # ذخیره فایل
-                    unique_filename, file_path = st.session_state.file_manager.save_uploaded_file(uploaded_file)
-                    
-                    if file_path:
-                        # استخراج متن
-                        text = st.session_state.doc_processor.extract_text_from_pdf(file_path)
-                        
-                        if text:
-                            # تقسیم به چانک
-                            chunks = st.session_state.doc_processor.chunk_text(text)
-                            
-                            # افزودن به پایگاه داده برداری
-                            st.session_state.vector_db.add_documents(chunks, unique_filename)
-                            
-                            st.success(f"✅ فایل {uploaded_file.name} با موفقیت پردازش شد! ({len(chunks)} چانک ایجاد شد)")
-                        else:
-                            st.error(f"❌ خطا در استخراج متن از {uploaded_file.name}")
+                # ذخیره فایل
+                unique_filename, file_path, already_known = st.session_state.file_manager.save_uploaded_file(uploaded_file)
+                
+                if already_known:
+                    # محتوای یکسان قبلاً ایندکس شده است؛ استخراج و embedding دوباره لازم نیست
+                    st.info(f"ℹ️ فایل {uploaded_file.name} قبلاً با نام {unique_filename} پردازش شده است و دوباره ایندکس نمی‌شود.")
+                elif file_path:
+                    # استخراج صفحه به صفحه، چانک کردن و افزودن به پایگاه داده برداری در پس‌زمینه
+                    job_id = get_shared_job_queue().submit([(unique_filename, file_path)])
+                    st.info(f"⏳ پردازش {uploaded_file.name} در پس‌زمینه آغاز شد (کار #{job_id}).")
+    
+    render_ingestion_jobs()
     
     st.markdown('</div>', unsafe_allow_html=True)
     
     # بخش مدیریت فایل‌ها
     st.markdown('<h3 class="rtl">📋 مدیریت فایل‌های آپلودشده</h3>', unsafe_allow_html=True)
     
-    uploaded_files_list = st.session_state.file_manager.get_uploaded_files()
+    uploaded_files_list = get_available_files()
     
     if uploaded_files_list:
         st.markdown('<p class="rtl">فایل‌های موجود:</p>', unsafe_allow_html=True)
@@ -312,41 +627,113 @@ def render_query_section(selected_files):
     # پردازش سؤال
     if submit_button and user_question.strip():
         with st.spinner("در حال جستجو و تولید پاسخ..."):
-            # جستجو در پایگاه داده برداری
-            search_results = st.session_state.vector_db.search(
-                user_question, 
-                k=5, 
-                selected_files=selected_files
-            )
+            llm_client = st.session_state.llm_client
+            vector_db = st.session_state.vector_db
+            semantic_cache = get_shared_semantic_cache()
+            reranker = get_shared_reranker()
+            fan_out = question_type == "تولید چندین سوال تستی" and llm_client.should_fan_out(user_question)
+            # زمان هر مرحله (ثانیه)
+            timings = {}
+            
+            # embedding پرسش یک‌بار محاسبه و هم برای کش معنایی و هم برای جستجو استفاده می‌شود
+            stage_start = time.perf_counter()
+            query_embedding = vector_db.encode_query(user_question)
+            timings['embed'] = time.perf_counter() - stage_start
+            # کش معنایی فقط برای سوال معمولی؛ درخواست‌های تولید سوال با تعداد یا موضوع متفاوت embedding بسیار نزدیکی دارند
+            use_semantic_cache = question_type == "سوال معمولی"
+            cache_hit = semantic_cache.lookup(query_embedding, selected_files, question_type) if use_semantic_cache else None
+            
+            rerank_stats = None
+            if cache_hit:
+                search_results = cache_hit['sources']
+            else:
+                # برای درخواست چند سوال تستی، هر درخواست هم‌زمان چانک‌های مرجع جداگانه‌ای دریافت می‌کند
+                k = min(20, max(5, llm_client.get_requested_question_count(user_question))) if fan_out else 5
+                use_reranker = reranker.enabled and not fan_out
+                
+                # مرحله اول: جستجو در پایگاه داده (در صورت فعال بودن بازچینی، با نامزدهای بیشتر)
+                stage_start = time.perf_counter()
+                search_results = vector_db.search(
+                    user_question, 
+                    k=max(k, reranker.candidates) if use_reranker else k, 
+                    selected_files=selected_files,
+                    query_embedding=query_embedding
+                )
+                timings['retrieve'] = time.perf_counter() - stage_start
+                
+                # مرحله دوم: بازچینی نامزدها با cross-encoder در محدوده بودجه زمانی
+                if use_reranker:
+                    search_results, rerank_stats = reranker.rerank(user_question, search_results, k)
+                    timings['rerank'] = rerank_stats['load_seconds'] + rerank_stats['seconds']
             
             if search_results:
-                # ترکیب نتایج جستجو
-                context = "\n\n".join([result['text'] for result in search_results])
+                # ترکیب نتایج جستجو (حذف متن تکراری چانک‌های هم‌پوشان و محدود کردن به بودجه توکن)
+                context_builder = st.session_state.context_builder
+                context_stats = None
+                if fan_out:
+                    # هر درخواست هم‌زمان بخشی از متن‌های ادغام‌شده را دریافت می‌کند و بودجه جداگانه ندارد
+                    passages = context_builder.merge(search_results)
+                    search_results = [result for passage in passages for result in passage['results']]
+                elif not cache_hit:
+                    stage_start = time.perf_counter()
+                    context, search_results, context_stats = context_builder.build(search_results)
+                    timings['context'] = time.perf_counter() - stage_start
                 
-                # تولید پاسخ
-                response = st.session_state.llm_client.generate_response(context, user_question)
+                st.markdown('<div class="response-section">', unsafe_allow_html=True)
+                st.markdown('<h4 class="rtl">📝 پاسخ جدید:</h4>', unsafe_allow_html=True)
+                
+                # تولید پاسخ (در حالت جریانی، متن به تدریج و به محض رسیدن نمایش داده می‌شود)
+                source_files = sorted({result['metadata']['file_name'] for result in search_results})
+                if cache_hit:
+                    response = cache_hit['answer']
+                    st.caption(f"⚡ پاسخ پرسش مشابه قبلی «{cache_hit['question']}» (شباهت {cache_hit['similarity']:.2f})")
+                    st.markdown(f'<div class="rtl">{response}</div>', unsafe_allow_html=True)
+                elif fan_out:
+                    response = llm_client.generate_mcq_batch([passage['text'] for passage in passages], user_question, source_files)
+                    st.markdown(f'<div class="rtl">{response}</div>', unsafe_allow_html=True)
+                elif llm_client.streaming:
+                    response_placeholder = st.empty()
+                    response = ""
+                    for delta in llm_client.generate_response_stream(context, user_question, source_files):
+                        response += delta
+                        response_placeholder.markdown(f'<div class="rtl">{response}▌</div>', unsafe_allow_html=True)
+                    response_placeholder.markdown(f'<div class="rtl">{response}</div>', unsafe_allow_html=True)
+                else:
+                    response = llm_client.generate_response(context, user_question, source_files)
+                    st.markdown(f'<div class="rtl">{response}</div>', unsafe_allow_html=True)
+                st.markdown('</div>', unsafe_allow_html=True)
+                
+                if cache_hit:
+                    metrics = {'ttft': 0.0, 'total': 0.0, 'streamed': False, 'cached': True, 'similarity': cache_hit['similarity']}
+                else:
+                    metrics = dict(llm_client.last_metrics)
+                    if metrics.get('total') is not None:
+                        timings['generate'] = metrics['total']
+                    metrics['timings'] = timings
+                    st.caption(format_stage_timings(timings, rerank_stats))
+                    if context_stats:
+                        metrics['context_tokens'] = context_stats['tokens']
+                        metrics['tokens_saved'] = context_stats['tokens_saved']
+                        st.caption(f"🧮 متن مرجع: {context_stats['tokens']} توکن ({context_stats['tokens_saved']} توکن کمتر از الحاق کامل نتایج)")
+                    if use_semantic_cache and not metrics.get('error'):
+                        semantic_cache.put(query_embedding, user_question, response, search_results, selected_files, question_type)
                 
-                # افزودن به تاریخچه
+                # افزودن متن کامل پاسخ به تاریخچه
                 st.session_state.chat_history.add_message(
                     question=user_question,
                     answer=response,
-                    sources=search_results
+                    sources=search_results,
+                    metrics=metrics
                 )
                 
                 # پاک کردن سؤال فعلی
                 st.session_state.current_question = ""
                 
-                # نمایش پاسخ
-                st.markdown('<div class="response-section">', unsafe_allow_html=True)
-                st.markdown('<h4 class="rtl">📝 پاسخ جدید:</h4>', unsafe_allow_html=True)
-                st.markdown(f'<div class="rtl">{response}</div>', unsafe_allow_html=True)
-                st.markdown('</div>', unsafe_allow_html=True)
-                
                 # نمایش منابع
                 with st.expander("📚 منابع استفاده‌شده"):
                     for i, result in enumerate(search_results, 1):
                         st.markdown(f"**منبع {i}** (امتیاز: {result['score']:.3f})")
-                        st.markdown(f"فایل: {result['metadata']['file_name']}")
+                        st.markdown(f"فایل: {result['metadata']['file_name']}{format_page_range(result['metadata'])}")
                         st.markdown(f"متن: {result['text'][:200]}...")
                         st.markdown("---")
                 
@@ -362,7 +749,7 @@ def render_query_section(selected_files):
 
 def render_statistics():
     """نمایش آمار سیستم"""
-    uploaded_files_list = st.session_state.file_manager.get_uploaded_files()
+    uploaded_files_list = get_available_files()
     
     if uploaded_files_list:
         st.markdown('<h3 class="rtl">📊 آمار سیستم</h3>', unsafe_allow_html=True)
@@ -372,43 +759,120 @@ def render_statistics():
             st.metric("تعداد فایل‌ها", len(uploaded_files_list))
         
         with col2:
-            st.metric("تعداد چانک‌ها", len(st.session_state.vector_db.documents))
+            st.metric("تعداد چانک‌ها", st.session_state.vector_db.get_chunk_count())
         
         with col3:
             total_size = st.session_state.file_manager.get_total_size()
             st.metric("حجم کل", f"{total_size:.1f} MB")
         
         with col4:
-            chat_count = len(st.session_state.chat_history.get_messages())
+            chat_count = st.session_state.chat_history.count()
             st.metric("تعداد گفتگوها", chat_count)
+        
+        with st.expander("⚙️ جزئیات فنی"):
+            st.markdown(format_startup_timings(get_startup_report()['timings']))
+            
+            index_info = st.session_state.vector_db.get_index_info()
+            st.markdown(f"**ایندکس برداری:** نوع `{index_info['type']}` (فشرده‌سازی `{index_info['quantization']}`)، {index_info['ntotal']} بردار، {index_info['tombstones']} چانک حذف‌شده در انتظار فشرده‌سازی")
+            st.markdown(f"**بازیابی:** حالت `{index_info['retrieval_mode']}`، ایندکس واژگانی با {index_info['lexical_terms']} واژه")
+            
+            cache_stats = st.session_state.vector_db.embedding_cache.get_stats()
+            st.markdown(
+                f"**کش embedding:** {cache_stats['entries']} ورودی، "
+                f"نرخ برخورد {cache_stats['hit_rate'] * 100:.1f}٪ "
+                f"({cache_stats['hits']} برخورد / {cache_stats['misses']} عدم برخورد)"
+            )
+            
+            engine_stats = st.session_state.vector_db.embedding_engine.get_stats()
+            st.markdown(
+                f"**تولید embedding:** {engine_stats['texts']} چانک، "
+                f"میانگین {engine_stats['chunks_per_second']:.1f} چانک در ثانیه "
+                f"(آخرین اجرا {engine_stats['last_chunks_per_second']:.1f}، اندازه دسته {engine_stats['batch_size']})"
+            )
+            
+            response_cache_stats = get_shared_response_cache().get_stats()
+            st.markdown(
+                f"**کش پاسخ‌ها:** {response_cache_stats['entries']} پاسخ، "
+                f"نرخ برخورد {response_cache_stats['hit_rate'] * 100:.1f}٪"
+            )
+            
+            semantic_cache_stats = get_shared_semantic_cache().get_stats()
+            st.markdown(
+                f"**کش معنایی پرسش‌ها:** {semantic_cache_stats['entries']} پرسش، "
+                f"نرخ برخورد {semantic_cache_stats['hit_rate'] * 100:.1f}٪ "
+                f"({semantic_cache_stats['hits']} برخورد / {semantic_cache_stats['misses']} عدم برخورد، "
+                f"آستانه شباهت {semantic_cache_stats['threshold']:.2f})"
+            )
+            
+            reranker_stats = get_shared_reranker().get_stats()
+            if reranker_stats['enabled']:
+                st.markdown(
+                    f"**بازچینی `{reranker_stats['model']}`:** {reranker_stats['queries']} پرسش، "
+                    f"میانگین {reranker_stats['mean_ms']:.0f} میلی‌ثانیه، "
+                    f"{reranker_stats['budget_exhausted']} بار عبور از بودجه {reranker_stats['time_budget_ms']:.0f} میلی‌ثانیه"
+                )
+            
+            transport_stats = st.session_state.llm_client.transport.get_stats()
+            for model_name, model_stats in transport_stats.items():
+                st.markdown(
+                    f"**مدل زبانی `{model_name}`:** {model_stats['attempts']} تلاش "
+                    f"({model_stats['retries']} تلاش مجدد، {model_stats['errors']} خطا)، "
+                    f"زمان پاسخ میانگین {model_stats['mean_latency']:.2f} و صدک ۹۵ {model_stats['p95_latency']:.2f} ثانیه"
+                )
+            
+            if st.button("📏 مقایسه انواع ایندکس", help="مقایسه recall، تأخیر و حافظه انواع ایندکس و فشرده‌سازی روی بردارهای همین پایگاه داده"):
+                with st.spinner("در حال ساخت و آزمایش ایندکس‌ها..."):
+                    benchmark_results = st.session_state.vector_db.benchmark_indexes()
+                st.table([
+                    {
+                        'ایندکس': row['index_type'],
+                        'فشرده‌سازی': row['quantization'],
+                        'امتیازدهی دوباره': '✓' if row['rescore'] else '',
+                        'recall@10': f"{row['recall']:.3f}",
+                        'تأخیر (ms)': f"{row['latency_ms']:.2f}",
+                        'حافظه (MB)': f"{row['memory_mb']:.1f}"
+                    }
+                    for row in benchmark_results
+                ])
 
 def main():
     """تابع اصلی اپلیکیشن"""
     # عنوان اصلی
     st.markdown('<h1 class="main-header rtl">🧠 DocuBrain - هوش اسناد و بازیابی</h1>', unsafe_allow_html=True)
     
-    # مقداردهی اولیه
+    # مقداردهی اولیه (مدل و ایندکس در پس‌زمینه بارگذاری می‌شوند و صفحه منتظر آن‌ها نمی‌ماند)
     initialize_session_state()
+    loader = get_shared_loader()
+    ready = loader.ready and finish_warmup(loader)
     
-    # بخش مدیریت فایل‌ها
-    selected_files = render_file_management()
-    if not selected_files:
-        selected_files = []
-    
-    # بخش پرسش و پاسخ
-    uploaded_files_list = st.session_state.file_manager.get_uploaded_files()
-    if uploaded_files_list:
-        render_query_section(selected_files)
+    if ready:
+        initialize_model_state()
+        
+        # بخش مدیریت فایل‌ها
+        selected_files = render_file_management()
+        if not selected_files:
+            selected_files = []
+        
+        # بخش پرسش و پاسخ
+        uploaded_files_list = get_available_files()
+        if uploaded_files_list:
+            render_query_section(selected_files)
+    elif not loader.ready:
+        render_warmup_status()
     
     # بخش تاریخچه چت
     render_chat_history()
     
     # بخش آمار
-    render_statistics()
+    if ready:
+        render_statistics()
     
     # --- Copyright/Footer ---
     st.markdown('<hr style="margin-top:32px; margin-bottom:8px;">', unsafe_allow_html=True)
     st.markdown('<div style="text-align:center; color:#888; font-size:14px;">This project was designed by <b>Naiem Yousefifard</b> | iritman@gmail.com<br>All rights reserved.</div>', unsafe_allow_html=True)
+    
+    # زمان اولین نمایش کامل صفحه پس از شروع پروسه (فقط اولین اجرا ثبت می‌شود)
+    get_startup_report()['timings'].setdefault('first_paint', time.perf_counter() - SCRIPT_START)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,138 @@
+"""خط فرمان DocuBrain: پردازش گروهی پوشه‌ای از فایل‌های PDF و ساخت بسته ایندکس بدون رابط کاربری
+
+نمونه:
+    python cli.py ingest /mnt/pdfs --bundle index_bundle.tar.gz
+    python cli.py export index_bundle.tar.gz
+"""
+
+import os
+import sys
+import time
+import argparse
+from dotenv import load_dotenv
+
+def find_pdfs(source_dir: str):
+    """مسیر تمام فایل‌های PDF پوشه و زیرپوشه‌ها (مرتب‌شده)"""
+    paths = []
+    for root, dirs, files in os.walk(source_dir):
+        dirs.sort()
+        paths.extend(os.path.join(root, name) for name in sorted(files) if name.lower().endswith('.pdf'))
+    return paths
+
+def load_components(args):
+    """بارگذاری مدل، پایگاه داده برداری و مدیریت فایل‌ها در پوشه data"""
+    from modules import VectorDatabase, DocumentProcessor, FileManager
+    
+    vector_db = VectorDatabase(data_dir=args.data_dir)
+    # طول چانک‌ها با توکنایزر مدل embedding سنجیده می‌شود (مانند رابط کاربری)
+    doc_processor = DocumentProcessor(
+        tokenizer=vector_db.model.tokenizer,
+        model_max_tokens=vector_db.model.max_seq_length - 2
+    )
+    return vector_db, doc_processor, FileManager(args.data_dir)
+
+def command_ingest(args) -> int:
+    """پردازش و ایندکس تمام فایل‌های PDF یک پوشه؛ فایل‌های پردازش‌شده در اجرای قبلی کنار گذاشته می‌شوند"""
+    from modules import IngestionPipeline
+    
+    source_dir = os.path.abspath(args.source_dir)
+    paths = find_pdfs(source_dir)
+    vector_db, doc_processor, file_manager = load_components(args)
+    
+    # فایل‌هایی که با همان مسیر، اندازه و زمان تغییر قبلاً پردازش شده‌اند بدون محاسبه هش کنار گذاشته می‌شوند
+    known_sources = file_manager.get_local_sources()
+    pending = []
+    for path in paths:
+        entry = known_sources.get(path)
+        file_stat = os.stat(path)
+        if (entry and entry.get('ingested') and entry['size'] == file_stat.st_size
+                and entry.get('source_mtime') == file_stat.st_mtime):
+            continue
+        pending.append(path)
+    print(f"{len(paths)} فایل PDF یافت شد؛ {len(paths) - len(pending)} فایل قبلاً پردازش شده است.")
+    
+    pipeline = IngestionPipeline(doc_processor, vector_db, None, max_workers=args.workers)
+    totals = {'files': 0, 'skipped': 0, 'errors': 0, 'pages': 0, 'chunks': 0}
+    start_time = time.perf_counter()
+    try:
+        for batch_start in range(0, len(pending), args.batch_files):
+            batch = pending[batch_start:batch_start + args.batch_files]
+            # نام هر فایل در پایگاه داده مسیر نسبی آن در پوشه منبع است
+            registered = file_manager.register_local_files(
+                [(path, os.path.relpath(path, source_dir).replace(os.sep, '/')) for path in batch]
+            )
+            files = [(file_name, path) for path, (file_name, already_known) in zip(batch, registered) if not already_known]
+            totals['skipped'] += len(batch) - len(files)
+            
+            if files:
+                stats = pipeline.ingest(files)
+                # فایل‌های هر دسته پس از ایندکس شدن ثبت می‌شوند؛ اجرای بعدی از اولین دسته ناتمام ادامه می‌دهد
+                file_manager.mark_ingested_files(stats['ingested'])
+                totals['files'] += len(stats['ingested'])
+                totals['errors'] += len(stats['errors'])
+                totals['pages'] += stats['pages']
+                totals['chunks'] += stats['chunks']
+                for file_name, error in stats['errors']:
+                    print(f"خطا در پردازش {file_name}: {error}", file=sys.stderr)
+            
+            elapsed = time.perf_counter() - start_time
+            done = batch_start + len(batch)
+            print(
+                f"[{done}/{len(pending)}] {totals['files']} فایل، {totals['pages']} صفحه، {totals['chunks']} چانک "
+                f"در {elapsed:.0f} ثانیه ({totals['pages'] / elapsed:.1f} صفحه در ثانیه)"
+            )
+    except KeyboardInterrupt:
+        print("پردازش متوقف شد؛ با اجرای دوباره همین دستور از ادامه کار شروع می‌شود.", file=sys.stderr)
+        vector_db.checkpoint()
+        return 130
+    
+    vector_db.checkpoint()
+    print(
+        f"پایان: {totals['files']} فایل پردازش شد، {totals['skipped']} فایل تکراری، {totals['errors']} خطا؛ "
+        f"پایگاه داده: {len(vector_db.get_file_names())} فایل و {vector_db.get_chunk_count()} چانک "
+        f"(ایندکس {vector_db.get_index_info()['type']})"
+    )
+    if args.bundle:
+        return export(vector_db, file_manager, args.bundle)
+    return 1 if totals['errors'] else 0
+
+def command_export(args) -> int:
+    """نوشتن بسته ایندکس از پوشه data"""
+    vector_db, _, file_manager = load_components(args)
+    return export(vector_db, file_manager, args.output)
+
+def export(vector_db, file_manager, output_path: str) -> int:
+    """نوشتن بسته ایندکس و نمایش خلاصه آن"""
+    from modules.index_bundle import export_bundle
+    
+    info = export_bundle(vector_db, file_manager, output_path)
+    print(f"بسته ایندکس در {output_path} نوشته شد ({info['files']} فایل، {info['chunks']} چانک، مدل {info['model_name']}).")
+    print(f"برای استفاده در اپلیکیشن: INDEX_BUNDLE={os.path.abspath(output_path)}")
+    return 0
+
+def main() -> int:
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="پردازش گروهی فایل‌های PDF و ساخت بسته ایندکس DocuBrain")
+    parser.add_argument("--data-dir", default="data", help="پوشه پایگاه داده (پیش‌فرض: data)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    ingest_parser = subparsers.add_parser("ingest", help="پردازش و ایندکس تمام فایل‌های PDF یک پوشه و زیرپوشه‌های آن")
+    ingest_parser.add_argument("source_dir", help="پوشه فایل‌های PDF")
+    ingest_parser.add_argument("--workers", type=int, default=None,
+                               help="تعداد پروسه‌های استخراج متن (پیش‌فرض: INGEST_WORKERS یا تعداد هسته‌ها)")
+    ingest_parser.add_argument("--batch-files", type=int, default=200,
+                               help="تعداد فایل‌های هر دسته؛ پیشرفت پس از هر دسته ذخیره می‌شود (پیش‌فرض: 200)")
+    ingest_parser.add_argument("--bundle", help="نوشتن بسته ایندکس در این مسیر پس از پایان پردازش")
+    ingest_parser.set_defaults(handler=command_ingest)
+    
+    export_parser = subparsers.add_parser("export", help="نوشتن بسته ایندکس (پوشه، یا فایل ‎.tar / .tar.gz)")
+    export_parser.add_argument("output", help="مسیر بسته")
+    export_parser.set_defaults(handler=command_export)
+    
+    args = parser.parse_args()
+    if not os.path.isdir(getattr(args, 'source_dir', None) or "."):
+        parser.error(f"پوشه یافت نشد: {args.source_dir}")
+    return args.handler(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -1,15 +1,60 @@
-"""ماژول‌های سیستم RAG"""
-
-from .document_processor import DocumentProcessor
-from .vector_database import VectorDatabase
-from .llm_client import LLMClient
-from .file_manager import FileManager
-from .chat_history import ChatHistory
-
-__all__ = [
-    'DocumentProcessor',
-    'VectorDatabase', 
-    'LLMClient',
-    'FileManager',
-    'ChatHistory'
-]
\ No newline at end of file
+"""ماژول‌های سیستم RAG
+
+کلاس‌ها در اولین دسترسی بارگذاری می‌شوند (PEP 562)؛ بنابراین `import modules` یا استفاده از
+کلاس‌های سبک (مانند ChatHistory) وابستگی‌های سنگین مانند torch، faiss و PyMuPDF را بارگذاری نمی‌کند.
+"""
+
+import importlib
+from typing import TYPE_CHECKING
+
+# نام هر کلاس و ماژولی که آن را تعریف می‌کند
+_EXPORTS = {
+    'DocumentProcessor': '.document_processor',
+    'VectorDatabase': '.vector_database',
+    'VectorStore': '.vector_store',
+    'EmbeddingCache': '.embedding_cache',
+    'LexicalIndex': '.lexical_index',
+    'EmbeddingEngine': '.embedding_engine',
+    'IngestionPipeline': '.ingestion',
+    'JobQueue': '.job_queue',
+    'LLMClient': '.llm_client',
+    'HTTPTransport': '.http_transport',
+    'ResponseCache': '.response_cache',
+    'SemanticCache': '.semantic_cache',
+    'ContextBuilder': '.context_builder',
+    'Reranker': '.reranker',
+    'FileManager': '.file_manager',
+    'ChatHistory': '.chat_history',
+    'BackgroundLoader': '.warmup'
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+if TYPE_CHECKING:
+    from .document_processor import DocumentProcessor
+    from .vector_database import VectorDatabase
+    from .vector_store import VectorStore
+    from .embedding_cache import EmbeddingCache
+    from .lexical_index import LexicalIndex
+    from .embedding_engine import EmbeddingEngine
+    from .ingestion import IngestionPipeline
+    from .job_queue import JobQueue
+    from .llm_client import LLMClient
+    from .http_transport import HTTPTransport
+    from .response_cache import ResponseCache
+    from .semantic_cache import SemanticCache
+    from .context_builder import ContextBuilder
+    from .reranker import Reranker
+    from .file_manager import FileManager
+    from .chat_history import ChatHistory
+    from .warmup import BackgroundLoader
\ No newline at end of file
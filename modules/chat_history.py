@@ -1,62 +1,151 @@
+import re
 import json
 import os
+import sqlite3
+import threading
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import streamlit as st
+from .lexical_index import normalize_text
+
+# نشست پیش‌فرض؛ تاریخچه قالب‌های قدیمی (بدون نشست) به این نشست منتقل می‌شود
+DEFAULT_SESSION = "default"
+
+_WORD = re.compile(r"\w+")
 
 class ChatHistory:
-    """کلاس مدیریت تاریخچه چت"""
+    """کلاس مدیریت تاریخچه چت
+
+    پیام‌ها در پایگاه داده SQLite (حالت WAL) ذخیره می‌شوند و هر پیام به یک نشست (`session_id`) تعلق دارد؛
+    بنابراین چند نشست هم‌زمان بدون بازنویسی کل تاریخچه و بدون تداخل شناسه‌ها پیام اضافه می‌کنند.
+    منابع هر پاسخ به صورت ارجاع به چانک (شناسه، نام فایل، امتیاز و صفحات) ذخیره و بر اساس نام فایل ایندکس
+    می‌شوند. متن نرمال‌شده سؤال و پاسخ‌ها در ایندکس تمام‌متن FTS5 قرار می‌گیرد.
+    تاریخچه قالب‌های قبلی (`chat_history.jsonl` و `chat_history.json`) در اولین اجرا منتقل می‌شود.
+    """
     
-    def __init__(self, history_file: str = "data/chat_history.json"):
+    def __init__(self, history_file: str = "data/chat_history.sqlite", session_id: str = DEFAULT_SESSION):
         self.history_file = history_file
-        self.messages = self.load_history()
+        self.session_id = session_id
+        self._lock = threading.Lock()
+        
+        try:
+            os.makedirs(os.path.dirname(history_file) or ".", exist_ok=True)
+            # هر نشست اتصال خودش را دارد؛ نویسنده‌های هم‌زمان تا timeout منتظر قفل نوشتن می‌مانند
+            self._conn = sqlite3.connect(history_file, timeout=30, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA foreign_keys=ON")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    question TEXT NOT NULL,
+                    answer TEXT NOT NULL,
+                    sources TEXT NOT NULL,
+                    metrics TEXT
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS message_sources (
+                    message_id INTEGER NOT NULL REFERENCES messages(id) ON DELETE CASCADE,
+                    file_name TEXT NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(question, answer)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id, id)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_message_sources_file ON message_sources(file_name, message_id)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_message_sources_message ON message_sources(message_id)")
+            self._migrate_legacy_history()
+        except Exception as e:
+            st.error(f"خطا در بارگذاری تاریخچه: {str(e)}")
     
-    def add_message(self, question: str, answer: str, sources: List[Dict] = None):
-        """افزودن پیام جدید به تاریخچه"""
+    def add_message(self, question: str, answer: str, sources: List[Dict] = None, metrics: Dict = None):
+        """افزودن پیام جدید به تاریخچه (metrics: زمان‌بندی پاسخ مانند زمان رسیدن اولین توکن)"""
         message = {
-            "id": len(self.messages) + 1,
             "timestamp": datetime.now().isoformat(),
             "question": question,
             "answer": answer,
-            "sources": sources or []
+            "sources": [self._source_ref(source) for source in sources or []]
         }
-        self.messages.append(message)
-        self.save_history()
+        if metrics:
+            message["metrics"] = metrics
+        
+        try:
+            with self._lock:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    self._insert(self.session_id, message)
+                    self._conn.execute("COMMIT")
+                except Exception:
+                    self._conn.execute("ROLLBACK")
+                    raise
+        except Exception as e:
+            st.error(f"خطا در ذخیره تاریخچه: {str(e)}")
+    
+    def count(self) -> int:
+        """تعداد پیام‌های نشست"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM messages WHERE session_id = ?", (self.session_id,)).fetchone()[0]
+    
+    def get_page(self, page: int = 0, page_size: int = 10) -> List[Dict[str, Any]]:
+        """دریافت یک صفحه از پیام‌های نشست از جدیدترین به قدیمی‌ترین (صفحه صفر = جدیدترین پیام‌ها)"""
+        return self._select("WHERE session_id = ? ORDER BY id DESC LIMIT ? OFFSET ?",
+                            (self.session_id, page_size, page * page_size))
     
     def get_messages(self) -> List[Dict[str, Any]]:
-        """دریافت تمام پیام‌ها"""
-        return self.messages
+        """دریافت تمام پیام‌های نشست (برای نمایش از get_page استفاده کنید)"""
+        return self._select("WHERE session_id = ? ORDER BY id", (self.session_id,))
     
-    def clear_history(self):
-        """پاک کردن تاریخچه"""
-        self.messages = []
-        self.save_history()
+    def search(self, query: str, file_name: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """جستجوی تمام‌متن در سؤال و پاسخ‌های نشست (اختیاری: فقط پیام‌هایی که از file_name استفاده کرده‌اند)
+
+        بدون query، جدیدترین پیام‌هایی که از file_name استفاده کرده‌اند برگردانده می‌شوند.
+        خروجی به ترتیب ارتباط (BM25) یا در نبود query از جدیدترین است.
+        """
+        terms = _WORD.findall(normalize_text(query or ""))
+        conditions = ["m.session_id = ?"]
+        params = [self.session_id]
+        joins = ""
+        order = "m.id DESC"
+        if terms:
+            joins = "JOIN messages_fts ON messages_fts.rowid = m.id"
+            conditions.append("messages_fts MATCH ?")
+            params.append(" ".join(f'"{term}"' for term in terms))
+            order = "bm25(messages_fts)"
+        if file_name:
+            conditions.append("m.id IN (SELECT message_id FROM message_sources WHERE file_name = ?)")
+            params.append(file_name)
+        if len(conditions) == 1:
+            return []
+        params.append(limit)
+        return self._select(f"{joins} WHERE {' AND '.join(conditions)} ORDER BY {order} LIMIT ?", params)
     
-    def save_history(self):
-        """ذخیره تاریخچه در فایل"""
-        try:
-            # اطمینان از وجود پوشه data
-            os.makedirs(os.path.dirname(self.history_file), exist_ok=True)
-            
-            with open(self.history_file, 'w', encoding='utf-8') as f:
-                json.dump(self.messages, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            st.error(f"خطا در ذخیره تاریخچه: {str(e)}")
+    def get_source_files(self) -> List[str]:
+        """نام فایل‌هایی که در پاسخ‌های نشست به عنوان منبع استفاده شده‌اند"""
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT DISTINCT s.file_name FROM message_sources s JOIN messages m ON m.id = s.message_id
+                WHERE m.session_id = ? ORDER BY s.file_name
+            """, (self.session_id,)).fetchall()
+        return [row[0] for row in rows]
     
-    def load_history(self) -> List[Dict[str, Any]]:
-        """بارگذاری تاریخچه از فایل"""
+    def clear_history(self):
+        """پاک کردن تاریخچه نشست"""
         try:
-            if os.path.exists(self.history_file):
-                with open(self.history_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            return []
+            with self._lock:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._conn.execute("DELETE FROM messages_fts WHERE rowid IN (SELECT id FROM messages WHERE session_id = ?)",
+                                   (self.session_id,))
+                self._conn.execute("DELETE FROM messages WHERE session_id = ?", (self.session_id,))
+                self._conn.execute("COMMIT")
         except Exception as e:
-            st.error(f"خطا در بارگذاری تاریخچه: {str(e)}")
-            return []
+            st.error(f"خطا در ذخیره تاریخچه: {str(e)}")
     
     def get_last_messages(self, count: int = 10) -> List[Dict[str, Any]]:
         """دریافت آخرین پیام‌ها"""
-        return self.messages[-count:] if len(self.messages) > count else self.messages
+        return list(reversed(self.get_page(0, count)))
     
     def format_timestamp(self, timestamp: str) -> str:
         """فرمت کردن زمان برای نمایش"""
@@ -64,4 +153,98 @@ class ChatHistory:
             dt = datetime.fromisoformat(timestamp)
             return dt.strftime("%Y/%m/%d - %H:%M")
         except:
-            return timestamp
\ No newline at end of file
+            return timestamp
+    
+    @staticmethod
+    def _source_ref(source: Dict) -> Dict:
+        """ارجاع به چانک منبع به جای متن کامل آن"""
+        metadata = source.get('metadata', source)
+        ref = {
+            'chunk_id': metadata.get('chunk_id'),
+            'file_name': metadata.get('file_name'),
+            'score': source.get('score')
+        }
+        for key in ('page_start', 'page_end'):
+            if key in metadata:
+                ref[key] = metadata[key]
+        return ref
+    
+    def _insert(self, session_id: str, message: Dict):
+        """درج یک پیام، فایل‌های منبع و متن قابل جستجوی آن (درون تراکنش فراخواننده)"""
+        cursor = self._conn.execute(
+            "INSERT INTO messages (session_id, timestamp, question, answer, sources, metrics) VALUES (?, ?, ?, ?, ?, ?)",
+            (session_id, message['timestamp'], message['question'], message['answer'],
+             json.dumps(message['sources'], ensure_ascii=False),
+             json.dumps(message['metrics'], ensure_ascii=False) if message.get('metrics') else None)
+        )
+        message_id = cursor.lastrowid
+        source_files = {source['file_name'] for source in message['sources'] if source.get('file_name')}
+        self._conn.executemany("INSERT INTO message_sources (message_id, file_name) VALUES (?, ?)",
+                               [(message_id, file_name) for file_name in source_files])
+        self._conn.execute("INSERT INTO messages_fts (rowid, question, answer) VALUES (?, ?, ?)",
+                           (message_id, normalize_text(message['question']), normalize_text(message['answer'])))
+    
+    def _select(self, clause: str, params) -> List[Dict[str, Any]]:
+        """خواندن پیام‌ها با شرط و ترتیب داده‌شده (جدول messages با نام مستعار m)"""
+        try:
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT m.id, m.timestamp, m.question, m.answer, m.sources, m.metrics FROM messages m {clause}",
+                    params
+                ).fetchall()
+        except Exception as e:
+            st.error(f"خطا در بارگذاری تاریخچه: {str(e)}")
+            return []
+        
+        messages = []
+        for message_id, timestamp, question, answer, sources, metrics in rows:
+            message = {
+                "id": message_id,
+                "timestamp": timestamp,
+                "question": question,
+                "answer": answer,
+                "sources": json.loads(sources)
+            }
+            if metrics:
+                message["metrics"] = json.loads(metrics)
+            messages.append(message)
+        return messages
+    
+    @staticmethod
+    def _read_legacy_messages(path: str) -> List[Dict]:
+        """خواندن پیام‌های قالب‌های قبلی: آرایه JSON یا JSON Lines (خط ناقص انتهایی نادیده گرفته می‌شود)"""
+        with open(path, 'r', encoding='utf-8') as f:
+            if path.endswith(".json"):
+                return json.load(f)
+            return [json.loads(line) for line in f if line.endswith("\n") and line.strip()]
+    
+    def _migrate_legacy_history(self):
+        """انتقال یک‌باره تاریخچه قالب‌های قبلی به نشست پیش‌فرض"""
+        base_path = os.path.splitext(self.history_file)[0]
+        for legacy_file in (base_path + ".json", base_path + ".jsonl"):
+            if not os.path.exists(legacy_file):
+                continue
+            with self._lock:
+                self._conn.execute("BEGIN IMMEDIATE")
+                # ممکن است نشست دیگری هم‌زمان انتقال را انجام داده باشد
+                if not os.path.exists(legacy_file):
+                    self._conn.execute("ROLLBACK")
+                    continue
+                try:
+                    for message in self._read_legacy_messages(legacy_file):
+                        self._insert(DEFAULT_SESSION, {
+                            'timestamp': message.get('timestamp', datetime.now().isoformat()),
+                            'question': message.get('question', ''),
+                            'answer': message.get('answer', ''),
+                            'sources': [self._source_ref(source) for source in message.get('sources', [])],
+                            'metrics': message.get('metrics')
+                        })
+                    os.replace(legacy_file, legacy_file + ".migrated")
+                    self._conn.execute("COMMIT")
+                except Exception:
+                    self._conn.execute("ROLLBACK")
+                    if os.path.exists(legacy_file + ".migrated") and not os.path.exists(legacy_file):
+                        os.replace(legacy_file + ".migrated", legacy_file)
+                    raise
+            if legacy_file.endswith(".jsonl") and os.path.exists(base_path + ".idx"):
+                os.remove(base_path + ".idx")
\ No newline at end of file
@@ -0,0 +1,153 @@
+import os
+from typing import List, Dict, Tuple, Optional, Callable
+
+# دو چانک از یک فایل که فاصله آن‌ها در متن سند حداکثر این تعداد کاراکتر (فاصله و خط جدید) باشد مجاور هستند
+_ADJACENT_GAP = 5
+
+class ContextBuilder:
+    """ساخت متن مرجع پرامپت از نتایج جستجو در محدوده بودجه توکن
+
+    نتایج با شباهت برداری کمتر از `min_score` کنار گذاشته می‌شوند، مگر اینکه در جستجوی واژگانی
+    یافت شده باشند (نتیجه اول همیشه نگه داشته می‌شود).
+    چانک‌های یک فایل که در متن سند هم‌پوشانی دارند یا مجاور هستند در یک بخش ادغام می‌شوند و
+    متن تکراری ناحیه هم‌پوشانی فقط یک‌بار می‌آید. سپس بخش‌ها به ترتیب رتبه نتایج ورودی (رتبه جستجو
+    یا بازچینی) تا سقف `max_tokens`
+    در متن مرجع قرار می‌گیرند و تعداد توکن‌های صرفه‌جویی‌شده نسبت به الحاق ساده نتایج گزارش می‌شود.
+    """
+    
+    def __init__(self, count_tokens: Optional[Callable[[str], int]] = None, max_tokens: Optional[int] = None,
+                 min_score: Optional[float] = None):
+        # شمارنده توکن (مثلاً DocumentProcessor.count_tokens)؛ در نبود آن تعداد توکن از طول متن تخمین زده می‌شود
+        self.count_tokens = count_tokens or (lambda text: len(text) // 3)
+        self.max_tokens = max_tokens or int(os.getenv("CONTEXT_MAX_TOKENS", "2000"))
+        self.min_score = min_score if min_score is not None else float(os.getenv("CONTEXT_MIN_SCORE", "0.2"))
+        self.separator = "\n\n"
+    
+    def build(self, results: List[Dict]) -> Tuple[str, List[Dict], Dict]:
+        """ساخت متن مرجع از نتایج جستجو
+
+        خروجی: (متن مرجع، نتایجی که در متن مرجع استفاده شده‌اند، آمار)
+        آمار شامل hits، dropped_low_score، merged، dropped_budget، truncated، tokens، naive_tokens و tokens_saved است.
+        """
+        stats = {
+            'hits': len(results),
+            'dropped_low_score': 0,
+            'merged': 0,
+            'dropped_budget': 0,
+            'truncated': 0,
+            'tokens': 0,
+            'naive_tokens': self.count_tokens(self.separator.join(result['text'] for result in results)) if results else 0,
+            'tokens_saved': 0
+        }
+        passages = self.merge(results, stats)
+        
+        separator_tokens = self.count_tokens(self.separator)
+        selected = []
+        used_tokens = 0
+        for passage in passages:
+            budget = self.max_tokens - used_tokens - (separator_tokens if selected else 0)
+            if budget <= 0:
+                stats['dropped_budget'] += 1
+                continue
+            
+            text = passage['text']
+            token_count = self.count_tokens(text)
+            if token_count > budget:
+                if selected:
+                    # بخش‌های کوچک‌تر بعدی ممکن است هنوز در بودجه جا شوند
+                    stats['dropped_budget'] += 1
+                    continue
+                # مرتبط‌ترین بخش حتی اگر از بودجه بزرگ‌تر باشد کوتاه شده و نگه داشته می‌شود
+                text, token_count = self._truncate(text, budget)
+                stats['truncated'] += 1
+            
+            selected.append((text, passage))
+            used_tokens += token_count + (separator_tokens if len(selected) > 1 else 0)
+        
+        context = self.separator.join(text for text, _ in selected)
+        used_results = [result for _, passage in selected for result in passage['results']]
+        stats['tokens'] = self.count_tokens(context) if context else 0
+        stats['tokens_saved'] = max(0, stats['naive_tokens'] - stats['tokens'])
+        return context, used_results, stats
+    
+    def merge(self, results: List[Dict], stats: Optional[Dict] = None) -> List[Dict]:
+        """حذف نتایج کم‌امتیاز و ادغام چانک‌های هم‌پوشان یا مجاور هر فایل
+
+        خروجی: لیست بخش‌ها {'text', 'score', 'results'} به ترتیب بهترین رتبه نتایج هر بخش در ورودی
+        """
+        if not results:
+            return []
+        kept = [(rank, result) for rank, result in enumerate(results) if rank == 0 or self._passes_cutoff(result)]
+        if stats is not None:
+            stats['dropped_low_score'] = len(results) - len(kept)
+        
+        # چانک‌های قدیمی بازه کاراکتر ندارند و جداگانه باقی می‌مانند
+        by_file = {}
+        passages = []
+        for rank, result in kept:
+            metadata = result['metadata']
+            if 'char_start' in metadata and 'char_end' in metadata:
+                by_file.setdefault(metadata['file_name'], []).append((rank, result))
+            else:
+                passages.append({'text': result['text'], 'score': result['score'], 'rank': rank, 'results': [result]})
+        
+        for file_results in by_file.values():
+            file_results.sort(key=lambda item: (item[1]['metadata']['char_start'], item[1]['metadata']['char_end']))
+            current = None
+            for rank, result in file_results:
+                metadata = result['metadata']
+                if current is not None and metadata['char_start'] <= current['char_end'] + _ADJACENT_GAP:
+                    if metadata['char_end'] > current['char_end']:
+                        current['text'] = self._join_overlapping(current['text'], result['text'])
+                        current['char_end'] = metadata['char_end']
+                    current['score'] = max(current['score'], result['score'])
+                    current['rank'] = min(current['rank'], rank)
+                    current['results'].append(result)
+                    if stats is not None:
+                        stats['merged'] += 1
+                    continue
+                
+                if current is not None:
+                    passages.append(current)
+                current = {
+                    'text': result['text'],
+                    'score': result['score'],
+                    'rank': rank,
+                    'results': [result],
+                    'char_end': metadata['char_end']
+                }
+            passages.append(current)
+        
+        passages.sort(key=lambda passage: passage['rank'])
+        return [{'text': p['text'], 'score': p['score'], 'results': p['results']} for p in passages]
+    
+    def _passes_cutoff(self, result: Dict) -> bool:
+        """آیا نتیجه به اندازه کافی مرتبط است (در جستجوی ترکیبی، امتیاز شباهت برداری جداگانه برگردانده می‌شود)"""
+        if result.get('lexical_score'):
+            return True
+        return result.get('dense_score', result['score']) >= self.min_score
+    
+    @staticmethod
+    def _join_overlapping(first: str, second: str) -> str:
+        """الحاق دو متن با حذف طولانی‌ترین انتهای متن اول که ابتدای متن دوم است (در سطح کلمه)"""
+        first_words = first.split()
+        second_words = second.split()
+        if second_words:
+            for i, word in enumerate(first_words):
+                if word == second_words[0] and first_words[i:] == second_words[:len(first_words) - i]:
+                    return " ".join(first_words + second_words[len(first_words) - i:])
+        return " ".join(first_words + second_words)
+    
+    def _truncate(self, text: str, budget: int) -> Tuple[str, int]:
+        """کوتاه کردن متن در مرز کلمه تا حداکثر budget توکن؛ خروجی: (متن، تعداد توکن)"""
+        words = text.split()
+        low, high = 0, len(words)
+        # جستجوی دودویی بیشترین تعداد کلمه‌ای که در بودجه جا می‌شود
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count_tokens(" ".join(words[:middle])) <= budget:
+                low = middle
+            else:
+                high = middle - 1
+        truncated = " ".join(words[:low])
+        return truncated, self.count_tokens(truncated) if truncated else 0
\ No newline at end of file
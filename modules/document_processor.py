@@ -1,35 +1,204 @@
+import os
+import re
 import fitz  # PyMuPDF
-from typing import List
-import streamlit as st
+from collections import deque
+from typing import List, Dict, Tuple, Iterable, Iterator, Optional
+
+CHUNK_MODES = ('words', 'tokens')
+
+# مرز جمله (پس از علامت پایان جمله) یا پاراگراف (خط خالی)
+_SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?؟])\s+|\n\s*\n')
 
 class DocumentProcessor:
-    """کلاس پردازش اسناد PDF"""
+    """کلاس پردازش اسناد PDF
+
+    متن فایل به صورت صفحه به صفحه خوانده و به صورت افزایشی چانک می‌شود؛ در هر لحظه فقط
+    یک صفحه و کلمات یک چانک در حافظه هستند. متادیتای هر چانک شامل شماره صفحه شروع و پایان
+    و بازه کاراکترهای آن در متن کامل سند است.
+
+    در حالت `words` چانک‌ها پنجره‌های ثابت کلمه هستند. در حالت `tokens` طول چانک‌ها با توکنایزر
+    خود مدل embedding اندازه‌گیری می‌شود تا از سقف ورودی مدل بیشتر نشوند و چانک‌ها تا حد امکان
+    در مرز جمله و پاراگراف بسته می‌شوند. در صورت وجود توکنایزر، در هر دو حالت مقدار متنی که مدل
+    به دلیل سقف ورودی نادیده می‌گیرد در آمار چانک‌ها گزارش می‌شود.
+    """
     
-    def __init__(self):
+    def __init__(self, tokenizer=None, model_max_tokens: Optional[int] = None, chunk_mode: Optional[str] = None):
         self.chunk_size = 500
         self.chunk_overlap = 50
+        
+        self.tokenizer = tokenizer
+        # سقف توکن ورودی مدل embedding (بدون توکن‌های ویژه ابتدا و انتها)
+        self.model_max_tokens = model_max_tokens
+        self.chunk_mode = (chunk_mode or os.getenv("CHUNK_MODE", "words")).lower()
+        if self.chunk_mode not in CHUNK_MODES:
+            raise ValueError(f"حالت چانک نامعتبر است: {self.chunk_mode}")
+        if self.chunk_mode == 'tokens' and tokenizer is None:
+            raise ValueError("حالت چانک tokens به توکنایزر مدل embedding نیاز دارد")
+        self.max_tokens = int(os.getenv("CHUNK_MAX_TOKENS", "0")) or model_max_tokens or 256
+        self.overlap_tokens = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+        # چانک در پایان پاراگراف بسته می‌شود اگر دست‌کم این نسبت از سقف توکن پر شده باشد
+        self.paragraph_min_fill = 0.5
+    
+    def iter_pages(self, pdf_path: str) -> Iterator[Tuple[int, str]]:
+        """خواندن صفحه به صفحه فایل PDF؛ خروجی: (شماره صفحه از ۱، متن صفحه)
+
+        خطای خواندن (حتی پس از صفحات اول) به فراخواننده منتقل می‌شود تا سند ناقص ایندکس‌شده ثبت نشود.
+        """
+        with fitz.open(pdf_path) as doc:
+            for page_number, page in enumerate(doc, 1):
+                yield page_number, page.get_text()
     
     def extract_text_from_pdf(self, pdf_path: str) -> str:
         """استخراج متن از فایل PDF"""
-        try:
-            doc = fitz.open(pdf_path)
-            text = ""
-            for page in doc:
-                text += page.get_text()
-            doc.close()
-            return text
-        except Exception as e:
-            st.error(f"خطا در خواندن فایل PDF: {str(e)}")
-            return ""
+        return "".join(text for _, text in self.iter_pages(pdf_path))
     
-    def chunk_text(self, text: str) -> List[str]:
-        """تقسیم متن به چانک‌های کوچک"""
-        words = text.split()
-        chunks = []
+    def iter_chunks(self, pages: Iterable[Tuple[int, str]], stats: Optional[Dict] = None) -> Iterator[Tuple[str, Dict]]:
+        """تقسیم افزایشی صفحات به چانک‌های کوچک
+
+        خروجی: (متن چانک، متادیتا شامل page_start، page_end، char_start و char_end)
+        بازه کاراکترها نسبت به متن کامل سند (الحاق متن صفحات) است.
+        اگر stats داده شود، آمار توکن‌ها و توکن‌های بریده‌شده توسط مدل در آن جمع می‌شود.
+        """
+        chunks = self._iter_token_chunks(pages) if self.chunk_mode == 'tokens' else self._iter_word_chunks(pages)
+        if stats is None or self.tokenizer is None:
+            yield from chunks
+            return
+        
+        for stat_key in ('tokens', 'truncated_tokens', 'truncated_chunks'):
+            stats.setdefault(stat_key, 0)
+        limit = self.model_max_tokens or self.max_tokens
+        for chunk, metadata in chunks:
+            token_count = self.count_tokens(chunk)
+            stats['tokens'] += token_count
+            if token_count > limit:
+                stats['truncated_tokens'] += token_count - limit
+                stats['truncated_chunks'] += 1
+            yield chunk, metadata
+    
+    def count_tokens(self, text: str) -> int:
+        """تعداد توکن‌های متن با توکنایزر مدل embedding"""
+        return len(self.tokenizer(text, add_special_tokens=False)['input_ids'])
+    
+    def _iter_word_chunks(self, pages: Iterable[Tuple[int, str]]) -> Iterator[Tuple[str, Dict]]:
+        """چانک‌های پنجره ثابت کلمه (chunk_size کلمه با chunk_overlap کلمه همپوشانی)"""
+        step = self.chunk_size - self.chunk_overlap
+        words = deque()  # (کلمه، شماره صفحه، شروع، پایان)
+        offset = 0
         
-        for i in range(0, len(words), self.chunk_size - self.chunk_overlap):
-            chunk = " ".join(words[i:i + self.chunk_size])
-            if chunk.strip():
-                chunks.append(chunk)
+        for page_number, page_text in pages:
+            for match in re.finditer(r'\S+', page_text):
+                words.append((match.group(), page_number, offset + match.start(), offset + match.end()))
+                if len(words) >= self.chunk_size:
+                    yield self._make_chunk(words)
+                    for _ in range(step):
+                        words.popleft()
+            offset += len(page_text)
         
-        return chunks
\ No newline at end of file
+        # چانک‌های انتهایی (مانند حالت غیرافزایشی، از هر گام یک چانک ساخته می‌شود)
+        while words:
+            yield self._make_chunk(words)
+            for _ in range(min(step, len(words))):
+                words.popleft()
+    
+    def _iter_token_chunks(self, pages: Iterable[Tuple[int, str]]) -> Iterator[Tuple[str, Dict]]:
+        """چانک‌های محدود به max_tokens توکن مدل که در مرز جمله و پاراگراف بسته می‌شوند"""
+        units = deque()  # (متن، تعداد توکن، شماره صفحه، شروع، پایان)
+        unit_tokens = 0
+        offset = 0
+        
+        for page_number, page_text in pages:
+            for text, token_count, start, end, ends_paragraph in self._iter_units(page_text):
+                if units and unit_tokens + token_count > self.max_tokens:
+                    yield self._make_token_chunk(units)
+                    unit_tokens = self._keep_overlap(units, self.max_tokens - token_count)
+                
+                units.append((text, token_count, page_number, offset + start, offset + end))
+                unit_tokens += token_count
+                
+                if ends_paragraph and unit_tokens >= self.max_tokens * self.paragraph_min_fill:
+                    # پاراگراف جدید بدون همپوشانی از چانک جدید شروع می‌شود
+                    yield self._make_token_chunk(units)
+                    units.clear()
+                    unit_tokens = 0
+            offset += len(page_text)
+        
+        if units:
+            yield self._make_token_chunk(units)
+    
+    def _iter_units(self, text: str) -> Iterator[Tuple[str, int, int, int, bool]]:
+        """تقسیم متن یک صفحه به جمله‌ها؛ جمله‌های طولانی‌تر از max_tokens در مرز توکن شکسته می‌شوند
+
+        خروجی: (متن، تعداد توکن، شروع، پایان، آیا پاراگراف تمام می‌شود)
+        """
+        spans = []
+        position = 0
+        for match in _SENTENCE_BOUNDARY.finditer(text):
+            spans.append((position, match.start(), match.group().count('\n') >= 2))
+            position = match.end()
+        spans.append((position, len(text), False))
+        
+        for start, end, ends_paragraph in spans:
+            sentence = text[start:end]
+            stripped = sentence.strip()
+            if not stripped:
+                continue
+            start += len(sentence) - len(sentence.lstrip())
+            end = start + len(stripped)
+            
+            encoding = self.tokenizer(stripped, add_special_tokens=False, return_offsets_mapping=True)
+            offsets = encoding['offset_mapping']
+            if len(offsets) <= self.max_tokens:
+                yield stripped, len(offsets), start, end, ends_paragraph
+                continue
+            
+            for piece_start in range(0, len(offsets), self.max_tokens):
+                piece_offsets = offsets[piece_start:piece_start + self.max_tokens]
+                is_last = piece_start + self.max_tokens >= len(offsets)
+                # تکه تا ابتدای توکن بعدی ادامه می‌یابد تا هیچ کاراکتری از قلم نیفتد
+                char_start = piece_offsets[0][0] if piece_start else 0
+                char_end = len(stripped) if is_last else offsets[piece_start + self.max_tokens][0]
+                piece = stripped[char_start:char_end].strip()
+                if piece:
+                    yield piece, len(piece_offsets), start + char_start, start + char_start + len(piece), ends_paragraph and is_last
+    
+    def _keep_overlap(self, units: deque, budget: int) -> int:
+        """نگه داشتن جمله‌های انتهایی چانک قبلی به اندازه overlap_tokens برای همپوشانی
+
+        خروجی: تعداد توکن‌های باقی‌مانده
+        """
+        budget = min(self.overlap_tokens, budget)
+        kept_tokens = 0
+        kept = 0
+        for unit in reversed(units):
+            if kept_tokens + unit[1] > budget:
+                break
+            kept_tokens += unit[1]
+            kept += 1
+        for _ in range(len(units) - kept):
+            units.popleft()
+        return kept_tokens
+    
+    def _make_token_chunk(self, units: deque) -> Tuple[str, Dict]:
+        """ساخت یک چانک از جمله‌های صف"""
+        metadata = {
+            'page_start': units[0][2],
+            'page_end': units[-1][2],
+            'char_start': units[0][3],
+            'char_end': units[-1][4]
+        }
+        return " ".join(unit[0] for unit in units), metadata
+    
+    def chunk_text(self, text: str) -> List[str]:
+        """تقسیم متن به چانک‌های کوچک"""
+        return [chunk for chunk, _ in self.iter_chunks([(1, text)])]
+    
+    def _make_chunk(self, words: deque) -> Tuple[str, Dict]:
+        """ساخت یک چانک از ابتدای صف کلمات"""
+        chunk_words = [words[i] for i in range(min(self.chunk_size, len(words)))]
+        metadata = {
+            'page_start': chunk_words[0][1],
+            'page_end': chunk_words[-1][1],
+            'char_start': chunk_words[0][2],
+            'char_end': chunk_words[-1][3]
+        }
+        return " ".join(word for word, _, _, _ in chunk_words), metadata
\ No newline at end of file
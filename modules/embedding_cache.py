@@ -0,0 +1,101 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from typing import List, Dict, Optional
+
+class EmbeddingCache:
+    """کش پایدار embedding بر اساس محتوای چانک
+
+    کلید هر ورودی هش SHA-256 نام مدل و متن چانک است؛ بنابراین متن تکراری (بارگذاری مجدد،
+    نسخه‌های مشابه یک گزارش یا سربرگ و پاورقی‌های تکراری) هرگز دوباره به مدل داده نمی‌شود.
+    تعداد ورودی‌ها محدود است و قدیمی‌ترین ورودی‌ها (LRU) حذف می‌شوند.
+    """
+    
+    def __init__(self, cache_path: str = "data/embedding_cache.sqlite", model_name: str = "",
+                 max_entries: Optional[int] = None):
+        self.cache_path = cache_path
+        self.model_name = model_name
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "500000"))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+    
+    def make_key(self, text: str) -> str:
+        """کلید کش برای یک متن"""
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode('utf-8')).hexdigest()
+    
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """خواندن embedding چند کلید؛ فقط کلیدهای موجود در خروجی هستند"""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                for key, vector in self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ):
+                    found[key] = np.frombuffer(vector, dtype='float32')
+            
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                       [(now, key) for key in found])
+                self._conn.commit()
+            
+            hit_count = sum(1 for key in keys if key in found)
+            self.hits += hit_count
+            self.misses += len(keys) - hit_count
+        return found
+    
+    def put_many(self, keys: List[str], vectors: np.ndarray):
+        """ذخیره embedding چند کلید و حذف قدیمی‌ترین ورودی‌ها در صورت عبور از سقف"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, np.ascontiguousarray(vector, dtype='float32').tobytes(), now) for key, vector in zip(keys, vectors)]
+            )
+            self._evict()
+            self._conn.commit()
+    
+    def get_stats(self) -> Dict:
+        """آمار استفاده از کش از زمان شروع برنامه"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                'entries': entries,
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0
+            }
+    
+    def _evict(self):
+        """حذف قدیمی‌ترین ورودی‌ها تا ۹۰٪ سقف، تا هزینه حذف بین چند نوشتن پخش شود"""
+        entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if entries <= self.max_entries:
+            return
+        excess = entries - int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+            (excess,)
+        )
\ No newline at end of file
@@ -1,13 +1,30 @@
 import os
+import json
 import uuid
+import hashlib
+import threading
+from datetime import datetime
 import streamlit as st
-from typing import List, Tuple, Optional
+from typing import List, Tuple, Optional, Dict
+
+# manifest بین تمام نشست‌های یک پروسه مشترک است؛ خواندن و نوشتن آن با این قفل انجام می‌شود
+_manifest_lock = threading.Lock()
 
 class FileManager:
-    """کلاس مدیریت فایل‌ها"""
+    """کلاس مدیریت فایل‌ها
+    
+    هر فایل آپلودشده با هش SHA-256 محتوایش شناسایی می‌شود و در `file_manifest.json` ثبت می‌گردد.
+    آپلود مجدد فایلی که قبلاً پردازش شده، بدون ذخیره، استخراج و embedding دوباره به همان فایل ارجاع داده می‌شود.
+    """
     
-    def __init__(self, data_dir: str = "data"):
+    def __init__(self, data_dir: str = "data", response_cache=None, semantic_cache=None, vector_db=None):
         self.data_dir = data_dir
+        # کش پاسخ‌های مدل زبانی و کش معنایی پرسش‌ها؛ با حذف فایل، پاسخ‌های مبتنی بر آن نامعتبر می‌شوند
+        self.response_cache = response_cache
+        self.semantic_cache = semantic_cache
+        # پایگاه داده برداری؛ فایل‌های ثبت‌شده از خط فرمان یا بسته ایندکس فقط در آن (و نه در پوشه data) وجود دارند
+        self.vector_db = vector_db
+        self.manifest_path = os.path.join(data_dir, "file_manifest.json")
         self._ensure_data_dir()
     
     def _ensure_data_dir(self):
@@ -26,29 +43,160 @@ class FileManager:
                 files.append(file)
         return files
     
-    def save_uploaded_file(self, uploaded_file) -> Tuple[Optional[str], Optional[str]]:
-        """ذخیره فایل آپلودشده"""
+    @staticmethod
+    def compute_file_hash(content) -> str:
+        """محاسبه هش SHA-256 محتوای فایل"""
+        return hashlib.sha256(content).hexdigest()
+    
+    @staticmethod
+    def compute_path_hash(file_path: str) -> str:
+        """محاسبه هش SHA-256 یک فایل روی دیسک بدون خواندن کامل آن در حافظه"""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+    
+    def register_local_files(self, files: List[Tuple[str, str]]) -> List[Tuple[str, bool]]:
+        """ثبت فایل‌های موجود روی دیسک بدون کپی در پوشه data (برای پردازش گروهی از خط فرمان)
+
+        files: لیست (مسیر فایل، نام فایل در پایگاه داده)؛ manifest برای کل لیست یک‌بار نوشته می‌شود.
+        خروجی برای هر فایل: (نام فایل در پایگاه داده، آیا همین محتوا قبلاً پردازش شده است)؛
+        اگر محتوای فایل قبلاً با نام دیگری ثبت شده باشد، همان نام قبلی برگردانده می‌شود.
+        """
+        hashes = [self.compute_path_hash(file_path) for file_path, _ in files]
+        results = []
+        with _manifest_lock:
+            manifest = self._load_manifest()
+            hash_by_name = {entry['file_name']: content_hash for content_hash, entry in manifest.items()}
+            for (file_path, file_name), content_hash in zip(files, hashes):
+                entry = manifest.get(content_hash)
+                if entry and entry.get('ingested'):
+                    results.append((entry['file_name'], True))
+                    continue
+                if entry:
+                    # ثبت قبلی نیمه‌تمام مانده است؛ با همان نام دوباره پردازش می‌شود
+                    file_name = entry['file_name']
+                elif hash_by_name.get(file_name) in manifest:
+                    # محتوای فایل تغییر کرده است؛ چانک‌های نسخه قبلی هنگام ایندکس شدن جایگزین می‌شوند
+                    del manifest[hash_by_name[file_name]]
+                hash_by_name[file_name] = content_hash
+                file_stat = os.stat(file_path)
+                manifest[content_hash] = {
+                    'file_name': file_name,
+                    'original_name': os.path.basename(file_path),
+                    'size': file_stat.st_size,
+                    'uploaded_at': datetime.now().isoformat(),
+                    'ingested': False,
+                    'source_path': os.path.abspath(file_path),
+                    'source_mtime': file_stat.st_mtime
+                }
+                results.append((file_name, False))
+            self._save_manifest(manifest)
+        return results
+    
+    def get_local_sources(self) -> Dict[str, Dict]:
+        """نگاشت مسیر فایل‌های ثبت‌شده از خط فرمان به اطلاعات آن‌ها در manifest"""
+        with _manifest_lock:
+            manifest = self._load_manifest()
+        return {entry['source_path']: entry for entry in manifest.values() if 'source_path' in entry}
+    
+    def get_manifest(self) -> Dict[str, Dict]:
+        """manifest فایل‌ها (نگاشت هش محتوا به اطلاعات فایل)"""
+        with _manifest_lock:
+            return self._load_manifest()
+    
+    def install_manifest(self, entries: Dict[str, Dict]):
+        """جایگزینی manifest با manifest بسته ایندکس
+
+        چانک‌های فایل‌های قبلی که در بسته نیستند همراه با پایگاه داده برداری قبلی حذف شده‌اند؛
+        این فایل‌ها در manifest می‌مانند اما پردازش‌نشده علامت می‌خورند تا آپلود مجدد آن‌ها را دوباره ایندکس کند.
+        """
+        with _manifest_lock:
+            manifest = self._load_manifest()
+            for entry in manifest.values():
+                entry['ingested'] = False
+                entry.pop('ingested_at', None)
+            manifest.update(entries)
+            self._save_manifest(manifest)
+    
+    def save_uploaded_file(self, uploaded_file) -> Tuple[Optional[str], Optional[str], bool]:
+        """ذخیره فایل آپلودشده
+        
+        خروجی: (نام یونیک فایل، مسیر فایل، آیا فایل قبلاً پردازش شده است)
+        اگر محتوای فایل قبلاً پردازش شده باشد، فایل جدیدی ذخیره نمی‌شود و همان فایل قبلی برگردانده می‌شود.
+        """
         try:
-            # ایجاد نام یونیک برای فایل
-            file_id = str(uuid.uuid4())[:8]
-            file_extension = uploaded_file.name.split('.')[-1]
-            unique_filename = f"{file_id}_{uploaded_file.name}"
-            file_path = os.path.join(self.data_dir, unique_filename)
+            content = uploaded_file.getbuffer()
+            content_hash = self.compute_file_hash(content)
             
-            with open(file_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
+            with _manifest_lock:
+                manifest = self._load_manifest()
+                entry = manifest.get(content_hash)
+                if entry and os.path.exists(os.path.join(self.data_dir, entry['file_name'])):
+                    file_path = os.path.join(self.data_dir, entry['file_name'])
+                    # فایل قبلاً ذخیره شده است؛ اگر پردازش آن کامل نشده بود، دوباره پردازش می‌شود
+                    return entry['file_name'], file_path, bool(entry.get('ingested'))
+                if entry and entry.get('ingested') and self._is_indexed(entry['file_name']):
+                    # فایل از خط فرمان یا بسته ایندکس پردازش شده و در پوشه data کپی نشده است
+                    return entry['file_name'], entry.get('source_path'), True
+                
+                # ایجاد نام یونیک برای فایل
+                file_id = str(uuid.uuid4())[:8]
+                unique_filename = f"{file_id}_{uploaded_file.name}"
+                file_path = os.path.join(self.data_dir, unique_filename)
+                
+                with open(file_path, "wb") as f:
+                    f.write(content)
+                
+                manifest[content_hash] = {
+                    'file_name': unique_filename,
+                    'original_name': uploaded_file.name,
+                    'size': len(content),
+                    'uploaded_at': datetime.now().isoformat(),
+                    'ingested': False
+                }
+                self._save_manifest(manifest)
             
-            return unique_filename, file_path
+            return unique_filename, file_path, False
         except Exception as e:
             st.error(f"خطا در ذخیره فایل: {str(e)}")
-            return None, None
+            return None, None, False
+    
+    def mark_ingested(self, filename: str):
+        """ثبت پایان موفق پردازش و ایندکس شدن یک فایل در manifest"""
+        self.mark_ingested_files([filename])
+    
+    def mark_ingested_files(self, filenames: List[str]):
+        """ثبت پایان پردازش چند فایل با یک‌بار نوشتن manifest"""
+        filenames = set(filenames)
+        if not filenames:
+            return
+        with _manifest_lock:
+            manifest = self._load_manifest()
+            for entry in manifest.values():
+                if entry['file_name'] in filenames:
+                    entry['ingested'] = True
+                    entry['ingested_at'] = datetime.now().isoformat()
+            self._save_manifest(manifest)
     
     def delete_file(self, filename: str) -> bool:
-        """حذف فایل"""
+        """حذف فایل
+
+        خروجی True یعنی فایل (در پوشه data، manifest یا پایگاه داده برداری) وجود داشت و چانک‌های آن باید حذف شوند.
+        """
         try:
             file_path = os.path.join(self.data_dir, filename)
-            if os.path.exists(file_path):
+            # فایل‌های ثبت‌شده از خط فرمان یا بسته ایندکس در پوشه data کپی نشده‌اند و فقط در manifest یا پایگاه داده هستند
+            removed = os.path.exists(file_path)
+            if removed:
                 os.remove(file_path)
+            forgotten = self._forget_file(filename)
+            if forgotten or removed or self._is_indexed(filename):
+                if self.response_cache is not None:
+                    self.response_cache.invalidate_file(filename)
+                if self.semantic_cache is not None:
+                    self.semantic_cache.invalidate_file(filename)
                 return True
             return False
         except Exception as e:
@@ -63,4 +211,32 @@ class FileManager:
             for f in uploaded_files 
             if os.path.exists(os.path.join(self.data_dir, f))
         )
-        return total_size / 1024 / 1024  # تبدیل به مگابایت
\ No newline at end of file
+        return total_size / 1024 / 1024  # تبدیل به مگابایت
+    
+    def _is_indexed(self, filename: str) -> bool:
+        """آیا فایل چانک زنده در پایگاه داده برداری دارد (بدون پایگاه داده برداری: False)"""
+        return self.vector_db is not None and filename in self.vector_db.get_file_names()
+    
+    def _forget_file(self, filename: str) -> bool:
+        """حذف فایل از manifest؛ خروجی: آیا فایل در manifest بود"""
+        with _manifest_lock:
+            manifest = self._load_manifest()
+            remaining = {h: entry for h, entry in manifest.items() if entry['file_name'] != filename}
+            if len(remaining) != len(manifest):
+                self._save_manifest(remaining)
+                return True
+            return False
+    
+    def _load_manifest(self) -> Dict[str, Dict]:
+        """خواندن manifest فایل‌ها (نگاشت هش محتوا به اطلاعات فایل)"""
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    def _save_manifest(self, manifest: Dict[str, Dict]):
+        """نوشتن اتمیک manifest فایل‌ها"""
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
\ No newline at end of file
@@ -0,0 +1,129 @@
+import os
+import time
+import random
+import threading
+import requests
+from collections import deque
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from requests.adapters import HTTPAdapter
+from typing import Dict, Any, Optional
+
+# کدهای وضعیتی که خطای موقت محسوب می‌شوند و درخواست دوباره ارسال می‌شود
+RETRY_STATUSES = (408, 425, 429, 500, 502, 503, 504)
+
+class HTTPTransport:
+    """ارسال درخواست HTTP با اتصال‌های ماندگار و تلاش مجدد
+
+    یک `requests.Session` با مخزن اتصال بین تمام نشست‌ها به اشتراک گذاشته می‌شود تا هر درخواست
+    هزینه اتصال TCP و TLS جدید را نپردازد. خطاهای موقت (۴۲۹، ۵xx، قطع اتصال و timeout) با
+    تأخیر نمایی تصادفی (jitter) دوباره امتحان می‌شوند و هدر Retry-After رعایت می‌شود.
+    زمان هر تلاش برای هر برچسب (مثلاً نام مدل) ثبت می‌شود.
+    """
+    
+    def __init__(self):
+        self.connect_timeout = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+        self.read_timeout = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+        self.max_retries = int(os.getenv("LLM_MAX_RETRIES", "3"))
+        self.backoff_base = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+        self.backoff_max = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+        self.retry_after_max = float(os.getenv("LLM_RETRY_AFTER_MAX", "30"))
+        pool_size = int(os.getenv("LLM_POOL_SIZE", "20"))
+        
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        
+        self._lock = threading.Lock()
+        self._stats = {}
+    
+    def post(self, url: str, headers: Dict[str, str], json_body: Dict[str, Any], stream: bool = False,
+             label: str = "") -> requests.Response:
+        """ارسال درخواست POST با تلاش مجدد برای خطاهای موقت
+
+        خروجی پاسخ موفق است؛ اگر همه تلاش‌ها ناموفق باشند، خطای آخرین تلاش (RequestException) رخ می‌دهد.
+        """
+        for attempt in range(self.max_retries + 1):
+            is_last = attempt == self.max_retries
+            start_time = time.perf_counter()
+            try:
+                response = self.session.post(url, headers=headers, json=json_body, stream=stream,
+                                             timeout=(self.connect_timeout, self.read_timeout))
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self._record(label, time.perf_counter() - start_time, None, attempt)
+                if is_last:
+                    raise
+                time.sleep(self._backoff_delay(attempt))
+                continue
+            
+            self._record(label, time.perf_counter() - start_time, response.status_code, attempt)
+            if response.status_code in RETRY_STATUSES and not is_last:
+                delay = self._retry_after_delay(response)
+                if delay is None:
+                    delay = self._backoff_delay(attempt)
+                response.close()
+                time.sleep(delay)
+                continue
+            
+            response.raise_for_status()
+            return response
+    
+    def get_stats(self) -> Dict[str, Dict]:
+        """آمار تلاش‌ها و زمان پاسخ به تفکیک برچسب"""
+        with self._lock:
+            stats = {}
+            for label, entry in self._stats.items():
+                latencies = sorted(entry['latencies'])
+                stats[label] = {
+                    'attempts': entry['attempts'],
+                    'retries': entry['retries'],
+                    'errors': entry['errors'],
+                    'mean_latency': sum(latencies) / len(latencies) if latencies else 0.0,
+                    'p95_latency': latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0
+                }
+            return stats
+    
+    def _record(self, label: str, latency: float, status: Optional[int], attempt: int):
+        """ثبت زمان و نتیجه یک تلاش (status=None یعنی خطای اتصال یا timeout)"""
+        with self._lock:
+            entry = self._stats.setdefault(label, {
+                'attempts': 0, 'retries': 0, 'errors': 0,
+                'latencies': deque(maxlen=1000)  # زمان آخرین تلاش‌ها برای محاسبه میانگین و صدک ۹۵
+            })
+            entry['attempts'] += 1
+            if attempt:
+                entry['retries'] += 1
+            if status is None or status >= 400:
+                entry['errors'] += 1
+            entry['latencies'].append(latency)
+    
+    def _backoff_delay(self, attempt: int) -> float:
+        """تأخیر نمایی با jitter کامل برای تلاش بعدی"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+    
+    def _retry_after_delay(self, response: requests.Response) -> Optional[float]:
+        """خواندن تأخیر از هدر Retry-After (ثانیه یا تاریخ HTTP)"""
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            delay = float(value)
+        except ValueError:
+            try:
+                delay = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                return None
+        return min(max(delay, 0.0), self.retry_after_max)
+
+# اتصال‌ها در سطح پروسه نگه داشته می‌شوند تا بین تمام نشست‌های کاربران مشترک باشند
+_shared_transport = None
+_shared_transport_lock = threading.Lock()
+
+def get_shared_transport() -> HTTPTransport:
+    """دریافت HTTPTransport مشترک پروسه"""
+    global _shared_transport
+    with _shared_transport_lock:
+        if _shared_transport is None:
+            _shared_transport = HTTPTransport()
+        return _shared_transport
\ No newline at end of file
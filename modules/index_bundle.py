@@ -0,0 +1,108 @@
+import os
+import json
+import uuid
+import shutil
+import tarfile
+import tempfile
+from datetime import datetime
+from typing import Dict, Optional
+from .file_manager import FileManager
+from .response_cache import ResponseCache
+
+BUNDLE_VERSION = 1
+BUNDLE_INFO_FILE = "bundle.json"
+
+# پسوندهایی که بسته به صورت یک فایل tar نوشته می‌شود
+_TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz")
+
+def export_bundle(vector_db, file_manager, output_path: str) -> Dict:
+    """نوشتن بسته قابل انتقال ایندکس (پوشه یا فایل tar بر اساس پسوند output_path)
+
+    بسته شامل پوشه vector_store (سگمنت‌ها، ایندکس ANN، متن چانک‌ها و ایندکس واژگانی)، manifest فایل‌ها
+    و bundle.json (شناسه بسته، نام مدل embedding و تعداد فایل‌ها و چانک‌ها) است.
+    خروجی: اطلاعات bundle.json
+    """
+    info = {
+        'version': BUNDLE_VERSION,
+        'bundle_id': uuid.uuid4().hex,
+        'created_at': datetime.now().isoformat(),
+        'model_name': vector_db.model_name,
+        'dimension': vector_db.embedding_engine.dimension,
+        'files': len(vector_db.get_file_names()),
+        'chunks': vector_db.get_chunk_count()
+    }
+    as_tar = output_path.endswith(_TAR_SUFFIXES)
+    if not as_tar and os.path.exists(output_path):
+        raise FileExistsError(f"مسیر بسته از قبل وجود دارد: {output_path}")
+    
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output_path))) as temp_dir:
+        bundle_dir = os.path.join(temp_dir, "bundle")
+        vector_db.export(os.path.join(bundle_dir, "vector_store"))
+        with open(os.path.join(bundle_dir, "file_manifest.json"), 'w', encoding='utf-8') as f:
+            json.dump(file_manager.get_manifest(), f, ensure_ascii=False, indent=2)
+        with open(os.path.join(bundle_dir, BUNDLE_INFO_FILE), 'w', encoding='utf-8') as f:
+            json.dump(info, f, ensure_ascii=False, indent=2)
+        
+        if as_tar:
+            mode = "w:gz" if output_path.endswith(("gz", "tgz")) else "w"
+            with tarfile.open(output_path + ".tmp", mode) as tar:
+                tar.add(bundle_dir, arcname=".")
+            os.replace(output_path + ".tmp", output_path)
+        else:
+            os.replace(bundle_dir, output_path)
+    return info
+
+def install_bundle(bundle_path: str, data_dir: str = "data", model_name: Optional[str] = None) -> Optional[Dict]:
+    """نصب بسته ایندکس در پوشه data پیش از بارگذاری پایگاه داده برداری
+
+    پوشه vector_store فعلی با نسخه بسته جایگزین می‌شود (نسخه قبلی در vector_store.replaced نگه داشته می‌شود)
+    و manifest فایل‌ها با manifest بسته جایگزین می‌شود؛ فایل‌های قبلی که در بسته نیستند پردازش‌نشده علامت می‌خورند.
+    کش پاسخ‌ها و کش معنایی پاک می‌شوند، چون پاسخ‌های آن‌ها بر اسناد پایگاه داده قبلی مبتنی است.
+    بسته‌ای که قبلاً نصب شده دوباره نصب نمی‌شود.
+    خروجی: اطلاعات bundle.json بسته نصب‌شده، یا None اگر همین بسته قبلاً نصب شده باشد
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    installed_info_path = os.path.join(data_dir, BUNDLE_INFO_FILE)
+    with tempfile.TemporaryDirectory(dir=data_dir) as temp_dir:
+        if os.path.isdir(bundle_path):
+            bundle_dir = bundle_path
+        else:
+            bundle_dir = os.path.join(temp_dir, "bundle")
+            with tarfile.open(bundle_path) as tar:
+                if hasattr(tarfile, 'data_filter'):
+                    tar.extractall(bundle_dir, filter='data')
+                else:
+                    tar.extractall(bundle_dir)
+        
+        with open(os.path.join(bundle_dir, BUNDLE_INFO_FILE), 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        if info.get('version') != BUNDLE_VERSION:
+            raise ValueError(f"نسخه بسته ایندکس پشتیبانی نمی‌شود: {info.get('version')}")
+        if model_name and info['model_name'] != model_name:
+            raise ValueError(f"بسته ایندکس با مدل {info['model_name']} ساخته شده است، نه {model_name}")
+        if os.path.exists(installed_info_path):
+            with open(installed_info_path, 'r', encoding='utf-8') as f:
+                if json.load(f).get('bundle_id') == info['bundle_id']:
+                    return None
+        
+        # کپی در کنار مقصد و سپس جایگزینی با تغییر نام، تا قطع شدن نصب پوشه فعلی را خراب نکند
+        store_dir = os.path.join(data_dir, "vector_store")
+        staged_dir = os.path.join(temp_dir, "vector_store")
+        shutil.copytree(os.path.join(bundle_dir, "vector_store"), staged_dir)
+        replaced_dir = store_dir + ".replaced"
+        if os.path.exists(replaced_dir):
+            shutil.rmtree(replaced_dir)
+        if os.path.exists(store_dir):
+            os.replace(store_dir, replaced_dir)
+        os.replace(staged_dir, store_dir)
+        
+        with open(os.path.join(bundle_dir, "file_manifest.json"), 'r', encoding='utf-8') as f:
+            FileManager(data_dir).install_manifest(json.load(f))
+        ResponseCache(os.path.join(data_dir, "response_cache.sqlite")).clear()
+        # کش معنایی به faiss وابسته است و فقط هنگام نصب بسته import می‌شود
+        from .semantic_cache import SemanticCache
+        SemanticCache(info['dimension'], os.path.join(data_dir, "semantic_cache.sqlite")).clear()
+        with open(installed_info_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(info, f, ensure_ascii=False, indent=2)
+        os.replace(installed_info_path + ".tmp", installed_info_path)
+    return info
\ No newline at end of file
@@ -0,0 +1,210 @@
+import os
+import time
+import multiprocessing
+import fitz  # PyMuPDF
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Dict, Tuple, Optional, Callable
+
+def extract_page_range(pdf_path: str, start: int, end: int) -> List[str]:
+    """استخراج متن صفحات [start, end) یک فایل PDF (در پروسه‌های کارگر اجرا می‌شود)"""
+    doc = fitz.open(pdf_path)
+    try:
+        return [doc[page_number].get_text() for page_number in range(start, end)]
+    finally:
+        doc.close()
+
+class IngestionPipeline:
+    """پردازش گروهی فایل‌های PDF
+
+    استخراج متن صفحات بین چند پروسه (به تعداد هسته‌های پردازنده) پخش می‌شود و چانک‌های
+    چند فایل با هم به مدل embedding داده می‌شوند تا به جای یک فراخوانی کوچک برای هر فایل،
+    فراخوانی‌های بزرگ و کم‌تعداد انجام شود. در زمان تولید embedding، استخراج فایل‌های بعدی
+    در پروسه‌های کارگر ادامه پیدا می‌کند.
+    """
+    
+    def __init__(self, doc_processor, vector_db, file_manager=None,
+                 max_workers: Optional[int] = None, pages_per_task: Optional[int] = None,
+                 embed_batch_chunks: Optional[int] = None):
+        self.doc_processor = doc_processor
+        self.vector_db = vector_db
+        self.file_manager = file_manager
+        self.max_workers = max_workers or int(os.getenv("INGEST_WORKERS", "0")) or os.cpu_count() or 1
+        self.pages_per_task = pages_per_task or int(os.getenv("INGEST_PAGES_PER_TASK", "50"))
+        # سقف تعداد چانک‌هایی که در یک فراخوانی به مدل داده می‌شوند (برای محدود ماندن حافظه)
+        self.embed_batch_chunks = embed_batch_chunks or int(os.getenv("INGEST_EMBED_BATCH_CHUNKS", "20000"))
+    
+    def ingest(self, files: List[Tuple[str, str]],
+               progress_callback: Optional[Callable[[int, int], None]] = None,
+               embed_progress_callback: Optional[Callable[[int, int], None]] = None,
+               stats_callback: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """پردازش و ایندکس چند فایل
+
+        files: لیست (نام یونیک فایل، مسیر فایل)
+        progress_callback: با (تعداد فایل‌های ایندکس‌شده، تعداد کل فایل‌ها) فراخوانی می‌شود
+        embed_progress_callback: در هر دسته embedding با (تعداد چانک‌های انجام‌شده، تعداد کل چانک‌های دسته) فراخوانی می‌شود
+        stats_callback: پس از استخراج یا ایندکس شدن هر فایل با آمار جاری فراخوانی می‌شود
+        خروجی: آمار پردازش شامل تعداد صفحات و چانک‌ها، خطاها و سرعت پردازش
+        """
+        start_time = time.perf_counter()
+        stats = {
+            'files': len(files),
+            'ingested': [],
+            'errors': [],
+            'pages': 0,
+            'chunks': 0,
+            'cache_hits': 0,
+            'workers': self.max_workers,
+            'embed_calls': 0,
+            'embed_seconds': 0.0
+        }
+        
+        pending = []  # فایل‌های استخراج‌شده در انتظار تولید embedding: (نام فایل، چانک‌ها، متادیتای چانک‌ها)
+        pending_chunks = 0
+        
+        # پروسه‌های کارگر با spawn ساخته می‌شوند: fork از پروسه‌ای با نخ‌های فعال (مدل embedding، سرور Streamlit) ناامن است
+        with ProcessPoolExecutor(max_workers=self.max_workers,
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = {}
+            pages = {}
+            remaining_tasks = {}
+            for file_name, file_path in files:
+                try:
+                    with fitz.open(file_path) as doc:
+                        page_count = doc.page_count
+                except Exception as e:
+                    stats['errors'].append((file_name, str(e)))
+                    continue
+                
+                pages[file_name] = [None] * page_count
+                remaining_tasks[file_name] = 0
+                for start in range(0, page_count, self.pages_per_task):
+                    end = min(start + self.pages_per_task, page_count)
+                    future = executor.submit(extract_page_range, file_path, start, end)
+                    futures[future] = (file_name, start)
+                    remaining_tasks[file_name] += 1
+                
+                if page_count == 0:
+                    del pages[file_name], remaining_tasks[file_name]
+                    stats['errors'].append((file_name, "فایل هیچ صفحه‌ای ندارد"))
+            
+            for future in as_completed(futures):
+                file_name, start = futures[future]
+                if file_name not in pages:
+                    # استخراج صفحات دیگری از این فایل قبلاً با خطا مواجه شده است
+                    continue
+                try:
+                    page_texts = future.result()
+                except Exception as e:
+                    del pages[file_name], remaining_tasks[file_name]
+                    stats['errors'].append((file_name, str(e)))
+                    continue
+                
+                pages[file_name][start:start + len(page_texts)] = page_texts
+                remaining_tasks[file_name] -= 1
+                if remaining_tasks[file_name]:
+                    continue
+                
+                # تمام صفحات فایل استخراج شده است
+                file_pages = pages.pop(file_name)
+                del remaining_tasks[file_name]
+                stats['pages'] += len(file_pages)
+                if stats_callback:
+                    stats_callback(stats)
+                chunked = list(self.doc_processor.iter_chunks(enumerate(file_pages, 1), stats))
+                if not chunked:
+                    stats['errors'].append((file_name, "متنی از فایل استخراج نشد"))
+                    continue
+                
+                chunks = [chunk for chunk, _ in chunked]
+                pending.append((file_name, chunks, [metadata for _, metadata in chunked]))
+                pending_chunks += len(chunks)
+                if pending_chunks >= self.embed_batch_chunks:
+                    self._flush(pending, stats, progress_callback, embed_progress_callback, stats_callback)
+                    pending, pending_chunks = [], 0
+        
+        if pending:
+            self._flush(pending, stats, progress_callback, embed_progress_callback, stats_callback)
+        
+        elapsed = time.perf_counter() - start_time
+        stats['seconds'] = elapsed
+        stats['pages_per_second'] = stats['pages'] / elapsed if elapsed else 0.0
+        stats['chunks_per_second'] = stats['chunks'] / elapsed if elapsed else 0.0
+        embedded = stats['chunks'] - stats['cache_hits']
+        stats['embed_chunks_per_second'] = embedded / stats['embed_seconds'] if stats['embed_seconds'] else 0.0
+        return stats
+    
+    def ingest_file(self, file_name: str, file_path: str,
+                    stats_callback: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """پردازش افزایشی یک فایل در همین پروسه
+
+        صفحات یکی‌یکی خوانده و چانک می‌شوند و هر embed_batch_chunks چانک یک‌بار به پایگاه داده
+        افزوده می‌شود؛ بنابراین حافظه مصرفی به اندازه فایل بستگی ندارد.
+        stats_callback: پس از خواندن هر صفحه و افزودن هر دسته چانک با آمار جاری فراخوانی می‌شود
+        خروجی: آمار پردازش شامل تعداد صفحات، چانک‌ها، embeddingهای خوانده‌شده از کش و توکن‌های بریده‌شده
+        اگر خواندن فایل در میانه با خطا مواجه شود، چانک‌های افزوده‌شده حذف می‌شوند و خطا دوباره رخ می‌دهد.
+        """
+        stats = {'pages': 0, 'chunks': 0, 'cache_hits': 0}
+        
+        def counted_pages():
+            for page in self.doc_processor.iter_pages(file_path):
+                stats['pages'] += 1
+                if stats_callback:
+                    stats_callback(stats)
+                yield page
+        
+        # حذف چانک‌های باقی‌مانده از پردازش نیمه‌تمام قبلی همین فایل
+        self.vector_db.remove_documents_by_file(file_name)
+        
+        chunks, metadatas = [], []
+        try:
+            for chunk, metadata in self.doc_processor.iter_chunks(counted_pages(), stats):
+                chunks.append(chunk)
+                metadatas.append(metadata)
+                if len(chunks) >= self.embed_batch_chunks:
+                    stats['cache_hits'] += self.vector_db.add_documents(chunks, file_name, metadatas=metadatas)['cache_hits']
+                    stats['chunks'] += len(chunks)
+                    chunks, metadatas = [], []
+                    if stats_callback:
+                        stats_callback(stats)
+            
+            if chunks:
+                stats['cache_hits'] += self.vector_db.add_documents(chunks, file_name, metadatas=metadatas)['cache_hits']
+                stats['chunks'] += len(chunks)
+        except Exception:
+            # سند ناقص ایندکس نمی‌شود؛ فایل پردازش‌نشده می‌ماند تا با آپلود یا پردازش مجدد کامل ایندکس شود
+            self.vector_db.remove_documents_by_file(file_name)
+            raise
+        
+        if stats['chunks'] and self.file_manager is not None:
+            self.file_manager.mark_ingested(file_name)
+        return stats
+    
+    def _flush(self, pending: List[Tuple[str, List[str], List[Dict]]], stats: Dict,
+               progress_callback: Optional[Callable[[int, int], None]],
+               embed_progress_callback: Optional[Callable[[int, int], None]] = None,
+               stats_callback: Optional[Callable[[Dict], None]] = None):
+        """تولید embedding چانک‌های چند فایل در یک فراخوانی و افزودن هر فایل به پایگاه داده"""
+        all_chunks = [chunk for _, chunks, _ in pending for chunk in chunks]
+        embed_start = time.perf_counter()
+        embeddings, cache_hits = self.vector_db.encode_texts(all_chunks, embed_progress_callback)
+        stats['embed_seconds'] += time.perf_counter() - embed_start
+        stats['embed_calls'] += 1
+        stats['cache_hits'] += cache_hits
+        
+        offset = 0
+        for file_name, chunks, metadatas in pending:
+            file_embeddings = embeddings[offset:offset + len(chunks)]
+            offset += len(chunks)
+            
+            # حذف چانک‌های باقی‌مانده از پردازش نیمه‌تمام قبلی همین فایل
+            self.vector_db.remove_documents_by_file(file_name)
+            self.vector_db.add_documents(chunks, file_name, embeddings=file_embeddings, metadatas=metadatas)
+            if self.file_manager is not None:
+                self.file_manager.mark_ingested(file_name)
+            
+            stats['chunks'] += len(chunks)
+            stats['ingested'].append(file_name)
+            if progress_callback:
+                progress_callback(len(stats['ingested']), stats['files'])
+            if stats_callback:
+                stats_callback(stats)
\ No newline at end of file
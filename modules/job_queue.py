@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import fitz  # PyMuPDF
+from datetime import datetime
+from typing import List, Dict, Tuple, Optional
+from .ingestion import IngestionPipeline
+
+JOB_STATUSES = ('queued', 'running', 'done', 'failed')
+
+class JobQueue:
+    """صف پس‌زمینه کارهای پردازش فایل (استخراج ← چانک ← embedding ← ایندکس)
+
+    هر کار یک یا چند فایل را با `IngestionPipeline` پردازش می‌کند: کار تک‌فایلی با `ingest_file`
+    (حافظه محدود) و کار چندفایلی با `ingest` (استخراج موازی در چند پروسه). کارها در نخ‌های کارگر
+    پروسه سرور اجرا می‌شوند تا از همان مدل و ایندکس مشترک استفاده کنند، و وضعیت آن‌ها
+    (queued/running/done/failed، صفحات و چانک‌های پردازش‌شده) در SQLite ذخیره می‌شود؛ بنابراین
+    بستن مرورگر کار را متوقف نمی‌کند و کارهای نیمه‌تمام پس از راه‌اندازی مجدد سرور دوباره در صف قرار می‌گیرند.
+    """
+    
+    def __init__(self, doc_processor, vector_db, file_manager=None, db_path: str = "data/jobs.sqlite",
+                 workers: Optional[int] = None, progress_interval: Optional[float] = None):
+        self.doc_processor = doc_processor
+        self.vector_db = vector_db
+        self.file_manager = file_manager
+        self.db_path = db_path
+        self.workers = workers or int(os.getenv("INGEST_JOB_WORKERS", "1"))
+        # حداقل فاصله (ثانیه) بین دو ثبت پیشرفت یک کار در پایگاه داده
+        self.progress_interval = progress_interval if progress_interval is not None else float(os.getenv("INGEST_JOB_PROGRESS_INTERVAL", "0.5"))
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                files TEXT NOT NULL,
+                status TEXT NOT NULL,
+                total_files INTEGER NOT NULL,
+                total_pages INTEGER,
+                files_done INTEGER NOT NULL DEFAULT 0,
+                pages INTEGER NOT NULL DEFAULT 0,
+                chunks INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                error TEXT,
+                created_at TEXT NOT NULL,
+                started_at TEXT,
+                finished_at TEXT
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id)")
+        # کارهایی که با توقف سرور نیمه‌تمام مانده‌اند از ابتدا تکرار می‌شوند
+        # (پایپلاین پیش از افزودن، چانک‌های باقی‌مانده هر فایل را حذف می‌کند)
+        self._conn.execute("""
+            UPDATE jobs SET status = 'queued', files_done = 0, pages = 0, chunks = 0, started_at = NULL
+            WHERE status = 'running'
+        """)
+        self._conn.commit()
+        
+        for worker_number in range(self.workers):
+            threading.Thread(target=self._worker, name=f"ingest-job-{worker_number}", daemon=True).start()
+    
+    def submit(self, files: List[Tuple[str, str]]) -> int:
+        """افزودن کار پردازش فایل‌ها به صف؛ files: لیست (نام یونیک فایل، مسیر فایل)، خروجی: شناسه کار
+
+        اگر کار فعالی (در صف یا در حال اجرا) برای همین فایل‌ها وجود داشته باشد، شناسه همان کار برگردانده می‌شود.
+        """
+        files_json = json.dumps([list(file) for file in files], ensure_ascii=False)
+        with self._wakeup:
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE files = ? AND status IN ('queued', 'running')", (files_json,)
+            ).fetchone()
+            if row is not None:
+                return row[0]
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (files, status, total_files, created_at) VALUES (?, 'queued', ?, ?)",
+                (files_json, len(files), datetime.now().isoformat())
+            )
+            self._conn.commit()
+            self._wakeup.notify()
+            return cursor.lastrowid
+    
+    def get_job(self, job_id: int) -> Optional[Dict]:
+        """وضعیت یک کار"""
+        jobs = self._select("WHERE id = ?", (job_id,))
+        return jobs[0] if jobs else None
+    
+    def list_jobs(self, limit: int = 10) -> List[Dict]:
+        """کارهای فعال و آخرین کارهای پایان‌یافته (کارهای فعال ابتدا)"""
+        return self._select("ORDER BY status IN ('queued', 'running') DESC, id DESC LIMIT ?", (limit,))
+    
+    def get_stats(self) -> Dict:
+        """تعداد کارها در هر وضعیت"""
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {status: counts.get(status, 0) for status in JOB_STATUSES}
+    
+    def _select(self, clause: str, params) -> List[Dict]:
+        """خواندن کارها با شرط و ترتیب داده‌شده"""
+        with self._lock:
+            cursor = self._conn.execute(f"SELECT * FROM jobs {clause}", params)
+            columns = [column[0] for column in cursor.description]
+            rows = cursor.fetchall()
+        jobs = []
+        for row in rows:
+            job = dict(zip(columns, row))
+            job['files'] = [tuple(file) for file in json.loads(job['files'])]
+            job['result'] = json.loads(job['result']) if job['result'] else None
+            jobs.append(job)
+        return jobs
+    
+    def _claim(self) -> Optional[Dict]:
+        """برداشتن قدیمی‌ترین کار در صف و علامت‌گذاری آن به عنوان در حال اجرا (با قفل گرفته‌شده)"""
+        row = self._conn.execute("SELECT id, files FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+        if row is None:
+            return None
+        self._conn.execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?",
+                           (datetime.now().isoformat(), row[0]))
+        self._conn.commit()
+        return {'id': row[0], 'files': [tuple(file) for file in json.loads(row[1])]}
+    
+    def _update(self, job_id: int, **fields):
+        """ثبت تغییرات یک کار"""
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+            self._conn.commit()
+    
+    def _worker(self):
+        """حلقه نخ کارگر: اجرای کارهای صف به ترتیب ثبت"""
+        while True:
+            with self._wakeup:
+                job = self._claim()
+                while job is None:
+                    self._wakeup.wait()
+                    job = self._claim()
+            
+            try:
+                self._run(job)
+            except Exception as e:
+                self._update(job['id'], status='failed', error=str(e), finished_at=datetime.now().isoformat())
+    
+    def _run(self, job: Dict):
+        """اجرای یک کار و ثبت پیشرفت و نتیجه آن"""
+        total_pages = 0
+        for _, file_path in job['files']:
+            try:
+                with fitz.open(file_path) as doc:
+                    total_pages += doc.page_count
+            except Exception:
+                pass  # خطای فایل در زمان پردازش ثبت می‌شود
+        self._update(job['id'], total_pages=total_pages)
+        
+        last_update = [0.0]
+        
+        def record_progress(stats: Dict):
+            now = time.monotonic()
+            if now - last_update[0] >= self.progress_interval:
+                last_update[0] = now
+                self._update(job['id'], pages=stats['pages'], chunks=stats['chunks'],
+                             files_done=len(stats.get('ingested', [])))
+        
+        pipeline = IngestionPipeline(self.doc_processor, self.vector_db, self.file_manager)
+        if len(job['files']) == 1:
+            file_name, file_path = job['files'][0]
+            stats = pipeline.ingest_file(file_name, file_path, stats_callback=record_progress)
+            stats['ingested'] = [file_name] if stats['chunks'] else []
+            stats['errors'] = [] if stats['chunks'] else [(file_name, "متنی از فایل استخراج نشد")]
+        else:
+            stats = pipeline.ingest(job['files'], stats_callback=record_progress)
+        
+        errors = "\n".join(f"{file_name}: {error}" for file_name, error in stats['errors'])
+        self._update(
+            job['id'],
+            status='done' if stats['ingested'] else 'failed',
+            pages=stats['pages'],
+            chunks=stats['chunks'],
+            files_done=len(stats['ingested']),
+            result=json.dumps(stats, ensure_ascii=False),
+            error=errors or None,
+            finished_at=datetime.now().isoformat()
+        )
\ No newline at end of file
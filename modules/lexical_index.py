@@ -0,0 +1,281 @@
+import os
+import re
+import math
+import sqlite3
+import threading
+import unicodedata
+import numpy as np
+from collections import Counter
+from typing import List, Dict, Tuple, Optional
+
+# نیم‌فاصله، اعراب و کشیده حذف می‌شوند
+_IGNORED = re.compile('[\u064B-\u065F\u0670\u0640\u200C\u200D]')
+
+# یکسان‌سازی نویسه‌های عربی و فارسی و تبدیل ارقام به لاتین
+# (جایگزینی رشته‌ای برای هر نویسه بسیار سریع‌تر از str.translate با نگاشت غیر ASCII است)
+_REPLACEMENTS = (
+    ('ي', 'ی'), ('ى', 'ی'), ('ك', 'ک'), ('ة', 'ه'), ('ۀ', 'ه'), ('أ', 'ا'), ('إ', 'ا'), ('ٱ', 'ا'),
+    *((digit, str(i)) for i, digit in enumerate('۰۱۲۳۴۵۶۷۸۹')),
+    *((digit, str(i)) for i, digit in enumerate('٠١٢٣٤٥٦٧٨٩'))
+)
+
+_WORD = re.compile(r'\w+')
+# کد مرکب (مانند AB-1234 یا 12/5)
+_COMPOUND = re.compile(r'\b\w+(?:[-/.]\w+)+')
+
+def normalize_text(text: str) -> str:
+    """یکسان‌سازی متن فارسی برای جستجوی واژگانی
+
+    شکل‌های نمایشی حروف (خروجی رایج PDF) با NFKC به حروف پایه تبدیل می‌شوند.
+    """
+    text = _IGNORED.sub('', unicodedata.normalize('NFKC', text))
+    for source, target in _REPLACEMENTS:
+        if source in text:
+            text = text.replace(source, target)
+    return text.lower()
+
+def tokenize(text: str) -> List[str]:
+    """تقسیم متن نرمال‌شده به توکن‌ها؛ کدهای مرکب هم به صورت کامل و هم بخش به بخش برگردانده می‌شوند"""
+    text = normalize_text(text)
+    return _WORD.findall(text) + _COMPOUND.findall(text)
+
+class LexicalIndex:
+    """ایندکس معکوس واژگانی (BM25) چانک‌ها
+
+    فهرست چانک‌های هر توکن (postings) به صورت سگمنت‌های فشرده در SQLite ذخیره می‌شود: هر فراخوانی
+    `add` برای هر توکن فقط یک سطر شامل آرایه شناسه چانک‌ها، تعداد تکرار و طول چانک می‌نویسد؛ بنابراین
+    هزینه نوشتن به تعداد توکن‌های یکتای دسته بستگی دارد نه به تعداد کل واژه‌ها. امتیاز BM25 با numpy
+    روی آرایه‌های توکن‌های پرسش محاسبه می‌شود.
+
+    حذف چانک‌ها فقط آن‌ها را علامت‌گذاری می‌کند. وقتی نسبت چانک‌های حذف‌شده از `compaction_ratio` بیشتر شود
+    (`needs_compaction`)، `compact` در نخ فشرده‌سازی پس‌زمینه پایگاه داده برداری سگمنت‌های هر توکن را ادغام
+    و چانک‌های حذف‌شده را از آن‌ها پاک می‌کند.
+    """
+    
+    def __init__(self, index_path: str = "data/vector_store/lexical.sqlite", k1: float = 1.2, b: float = 0.75):
+        self.index_path = index_path
+        self.k1 = k1
+        self.b = b
+        self.compaction_ratio = 0.2
+        self.compaction_min_deleted = 1000
+        self._lock = threading.Lock()
+        
+        os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(index_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS docs (
+                chunk_id INTEGER PRIMARY KEY,
+                file_name TEXT NOT NULL,
+                length INTEGER NOT NULL,
+                deleted INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                segment INTEGER NOT NULL,
+                chunk_ids BLOB NOT NULL,
+                tfs BLOB NOT NULL,
+                lengths BLOB NOT NULL,
+                PRIMARY KEY (term, segment)
+            ) WITHOUT ROWID
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_docs_file ON docs(file_name)")
+        self._conn.commit()
+        
+        self.doc_count, self.total_length = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM docs WHERE deleted = 0"
+        ).fetchone()
+        self._deleted = np.array(
+            [row[0] for row in self._conn.execute("SELECT chunk_id FROM docs WHERE deleted = 1 ORDER BY chunk_id")],
+            dtype='int64'
+        )
+        self._next_segment = self._conn.execute("SELECT COALESCE(MAX(segment), -1) + 1 FROM postings").fetchone()[0]
+    
+    @property
+    def next_chunk_id(self) -> int:
+        """چانک‌های با شناسه کوچک‌تر از این مقدار قبلاً پردازش شده‌اند (برای تکمیل ایندکس پایگاه‌های قدیمی)"""
+        with self._lock:
+            return (self._conn.execute("SELECT MAX(chunk_id) FROM docs").fetchone()[0] or -1) + 1
+    
+    def add(self, ids: List[int], texts: List[str], file_name: str):
+        """افزودن چند چانک به ایندکس در یک سگمنت جدید"""
+        # توکن‌سازی و ساخت postings خارج از قفل انجام می‌شود
+        term_codes = {}
+        posting_terms, posting_ids, posting_tfs, posting_lengths = [], [], [], []
+        lengths = []
+        for chunk_id, text in zip(ids, texts):
+            counts = Counter(tokenize(text))
+            length = sum(counts.values())
+            lengths.append(length)
+            posting_terms.extend(term_codes.setdefault(term, len(term_codes)) for term in counts)
+            posting_tfs.extend(counts.values())
+            posting_ids.extend([chunk_id] * len(counts))
+            posting_lengths.extend([length] * len(counts))
+        
+        # مرتب‌سازی postings بر اساس توکن (و به ترتیب شناسه چانک در هر توکن)
+        order = np.argsort(np.asarray(posting_terms, dtype='int64'), kind='stable')
+        sorted_codes = np.asarray(posting_terms, dtype='int64')[order]
+        posting_ids = np.asarray(posting_ids, dtype='int64')[order]
+        posting_tfs = np.asarray(posting_tfs, dtype='int32')[order]
+        posting_lengths = np.asarray(posting_lengths, dtype='int32')[order]
+        boundaries = np.flatnonzero(np.diff(sorted_codes)) + 1
+        starts = np.concatenate(([0], boundaries)).tolist() if len(order) else []
+        ends = np.concatenate((boundaries, [len(order)])).tolist() if len(order) else []
+        terms = list(term_codes)
+        rows = [
+            (terms[sorted_codes[start]], posting_ids[start:end].tobytes(),
+             posting_tfs[start:end].tobytes(), posting_lengths[start:end].tobytes())
+            for start, end in zip(starts, ends)
+        ]
+        
+        with self._lock:
+            segment = self._next_segment
+            self._next_segment += 1
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO docs (chunk_id, file_name, length) VALUES (?, ?, ?)",
+                [(int(chunk_id), file_name, length) for chunk_id, length in zip(ids, lengths)]
+            )
+            self._conn.executemany(
+                "INSERT INTO postings (term, segment, chunk_ids, tfs, lengths) VALUES (?, ?, ?, ?, ?)",
+                [(term, segment, chunk_ids, tfs, term_lengths) for term, chunk_ids, tfs, term_lengths in rows]
+            )
+            self._conn.commit()
+            self.doc_count += len(ids)
+            self.total_length += sum(lengths)
+    
+    def remove(self, ids: List[int]):
+        """علامت‌گذاری چند چانک به عنوان حذف‌شده"""
+        ids = [int(chunk_id) for chunk_id in ids]
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                doc_count, length = self._conn.execute(
+                    f"SELECT COUNT(*), COALESCE(SUM(length), 0) FROM docs WHERE chunk_id IN ({placeholders}) AND deleted = 0",
+                    batch
+                ).fetchone()
+                self._conn.execute(f"UPDATE docs SET deleted = 1 WHERE chunk_id IN ({placeholders})", batch)
+                self.doc_count -= doc_count
+                self.total_length -= length
+            self._conn.commit()
+            self._deleted = np.union1d(self._deleted, np.asarray(ids, dtype='int64'))
+    
+    def needs_compaction(self) -> bool:
+        """آیا نسبت چانک‌های حذف‌شده برای شروع فشرده‌سازی کافی است"""
+        with self._lock:
+            deleted = len(self._deleted)
+            return deleted >= self.compaction_min_deleted and deleted > self.compaction_ratio * (self.doc_count + deleted)
+    
+    def search(self, query: str, k: int = 5, selected_files: Optional[List[str]] = None) -> List[Tuple[int, float]]:
+        """جستجوی BM25؛ خروجی: لیست (شناسه چانک، امتیاز) به ترتیب نزولی امتیاز"""
+        query_terms = list(dict.fromkeys(tokenize(query)))
+        if not query_terms or (selected_files is not None and not selected_files):
+            return []
+        
+        with self._lock:
+            if self.doc_count == 0:
+                return []
+            average_length = self.total_length / self.doc_count
+            
+            allowed = None
+            if selected_files is not None:
+                placeholders = ",".join("?" * len(selected_files))
+                allowed = np.array([row[0] for row in self._conn.execute(
+                    f"SELECT chunk_id FROM docs WHERE file_name IN ({placeholders}) AND deleted = 0", selected_files
+                )], dtype='int64')
+            
+            matched_ids = []
+            matched_scores = []
+            for term in query_terms:
+                chunk_ids, tfs, lengths = self._read_postings(term)
+                if len(chunk_ids) == 0:
+                    continue
+                # df فقط از چانک‌های زنده کل پیکره شمرده می‌شود
+                df = len(chunk_ids)
+                idf = math.log(1 + (self.doc_count - df + 0.5) / (df + 0.5))
+                if allowed is not None:
+                    mask = np.isin(chunk_ids, allowed)
+                    chunk_ids, tfs, lengths = chunk_ids[mask], tfs[mask], lengths[mask]
+                tfs = tfs.astype('float32')
+                matched_ids.append(chunk_ids)
+                matched_scores.append(idf * tfs * (self.k1 + 1) / (tfs + self.k1 * (1 - self.b + self.b * lengths / average_length)))
+        
+        if not matched_ids:
+            return []
+        unique_ids, inverse = np.unique(np.concatenate(matched_ids), return_inverse=True)
+        if len(unique_ids) == 0:
+            return []
+        scores = np.bincount(inverse, weights=np.concatenate(matched_scores))
+        top = np.argsort(-scores, kind='stable')[:k]
+        return [(int(unique_ids[i]), float(scores[i])) for i in top]
+    
+    def export(self, target_path: str):
+        """نوشتن نسخه سازگار ایندکس در یک فایل SQLite جدید (با SQLite backup)"""
+        with self._lock:
+            target = sqlite3.connect(target_path)
+            try:
+                self._conn.backup(target)
+            finally:
+                target.close()
+    
+    def get_stats(self) -> Dict:
+        """آمار ایندکس واژگانی"""
+        with self._lock:
+            terms = self._conn.execute("SELECT COUNT(DISTINCT term) FROM postings").fetchone()[0]
+            return {
+                'docs': self.doc_count,
+                'terms': terms,
+                'deleted': len(self._deleted),
+                'average_length': self.total_length / self.doc_count if self.doc_count else 0.0
+            }
+    
+    def _read_postings(self, term: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """خواندن و الحاق سگمنت‌های یک توکن بدون چانک‌های حذف‌شده (با قفل گرفته‌شده)"""
+        rows = self._conn.execute("SELECT chunk_ids, tfs, lengths FROM postings WHERE term = ?", (term,)).fetchall()
+        if not rows:
+            return np.zeros(0, dtype='int64'), np.zeros(0, dtype='int32'), np.zeros(0, dtype='int32')
+        chunk_ids = np.concatenate([np.frombuffer(row[0], dtype='int64') for row in rows])
+        tfs = np.concatenate([np.frombuffer(row[1], dtype='int32') for row in rows])
+        lengths = np.concatenate([np.frombuffer(row[2], dtype='int32') for row in rows])
+        if len(self._deleted):
+            live = ~np.isin(chunk_ids, self._deleted)
+            chunk_ids, tfs, lengths = chunk_ids[live], tfs[live], lengths[live]
+        return chunk_ids, tfs, lengths
+    
+    def compact(self, terms_per_batch: int = 500):
+        """ادغام سگمنت‌های هر توکن و حذف دائمی چانک‌های حذف‌شده
+
+        توکن‌ها دسته‌دسته و هر دسته با یک‌بار گرفتن قفل بازنویسی می‌شوند تا جستجو و افزودن چانک‌ها
+        در طول فشرده‌سازی متوقف نشوند. چانک‌هایی که در حین فشرده‌سازی حذف می‌شوند علامت‌گذاری‌شده باقی می‌مانند.
+        """
+        with self._lock:
+            compacted = self._deleted
+            if not len(compacted):
+                return
+            segment = self._next_segment
+            self._next_segment += 1
+            terms = [row[0] for row in self._conn.execute("SELECT DISTINCT term FROM postings")]
+        
+        for start in range(0, len(terms), terms_per_batch):
+            with self._lock:
+                for term in terms[start:start + terms_per_batch]:
+                    chunk_ids, tfs, lengths = self._read_postings(term)
+                    self._conn.execute("DELETE FROM postings WHERE term = ?", (term,))
+                    if len(chunk_ids):
+                        self._conn.execute(
+                            "INSERT INTO postings (term, segment, chunk_ids, tfs, lengths) VALUES (?, ?, ?, ?, ?)",
+                            (term, segment, chunk_ids.tobytes(), tfs.tobytes(), lengths.tobytes())
+                        )
+                self._conn.commit()
+        
+        with self._lock:
+            compacted_ids = compacted.tolist()
+            for start in range(0, len(compacted_ids), 500):
+                batch = compacted_ids[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                self._conn.execute(f"DELETE FROM docs WHERE chunk_id IN ({placeholders}) AND deleted = 1", batch)
+            self._conn.commit()
+            self._deleted = np.setdiff1d(self._deleted, compacted)
\ No newline at end of file
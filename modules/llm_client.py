@@ -1,34 +1,228 @@
 import requests
 import os
-from typing import Dict, Any
+import re
+import json
+import time
+import math
+import asyncio
+from typing import Dict, Any, Iterator, List, Tuple, Optional
+from .http_transport import get_shared_transport, RETRY_STATUSES
+
+# تبدیل ارقام فارسی و عربی به لاتین و بالعکس
+_DIGITS_TO_LATIN = str.maketrans('۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩', '01234567890123456789')
+_DIGITS_TO_PERSIAN = str.maketrans('0123456789', '۰۱۲۳۴۵۶۷۸۹')
+
+# عنوان هر سوال در خروجی مدل، مانند «سوال ۱:» یا «**سؤال 2:**»
+_QUESTION_HEADER = re.compile(r'^([ \t*#]*)(?:سوال|سؤال)\s*[0-9۰-۹٠-٩]+\s*([:：.\-)])', re.MULTILINE)
+
+# کدهای وضعیتی که به مدل جایگزین منتقل می‌شوند: خطاهای موقت و مدل ناموجود (404)؛
+# خطاهای درخواست یا احراز هویت (مانند 400، 401 و 403) برای همه مدل‌ها یکسان‌اند و بلافاصله گزارش می‌شوند
+FALLBACK_STATUSES = RETRY_STATUSES + (404,)
 
 class LLMClient:
     """کلاس ارتباط با مدل زبانی"""
     
-    def __init__(self):        
+    def __init__(self, response_cache=None):        
         # تنظیمات OpenRouter
         print('>>', os.getenv("OPENROUTER_BASE_URL"))
         self.base_url = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1/chat/completions")
         self.api_key = os.getenv("OPENROUTER_API_KEY")
         self.model = os.getenv("OPENROUTER_MODEL", "google/gemma-3n-e2b-it:free")
+        # مدل‌های جایگزین (جداشده با کاما) که پس از شکست همه تلاش‌های مدل اصلی به ترتیب امتحان می‌شوند
+        self.fallback_models = [m.strip() for m in os.getenv("OPENROUTER_FALLBACK_MODELS", "").split(",") if m.strip()]
+        # اتصال‌های HTTP بین تمام نشست‌ها مشترک هستند
+        self.transport = get_shared_transport()
+        self.streaming = os.getenv("LLM_STREAMING", "true").lower() == "true"
+        self.max_tokens = 1000
+        self.temperature = 0.7
+        # کش پاسخ‌ها (ResponseCache)؛ None یعنی بدون کش
+        self.response_cache = response_cache
+        # درخواست چند سوال تستی به چند درخواست هم‌زمان کوچک‌تر تقسیم می‌شود
+        self.mcq_questions_per_request = int(os.getenv("LLM_MCQ_QUESTIONS_PER_REQUEST", "3"))
+        self.max_concurrency = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+        # زمان‌بندی آخرین پاسخ (زمان رسیدن اولین توکن و زمان کل به ثانیه)؛ error یعنی پاسخ پیام خطاست
+        self.last_metrics = {}
     
-    def generate_response(self, context: str, question: str) -> str:
-        """تولید پاسخ با استفاده از مدل زبانی"""
-        # تشخیص نوع درخواست
-        is_mcq_request = self._is_multiple_choice_request(question)
-        
-        if is_mcq_request:
-            prompt = self._create_mcq_prompt(context, question)
-        else:
-            prompt = self._create_standard_prompt(context, question)
+    def generate_response(self, context: str, question: str, source_files: List[str] = None) -> str:
+        """تولید پاسخ با استفاده از مدل زبانی
+
+        source_files فایل‌هایی هستند که متن مرجع از آن‌ها آمده است؛ با حذف هر یک، پاسخ از کش حذف می‌شود.
+        """
+        prompt = self._build_prompt(context, question)
+        cache_key = self._cache_key(prompt)
+        cached = self._get_cached(cache_key)
+        if cached is not None:
+            return cached
         
         try:
-            return self._generate_openrouter_response(prompt)
+            response = self._generate_openrouter_response(prompt)
         
         except requests.exceptions.RequestException as e:
+            self.last_metrics = {'error': True}
             return f"خطا در ارتباط با مدل زبانی: {str(e)}"
         except Exception as e:
+            self.last_metrics = {'error': True}
             return f"خطا در پردازش پاسخ: {str(e)}"
+        
+        # پاسخ مدل جایگزین با کلید همان مدل ذخیره می‌شود تا به جای پاسخ مدل اصلی برگردانده نشود
+        self._put_cached(self._cache_key(prompt, self.last_metrics.get('model')), response, source_files)
+        return response
+    
+    def generate_response_stream(self, context: str, question: str, source_files: List[str] = None) -> Iterator[str]:
+        """تولید پاسخ به صورت جریانی؛ هر بخش از متن به محض رسیدن از مدل برگردانده می‌شود
+
+        در صورت خطا، پیام خطا به عنوان آخرین بخش برگردانده می‌شود. پاسخ موجود در کش یک‌جا برگردانده می‌شود.
+        """
+        prompt = self._build_prompt(context, question)
+        cache_key = self._cache_key(prompt)
+        cached = self._get_cached(cache_key)
+        if cached is not None:
+            yield cached
+            return
+        
+        try:
+            parts = []
+            for delta in self._stream_openrouter_response(prompt):
+                parts.append(delta)
+                yield delta
+            self._put_cached(self._cache_key(prompt, self.last_metrics.get('model')), "".join(parts), source_files)
+        except requests.exceptions.RequestException as e:
+            self.last_metrics['error'] = True
+            yield f"خطا در ارتباط با مدل زبانی: {str(e)}"
+        except Exception as e:
+            self.last_metrics['error'] = True
+            yield f"خطا در پردازش پاسخ: {str(e)}"
+    
+    def get_requested_question_count(self, question: str) -> int:
+        """تعداد سوال درخواست‌شده در متن درخواست (مثلاً «۲۰ سوال تستی»)؛ صفر اگر مشخص نشده باشد"""
+        match = re.search(r'([0-9۰-۹٠-٩]+)\s*(?:تا\s*)?(?:سوال|سؤال|پرسش|تست|question|mcq)', question, re.IGNORECASE)
+        if not match:
+            return 0
+        return int(match.group(1).translate(_DIGITS_TO_LATIN))
+    
+    def should_fan_out(self, question: str) -> bool:
+        """آیا تعداد سوال‌های درخواستی بیشتر از ظرفیت یک درخواست است"""
+        return self.get_requested_question_count(question) > self.mcq_questions_per_request
+    
+    def generate_mcq_batch(self, contexts: List[str], question: str, source_files: List[str] = None) -> str:
+        """تولید چند سوال تستی با تقسیم درخواست به چند درخواست هم‌زمان
+
+        هر درخواست بخشی از چانک‌های مرجع و بخشی از سوال‌ها را دریافت می‌کند؛ حداکثر max_concurrency
+        درخواست هم‌زمان ارسال می‌شود و نتایج به ترتیب ادغام و دوباره شماره‌گذاری می‌شوند.
+        """
+        if not contexts:
+            raise ValueError("برای تولید سوال تستی حداقل یک متن مرجع لازم است")
+        
+        question_count = self.get_requested_question_count(question) or self.mcq_questions_per_request
+        request_count = math.ceil(question_count / self.mcq_questions_per_request)
+        
+        prompts = []
+        for i in range(request_count):
+            count = min(self.mcq_questions_per_request, question_count - i * self.mcq_questions_per_request)
+            # توزیع چرخشی چانک‌ها تا هر درخواست روی بخش متفاوتی از متن تمرکز کند
+            sub_contexts = contexts[i::request_count] or [contexts[i % len(contexts)]]
+            sub_question = f"دقیقاً {count} سوال چهار گزینه‌ای از این بخش از متن طراحی کن. درخواست اصلی کاربر: {question}"
+            prompts.append(self._create_mcq_prompt("\n\n".join(sub_contexts), sub_question))
+        
+        combined_prompt = "\n\0\n".join(prompts)
+        cache_key = self._cache_key(combined_prompt)
+        cached = self._get_cached(cache_key)
+        if cached is not None:
+            return cached
+        
+        start_time = time.perf_counter()
+        results = asyncio.run(self._fan_out(prompts))
+        
+        questions = []
+        errors = []
+        models = set()
+        for result in results:
+            if isinstance(result, Exception):
+                errors.append(str(result))
+            else:
+                questions.extend(self._split_mcq_questions(result[0]))
+                models.add(result[1])
+        
+        self.last_metrics = {
+            'ttft': None,
+            'total': time.perf_counter() - start_time,
+            'streamed': False,
+            'requests': len(prompts),
+            'failed_requests': len(errors)
+        }
+        
+        if not questions:
+            self.last_metrics['error'] = True
+            return f"خطا در ارتباط با مدل زبانی: {errors[0] if errors else 'پاسخی دریافت نشد'}"
+        
+        response = "\n\n---\n\n".join(
+            _QUESTION_HEADER.sub(lambda m, n=number: f"{m.group(1)}سوال {str(n).translate(_DIGITS_TO_PERSIAN)}{m.group(2)}", block, count=1)
+            for number, block in enumerate(questions, 1)
+        )
+        if errors:
+            response += f"\n\n⚠️ {len(errors)} درخواست از {len(prompts)} درخواست ناموفق بود."
+        elif len(models) == 1:
+            # پاسخ ترکیبی از چند مدل مختلف در کش ذخیره نمی‌شود
+            self._put_cached(self._cache_key(combined_prompt, models.pop()), response, source_files)
+        return response
+    
+    def _cache_key(self, prompt: str, model: Optional[str] = None) -> Optional[str]:
+        """کلید کش پاسخ برای پرامپت نهایی با تنظیمات فعلی؛ model مدلی است که پاسخ داده (پیش‌فرض: مدل اصلی)"""
+        if self.response_cache is None:
+            return None
+        return self.response_cache.make_key(model or self.model, prompt, self.temperature, self.max_tokens)
+    
+    def _get_cached(self, cache_key: Optional[str]) -> Optional[str]:
+        """خواندن پاسخ از کش و ثبت زمان‌بندی پاسخ کش‌شده"""
+        if cache_key is None:
+            return None
+        cached = self.response_cache.get(cache_key)
+        if cached is not None:
+            self.last_metrics = {'ttft': 0.0, 'total': 0.0, 'streamed': False, 'cached': True}
+        return cached
+    
+    def _put_cached(self, cache_key: Optional[str], response: str, source_files: Optional[List[str]]):
+        """ذخیره پاسخ موفق در کش"""
+        if cache_key is not None and response:
+            self.response_cache.put(cache_key, response, source_files)
+    
+    async def _fan_out(self, prompts: List[str]) -> List:
+        """ارسال هم‌زمان چند پرامپت با سقف max_concurrency درخواست هم‌زمان
+
+        این fan-out مبتنی بر ترد است، نه I/O ناهمگام: HTTPTransport از requests (مسدودکننده) استفاده می‌کند و
+        هر درخواست با asyncio.to_thread در thread pool پیش‌فرض asyncio اجرا می‌شود (هم‌زمانی به اندازه آن نیز محدود است)؛
+        asyncio فقط سقف هم‌زمانی و جمع‌آوری نتایج را انجام می‌دهد.
+        خروجی به ترتیب پرامپت‌هاست؛ درخواست‌های ناموفق به صورت Exception برگردانده می‌شوند.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        async def complete(prompt: str):
+            async with semaphore:
+                return await asyncio.to_thread(self._complete, prompt)
+        
+        return await asyncio.gather(*(complete(prompt) for prompt in prompts), return_exceptions=True)
+    
+    def _complete(self, prompt: str) -> Tuple[str, str]:
+        """ارسال یک درخواست غیرجریانی؛ خروجی: (متن پاسخ، نام مدل)"""
+        response, model = self._post_with_fallback(prompt)
+        return response.json()['choices'][0]['message']['content'], model
+    
+    @staticmethod
+    def _split_mcq_questions(text: str) -> List[str]:
+        """جدا کردن سوال‌های یک پاسخ بر اساس عنوان «سوال N:»"""
+        starts = [match.start() for match in _QUESTION_HEADER.finditer(text)]
+        if not starts:
+            return [text.strip()] if text.strip() else []
+        blocks = [text[start:end] for start, end in zip(starts, starts[1:] + [len(text)])]
+        # حذف جداکننده «---» انتهای هر سوال؛ هنگام ادغام دوباره اضافه می‌شود
+        return [re.sub(r'\n\s*-{3,}\s*$', '', block.strip()).strip() for block in blocks]
+    
+    def _build_prompt(self, context: str, question: str) -> str:
+        """ساخت پرامپت بر اساس نوع درخواست"""
+        # تشخیص نوع درخواست
+        if self._is_multiple_choice_request(question):
+            return self._create_mcq_prompt(context, question)
+        return self._create_standard_prompt(context, question)
     
     def _is_multiple_choice_request(self, question: str) -> bool:
         """تشخیص اینکه آیا درخواست برای تولید سوال چهار گزینه‌ای است یا خیر"""
@@ -94,22 +288,86 @@ class LLMClient:
     
     def _generate_openrouter_response(self, prompt: str) -> str:
         """تولید پاسخ با استفاده از OpenRouter"""
-        headers = {
+        start_time = time.perf_counter()
+        content, model = self._complete(prompt)
+        elapsed = time.perf_counter() - start_time
+        self.last_metrics = {'ttft': elapsed, 'total': elapsed, 'streamed': False, 'model': model}
+        return content
+    
+    def _stream_openrouter_response(self, prompt: str) -> Iterator[str]:
+        """تولید پاسخ جریانی با پروتکل SSE سازگار با OpenAI (stream: true)"""
+        start_time = time.perf_counter()
+        self.last_metrics = {'ttft': None, 'total': None, 'streamed': True}
+        
+        # تلاش مجدد و مدل‌های جایگزین فقط تا پیش از دریافت پاسخ اعمال می‌شوند
+        response, model = self._post_with_fallback(prompt, stream=True)
+        self.last_metrics['model'] = model
+        with response:
+            # text/event-stream بدون charset در requests به صورت ISO-8859-1 خوانده می‌شود
+            response.encoding = 'utf-8'
+            # chunk_size=None هر بخش را به محض رسیدن برمی‌گرداند (به جای انتظار برای پر شدن بافر)
+            for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                # خطوط خالی جداکننده رویدادها و خطوط «:» توضیحات (keep-alive) هستند
+                if not line or line.startswith(':') or not line.startswith('data:'):
+                    continue
+                payload = line[len('data:'):].strip()
+                if payload == '[DONE]':
+                    break
+                
+                event = json.loads(payload)
+                if 'error' in event:
+                    raise RuntimeError(event['error'].get('message', str(event['error'])))
+                choices = event.get('choices') or [{}]
+                delta = choices[0].get('delta', {}).get('content')
+                if delta:
+                    if self.last_metrics['ttft'] is None:
+                        self.last_metrics['ttft'] = time.perf_counter() - start_time
+                    yield delta
+        
+        self.last_metrics['total'] = time.perf_counter() - start_time
+    
+    def _post_with_fallback(self, prompt: str, stream: bool = False):
+        """ارسال درخواست به مدل اصلی و در صورت شکست همه تلاش‌ها، به مدل‌های جایگزین
+
+        فقط خطاهای اتصال و کدهای FALLBACK_STATUSES به مدل بعدی منتقل می‌شوند؛ سایر خطاها بلافاصله رخ می‌دهند.
+        خروجی: (پاسخ HTTP، نام مدلی که پاسخ داده است)
+        """
+        last_error = None
+        for model in self._candidate_models():
+            try:
+                response = self.transport.post(self.base_url, self._headers(),
+                                               self._request_body(prompt, stream=stream, model=model),
+                                               stream=stream, label=model)
+                return response, model
+            except requests.exceptions.HTTPError as e:
+                if e.response is None or e.response.status_code not in FALLBACK_STATUSES:
+                    raise
+                last_error = e
+            except requests.exceptions.RequestException as e:
+                last_error = e
+        raise last_error
+    
+    def _candidate_models(self) -> List[str]:
+        """مدل اصلی و مدل‌های جایگزین به ترتیب اولویت"""
+        return [self.model] + [m for m in self.fallback_models if m != self.model]
+    
+    def _headers(self) -> Dict[str, str]:
+        """هدرهای درخواست OpenRouter"""
+        return {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
-        
+    
+    def _request_body(self, prompt: str, stream: bool = False, model: str = None) -> Dict[str, Any]:
+        """بدنه درخواست chat completions"""
         data = {
-            "model": self.model,
+            "model": model or self.model,
             "messages": [
                 {"role": "user", "content": prompt}
             ],
-            "max_tokens": 1000,
-            "temperature": 0.7
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature
         }
-        
-        response = requests.post(self.base_url, headers=headers, json=data, timeout=30)
-        response.raise_for_status()
-        
-        result = response.json()
-        return result['choices'][0]['message']['content']
\ No newline at end of file
+        if stream:
+            data["stream"] = True
+        return data
\ No newline at end of file
@@ -0,0 +1,97 @@
+import os
+import time
+import threading
+from typing import TYPE_CHECKING, List, Dict, Tuple, Optional
+
+if TYPE_CHECKING:
+    from sentence_transformers import CrossEncoder
+
+# مدل چندزبانه (شامل فارسی) و کوچک که روی CPU قابل اجراست
+DEFAULT_RERANKER_MODEL = 'cross-encoder/mmarco-mMiniLMv2-L12-H384-v1'
+
+# مدل‌های cross-encoder در سطح پروسه نگه داشته می‌شوند و فقط در اولین استفاده بارگذاری می‌شوند
+_models = {}
+_models_lock = threading.Lock()
+
+def get_cross_encoder(model_name: str = DEFAULT_RERANKER_MODEL) -> 'CrossEncoder':
+    """دریافت مدل cross-encoder مشترک (هر مدل فقط یک‌بار در هر پروسه بارگذاری می‌شود)"""
+    from sentence_transformers import CrossEncoder
+    
+    with _models_lock:
+        if model_name not in _models:
+            _models[model_name] = CrossEncoder(model_name, device='cpu')
+        return _models[model_name]
+
+class Reranker:
+    """مرحله دوم بازیابی: بازچینی نامزدهای جستجو با cross-encoder روی CPU
+
+    نامزدها به ترتیب رتبه مرحله اول و به صورت دسته‌ای امتیازدهی می‌شوند. پس از هر دسته زمان سپری‌شده
+    با `time_budget_ms` مقایسه می‌شود و در صورت عبور از بودجه، نامزدهای باقی‌مانده بدون امتیازدهی
+    با همان ترتیب مرحله اول پس از نامزدهای امتیازدهی‌شده قرار می‌گیرند (دسته اول همیشه امتیازدهی می‌شود).
+    مدل فقط در اولین استفاده بارگذاری می‌شود.
+    """
+    
+    def __init__(self, model_name: Optional[str] = None, enabled: Optional[bool] = None,
+                 candidates: Optional[int] = None, batch_size: Optional[int] = None,
+                 time_budget_ms: Optional[float] = None):
+        self.model_name = model_name or os.getenv("RERANKER_MODEL", DEFAULT_RERANKER_MODEL)
+        self.enabled = enabled if enabled is not None else os.getenv("RERANKER_ENABLED", "false").lower() == "true"
+        # تعداد نامزدهایی که از مرحله اول دریافت می‌شود
+        self.candidates = candidates or int(os.getenv("RERANKER_CANDIDATES", "30"))
+        self.batch_size = batch_size or int(os.getenv("RERANKER_BATCH_SIZE", "16"))
+        self.time_budget_ms = time_budget_ms if time_budget_ms is not None else float(os.getenv("RERANKER_TIME_BUDGET_MS", "500"))
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.total_seconds = 0.0
+        self.budget_exhausted = 0
+    
+    def rerank(self, query: str, results: List[Dict], k: int = 5) -> Tuple[List[Dict], Dict]:
+        """بازچینی نتایج جستجو و برگرداندن k نتیجه برتر
+
+        امتیاز cross-encoder در کلید rerank_score هر نتیجه امتیازدهی‌شده قرار می‌گیرد.
+        خروجی: (نتایج، آمار شامل candidates، scored، load_seconds، seconds و budget_exhausted)
+        """
+        stats = {'candidates': len(results), 'scored': 0, 'load_seconds': 0.0, 'seconds': 0.0, 'budget_exhausted': False}
+        if not results:
+            return [], stats
+        
+        load_start = time.perf_counter()
+        model = get_cross_encoder(self.model_name)
+        stats['load_seconds'] = time.perf_counter() - load_start
+        
+        start_time = time.perf_counter()
+        batch_seconds = 0.0
+        scored = []
+        for batch_start in range(0, len(results), self.batch_size):
+            # دسته بعدی فقط اگر (با فرض زمانی برابر دسته قبل) در بودجه جا شود امتیازدهی می‌شود
+            if batch_start and (time.perf_counter() - start_time + batch_seconds) * 1000 > self.time_budget_ms:
+                stats['budget_exhausted'] = True
+                break
+            batch_start_time = time.perf_counter()
+            batch = results[batch_start:batch_start + self.batch_size]
+            scores = model.predict([(query, result['text']) for result in batch],
+                                   batch_size=len(batch), show_progress_bar=False)
+            scored.extend({**result, 'rerank_score': float(score)} for result, score in zip(batch, scores))
+            batch_seconds = time.perf_counter() - batch_start_time
+        
+        stats['scored'] = len(scored)
+        stats['seconds'] = time.perf_counter() - start_time
+        with self._lock:
+            self.queries += 1
+            self.total_seconds += stats['seconds']
+            self.budget_exhausted += int(stats['budget_exhausted'])
+        
+        scored.sort(key=lambda result: -result['rerank_score'])
+        return (scored + results[len(scored):])[:k], stats
+    
+    def get_stats(self) -> Dict:
+        """آمار بازچینی از زمان شروع برنامه"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'model': self.model_name,
+                'queries': self.queries,
+                'mean_ms': self.total_seconds / self.queries * 1000 if self.queries else 0.0,
+                'budget_exhausted': self.budget_exhausted,
+                'time_budget_ms': self.time_budget_ms
+            }
\ No newline at end of file
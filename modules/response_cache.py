@@ -0,0 +1,131 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import List, Dict, Optional
+
+class ResponseCache:
+    """کش پایدار پاسخ‌های مدل زبانی
+
+    کلید هر ورودی هش نام مدل، پرامپت نهایی (متن مرجع + سؤال)، temperature و max_tokens است.
+    ورودی‌ها پس از `ttl_seconds` منقضی می‌شوند و تعداد آن‌ها محدود است (حذف قدیمی‌ترین‌ها، LRU).
+    فایل‌های منبع هر پاسخ ثبت می‌شوند تا با حذف یک فایل، پاسخ‌های وابسته به آن نیز حذف شوند.
+    """
+    
+    def __init__(self, cache_path: str = "data/response_cache.sqlite", max_entries: Optional[int] = None,
+                 ttl_seconds: Optional[int] = None):
+        self.cache_path = cache_path
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv("LLM_CACHE_MAX_ENTRIES", "2000"))
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS response_sources (
+                key TEXT NOT NULL REFERENCES responses(key) ON DELETE CASCADE,
+                file_name TEXT NOT NULL,
+                PRIMARY KEY (key, file_name)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_response_sources_file ON response_sources(file_name)")
+        self._conn.commit()
+    
+    @staticmethod
+    def make_key(model: str, prompt: str, temperature: float, max_tokens: int) -> str:
+        """کلید کش برای یک درخواست"""
+        payload = json.dumps([model, prompt, temperature, max_tokens], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def get(self, key: str) -> Optional[str]:
+        """خواندن پاسخ ذخیره‌شده (None اگر وجود نداشته باشد یا منقضی شده باشد)"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            
+            if row is None:
+                self.misses += 1
+                return None
+            
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+    
+    def put(self, key: str, response: str, source_files: Optional[List[str]] = None):
+        """ذخیره پاسخ و فایل‌های منبع آن"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.execute(
+                "INSERT INTO responses (key, response, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, response, now, now)
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO response_sources (key, file_name) VALUES (?, ?)",
+                [(key, file_name) for file_name in set(source_files or [])]
+            )
+            self._evict(now)
+            self._conn.commit()
+    
+    def invalidate_file(self, file_name: str) -> int:
+        """حذف تمام پاسخ‌هایی که متن مرجع آن‌ها از فایل داده‌شده بوده است؛ خروجی: تعداد پاسخ‌های حذف‌شده"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM response_sources WHERE file_name = ?)",
+                (file_name,)
+            )
+            self._conn.commit()
+            return cursor.rowcount
+    
+    def clear(self) -> int:
+        """حذف تمام پاسخ‌ها (مثلاً پس از جایگزینی کل پایگاه داده برداری)؛ خروجی: تعداد پاسخ‌های حذف‌شده"""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            return cursor.rowcount
+    
+    def get_stats(self) -> Dict:
+        """آمار استفاده از کش از زمان شروع برنامه"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                'entries': entries,
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0
+            }
+    
+    def _evict(self, now: float):
+        """حذف ورودی‌های منقضی و در صورت عبور از سقف، قدیمی‌ترین ورودی‌ها تا ۹۰٪ سقف"""
+        self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+        entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if entries <= self.max_entries:
+            return
+        excess = entries - int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used LIMIT ?)",
+            (excess,)
+        )
\ No newline at end of file
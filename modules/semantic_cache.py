@@ -0,0 +1,217 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import numpy as np
+import faiss
+from typing import List, Dict, Optional
+
+class SemanticCache:
+    """کش معنایی پرسش‌ها
+
+    علاوه بر پرسش‌های دقیقاً تکراری، پرسش‌های هم‌معنی (مانند «این متن درباره چیست؟» و
+    «موضوع این سند چیست؟») نیز با مقایسه embedding پرسش با پرسش‌های قبلی تشخیص داده می‌شوند.
+    embedding پرسش‌ها در یک ایندکس کوچک FAISS (ضرب داخلی روی بردارهای نرمال‌شده) نگه داشته می‌شود
+    و پاسخ ذخیره‌شده فقط زمانی برگردانده می‌شود که شباهت از `threshold` بیشتر باشد و مجموعه
+    فایل‌های انتخاب‌شده و نوع درخواست (scope) یکسان باشد.
+
+    ورودی‌ها در SQLite ذخیره می‌شوند، پس از `ttl_seconds` منقضی می‌شوند و تعداد آن‌ها محدود است
+    (حذف قدیمی‌ترین‌ها، LRU). با حذف یک فایل، پاسخ‌هایی که از آن فایل استفاده کرده‌اند حذف می‌شوند.
+    """
+    
+    def __init__(self, dimension: int, cache_path: str = "data/semantic_cache.sqlite", model_name: str = "",
+                 threshold: Optional[float] = None, max_entries: Optional[int] = None,
+                 ttl_seconds: Optional[int] = None):
+        self.dimension = dimension
+        self.cache_path = cache_path
+        self.model_name = model_name
+        self.threshold = threshold if threshold is not None else float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "5000"))
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._hit_similarity_sum = 0.0
+        
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dimension))
+        self.scope_ids = {}  # نگاشت scope به شناسه ورودی‌های آن (برای فیلتر کردن داخل ایندکس)
+        self._entry_scopes = {}
+        
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY,
+                scope TEXT NOT NULL,
+                question TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                answer TEXT NOT NULL,
+                sources TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS entry_files (
+                id INTEGER NOT NULL REFERENCES entries(id) ON DELETE CASCADE,
+                file_name TEXT NOT NULL,
+                PRIMARY KEY (id, file_name)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_used ON entries(last_used)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entry_files_file ON entry_files(file_name)")
+        self._conn.commit()
+        
+        self._load_index()
+    
+    def make_scope(self, selected_files: List[str], mode: str = "") -> str:
+        """کلید محدوده یک پرسش (مدل embedding، نوع درخواست و مجموعه فایل‌های انتخاب‌شده)"""
+        return json.dumps([self.model_name, mode, sorted(set(selected_files or []))], ensure_ascii=False)
+    
+    def lookup(self, query_embedding: np.ndarray, selected_files: List[str], mode: str = "") -> Optional[Dict]:
+        """جستجوی پاسخ یک پرسش هم‌معنی با همان محدوده
+
+        query_embedding: بردار نرمال‌شده پرسش با شکل (1, dimension)
+        خروجی: {'question', 'answer', 'sources', 'similarity'} یا None
+        """
+        scope = self.make_scope(selected_files, mode)
+        now = time.time()
+        with self._lock:
+            candidate_ids = self.scope_ids.get(scope)
+            hit = None
+            if candidate_ids:
+                ids = np.fromiter(candidate_ids, dtype='int64', count=len(candidate_ids))
+                params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids)))
+                scores, found_ids = self.index.search(np.ascontiguousarray(query_embedding, dtype='float32'), 1, params=params)
+                if found_ids[0][0] >= 0 and scores[0][0] >= self.threshold:
+                    entry_id = int(found_ids[0][0])
+                    row = self._conn.execute(
+                        "SELECT question, answer, sources, created_at FROM entries WHERE id = ?", (entry_id,)
+                    ).fetchone()
+                    if row is not None and now - row[3] > self.ttl_seconds:
+                        self._delete_entries([entry_id])
+                        self._conn.commit()
+                    elif row is not None:
+                        self._conn.execute("UPDATE entries SET last_used = ? WHERE id = ?", (now, entry_id))
+                        self._conn.commit()
+                        hit = {
+                            'question': row[0],
+                            'answer': row[1],
+                            'sources': json.loads(row[2]),
+                            'similarity': float(scores[0][0])
+                        }
+            
+            if hit is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._hit_similarity_sum += hit['similarity']
+            return hit
+    
+    def put(self, query_embedding: np.ndarray, question: str, answer: str, sources: List[Dict],
+            selected_files: List[str], mode: str = ""):
+        """ذخیره پاسخ یک پرسش همراه با منابع آن"""
+        scope = self.make_scope(selected_files, mode)
+        vector = np.ascontiguousarray(query_embedding, dtype='float32').reshape(1, self.dimension)
+        source_files = {source['metadata']['file_name'] for source in sources}
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO entries (scope, question, vector, answer, sources, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (scope, question, vector.tobytes(), answer, json.dumps(sources, ensure_ascii=False), now, now)
+            )
+            entry_id = cursor.lastrowid
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO entry_files (id, file_name) VALUES (?, ?)",
+                [(entry_id, file_name) for file_name in source_files]
+            )
+            self._add_to_index(np.array([entry_id], dtype='int64'), vector, [scope])
+            self._evict(now)
+            self._conn.commit()
+    
+    def invalidate_file(self, file_name: str) -> int:
+        """حذف تمام پاسخ‌هایی که از فایل داده‌شده استفاده کرده‌اند؛ خروجی: تعداد پاسخ‌های حذف‌شده"""
+        with self._lock:
+            entry_ids = [row[0] for row in self._conn.execute(
+                "SELECT id FROM entry_files WHERE file_name = ?", (file_name,)
+            )]
+            self._delete_entries(entry_ids)
+            self._conn.commit()
+            return len(entry_ids)
+    
+    def clear(self) -> int:
+        """حذف تمام پاسخ‌ها (مثلاً پس از جایگزینی کل پایگاه داده برداری)؛ خروجی: تعداد پاسخ‌های حذف‌شده"""
+        with self._lock:
+            entry_ids = [row[0] for row in self._conn.execute("SELECT id FROM entries")]
+            self._delete_entries(entry_ids)
+            self._conn.commit()
+            return len(entry_ids)
+    
+    def get_stats(self) -> Dict:
+        """آمار استفاده از کش از زمان شروع برنامه"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': self.index.ntotal,
+                'max_entries': self.max_entries,
+                'threshold': self.threshold,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'mean_hit_similarity': self._hit_similarity_sum / self.hits if self.hits else 0.0
+            }
+    
+    def _load_index(self):
+        """بارگذاری بردار پرسش‌های ذخیره‌شده در ایندکس"""
+        rows = self._conn.execute("SELECT id, scope, vector FROM entries").fetchall()
+        # ورودی‌هایی که با مدل دیگری (با ابعاد متفاوت) ساخته شده‌اند نادیده گرفته می‌شوند
+        rows = [row for row in rows if len(row[2]) == self.dimension * 4]
+        if not rows:
+            return
+        ids = np.array([row[0] for row in rows], dtype='int64')
+        vectors = np.vstack([np.frombuffer(row[2], dtype='float32') for row in rows])
+        self._add_to_index(ids, vectors, [row[1] for row in rows])
+    
+    def _add_to_index(self, ids: np.ndarray, vectors: np.ndarray, scopes: List[str]):
+        """افزودن بردارها به ایندکس و نگاشت scope"""
+        self.index.add_with_ids(np.ascontiguousarray(vectors, dtype='float32'), ids)
+        for entry_id, scope in zip(ids.tolist(), scopes):
+            self.scope_ids.setdefault(scope, set()).add(entry_id)
+            self._entry_scopes[entry_id] = scope
+    
+    def _delete_entries(self, entry_ids: List[int]):
+        """حذف ورودی‌ها از SQLite و ایندکس"""
+        if not entry_ids:
+            return
+        for start in range(0, len(entry_ids), 500):
+            batch = entry_ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            self._conn.execute(f"DELETE FROM entries WHERE id IN ({placeholders})", batch)
+        
+        self.index.remove_ids(np.array(entry_ids, dtype='int64'))
+        for entry_id in entry_ids:
+            scope = self._entry_scopes.pop(entry_id, None)
+            if scope is not None:
+                self.scope_ids[scope].discard(entry_id)
+                if not self.scope_ids[scope]:
+                    del self.scope_ids[scope]
+    
+    def _evict(self, now: float):
+        """حذف ورودی‌های منقضی و در صورت عبور از سقف، قدیمی‌ترین ورودی‌ها تا ۹۰٪ سقف"""
+        expired = [row[0] for row in self._conn.execute(
+            "SELECT id FROM entries WHERE created_at < ?", (now - self.ttl_seconds,)
+        )]
+        self._delete_entries(expired)
+        
+        entries = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        if entries <= self.max_entries:
+            return
+        excess = entries - int(self.max_entries * 0.9)
+        oldest = [row[0] for row in self._conn.execute(
+            "SELECT id FROM entries ORDER BY last_used LIMIT ?", (excess,)
+        )]
+        self._delete_entries(oldest)
\ No newline at end of file
@@ -1,125 +1,826 @@
 import os
+import time
 import pickle
+import logging
+import threading
 import numpy as np
-from typing import List, Dict
+from typing import TYPE_CHECKING, List, Dict, Optional, Callable
 from datetime import datetime
-import streamlit as st
-from sentence_transformers import SentenceTransformer
 import faiss
+from .vector_store import VectorStore
+from .embedding_cache import EmbeddingCache
+from .embedding_engine import EmbeddingEngine
+from .lexical_index import LexicalIndex
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_NAME = 'all-MiniLM-L6-v2'
+
+# انواع ایندکس قابل پشتیبانی
+INDEX_TYPES = ('flat', 'hnsw', 'ivf')
+
+# انواع فشرده‌سازی بردارها در ایندکس‌های ANN (بدون فشرده‌سازی، int8 یا product quantization)
+QUANTIZATION_TYPES = ('none', 'sq8', 'pq')
+
+# حالت‌های بازیابی: فقط برداری یا ترکیب برداری و واژگانی (BM25)
+RETRIEVAL_MODES = ('dense', 'hybrid')
+
+# مدل‌های embedding در سطح پروسه نگه داشته می‌شوند تا هر نشست کاربر یک نسخه جدید بارگذاری نکند
+_models = {}
+_models_lock = threading.Lock()
+
+def get_embedding_model(model_name: str = DEFAULT_MODEL_NAME) -> 'SentenceTransformer':
+    """دریافت مدل embedding مشترک (هر مدل فقط یک‌بار در هر پروسه بارگذاری می‌شود)"""
+    # sentence_transformers (و torch) فقط در اولین بارگذاری مدل import می‌شود تا شروع اپلیکیشن سریع بماند
+    from sentence_transformers import SentenceTransformer
+    
+    with _models_lock:
+        if model_name not in _models:
+            _models[model_name] = SentenceTransformer(model_name)
+        return _models[model_name]
 
 class VectorDatabase:
-    """کلاس مدیریت پایگاه داده برداری"""
+    """کلاس مدیریت پایگاه داده برداری
+
+    یک نمونه از این کلاس می‌تواند بین چند نشست هم‌زمان به اشتراک گذاشته شود؛
+    تمام دسترسی‌ها به ایندکس و لیست اسناد با یک قفل محافظت می‌شوند.
+
+    تا زمانی که تعداد چانک‌ها کمتر از `promotion_threshold` باشد از ایندکس flat (جستجوی دقیق)
+    استفاده می‌شود و پس از عبور از این آستانه، ایندکس به نوع `index_type` (HNSW یا IVF) ارتقا می‌یابد.
+    بردارهای ایندکس ANN می‌توانند با `quantization` به صورت int8 (sq8) یا PQ فشرده شوند؛ در این حالت
+    نتایج برتر با بردارهای کامل float32 سگمنت‌ها دوباره امتیازدهی می‌شوند.
+
+    هر چانک یک شناسه پایدار (chunk_id) دارد که در ایندکس IDMap ذخیره می‌شود. حذف فایل فقط
+    چانک‌های آن را علامت‌گذاری (tombstone) می‌کند و فشرده‌سازی ایندکس در پس‌زمینه انجام می‌شود.
+
+    بردارها، متن چانک‌ها و متادیتا به صورت افزایشی در `VectorStore` ذخیره می‌شوند؛
+    متن چانک‌ها در حافظه نگه داشته نمی‌شود و فقط برای نتایج جستجو خوانده می‌شود.
+    
+    در حالت بازیابی `hybrid` چانک‌ها هم‌زمان در یک ایندکس واژگانی BM25 (`LexicalIndex`) نیز ثبت می‌شوند
+    و رتبه نتایج جستجوی برداری و واژگانی با reciprocal rank fusion ترکیب می‌شود.
+    """
     
-    def __init__(self):
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+    def __init__(self, model_name: str = DEFAULT_MODEL_NAME, data_dir: str = "data",
+                 index_type: Optional[str] = None, promotion_threshold: Optional[int] = None,
+                 quantization: Optional[str] = None):
+        # زمان بارگذاری مدل و ایندکس (ثانیه) برای گزارش زمان راه‌اندازی
+        self.load_timings = {}
+        load_start = time.perf_counter()
+        self.model = get_embedding_model(model_name)
+        self.load_timings['model_seconds'] = time.perf_counter() - load_start
+        self.embedding_engine = EmbeddingEngine(self.model)
+        self.model_name = model_name
         self.index = None
-        self.documents = []
-        self.metadata = []
-        self.db_path = "data/vector_db.pkl"
+        self.store_dir = os.path.join(data_dir, "vector_store")
+        self.legacy_db_path = os.path.join(data_dir, "vector_db.pkl")
+        self._lock = threading.RLock()
+        
+        # تنظیمات ایندکس (قابل تنظیم با متغیرهای محیطی)
+        self.index_type = (index_type or os.getenv("VECTOR_INDEX_TYPE", "hnsw")).lower()
+        if self.index_type not in INDEX_TYPES:
+            raise ValueError(f"نوع ایندکس نامعتبر است: {self.index_type}")
+        self.promotion_threshold = promotion_threshold if promotion_threshold is not None else int(os.getenv("VECTOR_PROMOTION_THRESHOLD", "50000"))
+        self.hnsw_m = int(os.getenv("VECTOR_HNSW_M", "32"))
+        self.hnsw_ef_construction = int(os.getenv("VECTOR_HNSW_EF_CONSTRUCTION", "200"))
+        self.ef_search = int(os.getenv("VECTOR_HNSW_EF_SEARCH", "64"))
+        self.ivf_nlist = int(os.getenv("VECTOR_IVF_NLIST", "0"))  # صفر یعنی محاسبه خودکار بر اساس تعداد بردارها
+        self.nprobe = int(os.getenv("VECTOR_IVF_NPROBE", "16"))
+        self.quantization = (quantization or os.getenv("VECTOR_QUANTIZATION", "none")).lower()
+        if self.quantization not in QUANTIZATION_TYPES:
+            raise ValueError(f"نوع فشرده‌سازی نامعتبر است: {self.quantization}")
+        self.pq_m = int(os.getenv("VECTOR_PQ_M", "48"))  # تعداد زیربردارهای PQ (هر زیربردار یک بایت)
+        # در ایندکس فشرده، rescore_factor برابر k نامزد بازیابی و با بردارهای کامل دوباره امتیازدهی می‌شود (صفر = غیرفعال)
+        self.rescore_factor = int(os.getenv("VECTOR_RESCORE_FACTOR", "4"))
+        # تا این تعداد چانک، جستجوی فیلترشده به صورت دقیق فقط روی بردارهای فایل‌های انتخاب‌شده انجام می‌شود
+        self.filter_exact_limit = int(os.getenv("VECTOR_FILTER_EXACT_LIMIT", "20000"))
+        # فشرده‌سازی زمانی شروع می‌شود که نسبت چانک‌های حذف‌شده از این مقدار بیشتر شود
+        self.compaction_ratio = float(os.getenv("VECTOR_COMPACTION_RATIO", "0.2"))
+        self.compaction_min_deleted = int(os.getenv("VECTOR_COMPACTION_MIN_DELETED", "1000"))
+        # ایندکس‌های ANN پس از افزوده شدن این تعداد چانک جدید دوباره روی دیسک ذخیره می‌شوند
+        self.index_checkpoint_interval = int(os.getenv("VECTOR_INDEX_CHECKPOINT_INTERVAL", "20000"))
+        self.retrieval_mode = os.getenv("VECTOR_RETRIEVAL_MODE", "hybrid").lower()
+        if self.retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"حالت بازیابی نامعتبر است: {self.retrieval_mode}")
+        # تعداد نامزدهای هر روش پیش از ترکیب و ثابت k در فرمول reciprocal rank fusion
+        self.hybrid_candidates = int(os.getenv("VECTOR_HYBRID_CANDIDATES", "30"))
+        self.rrf_k = int(os.getenv("VECTOR_RRF_K", "60"))
+        
+        self.store = None
+        self.next_chunk_id = 0
+        self.deleted_ids = set()  # چانک‌های حذف‌شده‌ای که هنوز در ایندکس یا سگمنت‌ها هستند
+        # نگاشت نام فایل به شناسه چانک‌های زنده آن (برای فیلتر کردن داخل ایندکس)
+        self.file_ids = {}
+        
+        self._tombstone_selector = None
+        self._compaction_thread = None
+        # فشرده‌سازی و ادغام سگمنت‌ها هر دو فهرست سگمنت‌ها را بازنویسی می‌کنند و نباید هم‌زمان اجرا شوند
+        self._maintenance_lock = threading.Lock()
+        
+        # کش embedding بر اساس هش متن چانک (مشترک بین افزودن اسناد و هر بازسازی که به مدل نیاز دارد)
+        self.embedding_cache = EmbeddingCache(os.path.join(data_dir, "embedding_cache.sqlite"), model_name)
+        self.lexical_index = LexicalIndex(os.path.join(self.store_dir, "lexical.sqlite"))
+        
+        load_start = time.perf_counter()
         self.load_database()
+        self.load_timings['index_seconds'] = time.perf_counter() - load_start
     
-    def add_documents(self, texts: List[str], file_name: str):
-        """افزودن اسناد به پایگاه داده برداری"""
-        embeddings = self.model.encode(texts)
+    def add_documents(self, texts: List[str], file_name: str, embeddings: Optional[np.ndarray] = None,
+                      metadatas: Optional[List[Dict]] = None) -> Dict:
+        """افزودن اسناد به پایگاه داده برداری
+
+        metadatas متادیتای اضافه هر چانک است (مثلاً شماره صفحه و بازه کاراکترها از DocumentProcessor.iter_chunks).
+        اگر embeddings (خروجی encode_texts) داده شود، تولید embedding انجام نمی‌شود؛
+        این حالت برای پردازش گروهی چند فایل با یک فراخوانی بزرگ مدل استفاده می‌شود.
+        خروجی: آمار افزودن شامل تعداد چانک‌ها و تعداد embeddingهایی که از کش خوانده شدند
+        """
+        if not texts:
+            return {'chunks': 0, 'cache_hits': 0}
         
-        if self.index is None:
-            dimension = embeddings.shape[1]
-            self.index = faiss.IndexFlatIP(dimension)  # Inner Product for similarity
+        if embeddings is None:
+            # تولید embedding خارج از قفل انجام می‌شود تا جستجوی سایر نشست‌ها متوقف نشود
+            embeddings, cache_hits = self.encode_texts(texts)
+        else:
+            embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+            cache_hits = 0
         
-        # نرمال‌سازی بردارها برای استفاده از cosine similarity
-        faiss.normalize_L2(embeddings)
-        self.index.add(embeddings.astype('float32'))
+        with self._lock:
+            ids = np.arange(self.next_chunk_id, self.next_chunk_id + len(texts), dtype='int64')
+            timestamp = datetime.now().isoformat()
+            metadatas = [
+                {
+                    **(extra or {}),
+                    'file_name': file_name,
+                    'chunk_id': chunk_id,
+                    'timestamp': timestamp
+                }
+                for chunk_id, extra in zip(ids.tolist(), metadatas or [None] * len(texts))
+            ]
+            
+            # فقط داده‌های جدید روی دیسک نوشته می‌شوند
+            self.store.append(ids, embeddings, file_name, texts, metadatas)
+            self.next_chunk_id += len(texts)
+            self.file_ids.setdefault(file_name, []).extend(ids.tolist())
+            
+            if self.index is None:
+                self.index = self._build_index(embeddings, ids)
+            elif self._should_promote(self.get_chunk_count()):
+                # ارتقای ایندکس flat به ANN با استفاده از بردارهای ذخیره‌شده (بدون embedding مجدد)
+                live_ids = self._live_ids()
+                self.index = self._build_index(self.store.get_vectors(live_ids), live_ids)
+                self._persist_index()
+            else:
+                self.index.add_with_ids(embeddings, ids)
+            
+            if (self._index_kind(self.index) != 'flat'
+                    and self.next_chunk_id - self.store.index_covered_id >= self.index_checkpoint_interval):
+                self._persist_index()
         
-        # ذخیره متادیتا
-        for i, text in enumerate(texts):
-            self.documents.append(text)
-            self.metadata.append({
-                'file_name': file_name,
-                'chunk_id': len(self.documents),
-                'timestamp': datetime.now().isoformat()
-            })
+        self.lexical_index.add(ids.tolist(), texts, file_name)
+        # سگمنت‌های کوچک در پس‌زمینه ادغام می‌شوند
+        self._maybe_schedule_compaction()
+        return {'chunks': len(texts), 'cache_hits': cache_hits}
+    
+    def encode_texts(self, texts: List[str], progress_callback: Optional[Callable[[int, int], None]] = None):
+        """تولید embedding نرمال‌شده برای چند متن با استفاده از کش
+
+        فقط متن‌هایی که در کش نیستند (و هر متن تکراری فقط یک‌بار) به EmbeddingEngine داده می‌شوند.
+        progress_callback با (تعداد متن‌های انجام‌شده، تعداد متن‌های خارج از کش) فراخوانی می‌شود.
+        خروجی: (آرایه float32 بردارها، تعداد متن‌هایی که از کش خوانده شدند)
+        """
+        keys = [self.embedding_cache.make_key(text) for text in texts]
+        cached = self.embedding_cache.get_many(keys)
         
-        self.save_database()
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        
+        if missing:
+            new_embeddings = self.embedding_engine.encode(list(missing.values()), progress_callback)
+            self.embedding_cache.put_many(list(missing.keys()), new_embeddings)
+            cached.update(zip(missing.keys(), new_embeddings))
+        
+        embeddings = np.ascontiguousarray(np.vstack([cached[key] for key in keys]), dtype='float32')
+        cache_hits = sum(1 for key in keys if key not in missing)
+        return embeddings, cache_hits
+    
+    def encode_query(self, query: str) -> np.ndarray:
+        """تولید embedding نرمال‌شده یک پرسش با شکل (1, dimension)"""
+        query_embedding = np.ascontiguousarray(self.model.encode([query]), dtype='float32')
+        faiss.normalize_L2(query_embedding)
+        return query_embedding
     
-    def search(self, query: str, k: int = 5, selected_files: List[str] = None) -> List[Dict]:
-        """جستجو در پایگاه داده برداری"""
-        if self.index is None or len(self.documents) == 0:
+    def search(self, query: str, k: int = 5, selected_files: List[str] = None,
+               ef_search: Optional[int] = None, nprobe: Optional[int] = None,
+               query_embedding: Optional[np.ndarray] = None) -> List[Dict]:
+        """جستجو در پایگاه داده برداری
+
+        ef_search و nprobe به ترتیب دقت جستجو در ایندکس‌های HNSW و IVF را تعیین می‌کنند
+        (مقدار بیشتر = دقت بیشتر و سرعت کمتر). در صورت عدم تعیین، مقدار پیش‌فرض استفاده می‌شود.
+
+        فیلتر selected_files داخل خود جستجو اعمال می‌شود، بنابراین تا زمانی که فایل‌های انتخاب‌شده
+        به اندازه کافی چانک داشته باشند، همیشه k نتیجه از همان فایل‌ها برگردانده می‌شود.
+        
+        اگر query_embedding (خروجی encode_query) داده شود، embedding پرسش دوباره محاسبه نمی‌شود.
+        
+        در حالت hybrid، امتیاز هر نتیجه امتیاز RRF نرمال‌شده (۱ یعنی رتبه اول در هر دو روش) است و
+        امتیاز شباهت برداری و BM25 در کلیدهای dense_score و lexical_score (در صورت وجود) برگردانده می‌شوند.
+        """
+        # فهرست فایل‌ها و تعداد چانک‌ها با قفل خوانده می‌شود تا با افزودن یا حذف هم‌زمان فایل‌ها تغییر نکند
+        with self._lock:
+            chunk_count = self.get_chunk_count() if self.index is not None else 0
+            if selected_files is not None and set(selected_files).issuperset(self.file_ids):
+                # انتخاب همه فایل‌ها یعنی بدون فیلتر (هر دو روش جستجو از همین تصمیم استفاده می‌کنند)
+                selected_files = None
+        if chunk_count == 0:
             return []
         
-        query_embedding = self.model.encode([query])
-        faiss.normalize_L2(query_embedding)
+        if query_embedding is None:
+            query_embedding = self.encode_query(query)
         
-        scores, indices = self.index.search(query_embedding.astype('float32'), min(k, len(self.documents)))
+        hybrid = self.retrieval_mode == 'hybrid'
+        candidates = max(k, self.hybrid_candidates) if hybrid else k
+        if hybrid:
+            # ایندکس واژگانی قفل جداگانه دارد و جستجوی آن جستجوی سایر نشست‌ها را متوقف نمی‌کند
+            lexical_hits = self.lexical_index.search(query, candidates, selected_files)
+        
+        with self._lock:
+            if self.index is None or self.get_chunk_count() == 0:
+                return []
+            
+            hits = self._dense_search(query_embedding, candidates, selected_files, ef_search, nprobe)
+            ranked = self._fuse(hits, lexical_hits, k) if hybrid else [(chunk_id, score, {}) for chunk_id, score in hits]
+            chunks = self.store.get_chunks([chunk_id for chunk_id, _, _ in ranked])
         
         results = []
-        for score, idx in zip(scores[0], indices[0]):
-            if idx < len(self.documents):
-                metadata = self.metadata[idx]
-                # فیلتر کردن بر اساس فایل‌های انتخاب‌شده
-                if selected_files is None or (selected_files is not None and metadata['file_name'] in selected_files):
-                    results.append({
-                        'text': self.documents[idx],
-                        'score': float(score),
-                        'metadata': metadata
-                    })
+        for chunk_id, score, component_scores in ranked:
+            if chunk_id in chunks:
+                text, metadata = chunks[chunk_id]
+                results.append({
+                    'text': text,
+                    'score': score,
+                    'metadata': metadata,
+                    **component_scores
+                })
         
         return results
     
-    def remove_documents_by_file(self, file_name: str):
-        """حذف اسناد مربوط به یک فایل خاص"""
-        # پیدا کردن ایندکس‌های مربوط به فایل
-        indices_to_remove = []
-        for i, meta in enumerate(self.metadata):
-            if meta['file_name'] == file_name:
-                indices_to_remove.append(i)
-        
-        # حذف از لیست‌ها (از آخر به اول)
-        for idx in sorted(indices_to_remove, reverse=True):
-            del self.documents[idx]
-            del self.metadata[idx]
-        
-        # بازسازی ایندکس
-        if self.documents:
-            embeddings = self.model.encode(self.documents)
-            dimension = embeddings.shape[1]
-            self.index = faiss.IndexFlatIP(dimension)
-            faiss.normalize_L2(embeddings)
-            self.index.add(embeddings.astype('float32'))
+    def _dense_search(self, query_embedding: np.ndarray, k: int, selected_files: Optional[List[str]],
+                      ef_search: Optional[int], nprobe: Optional[int]) -> List[tuple]:
+        """جستجوی برداری (با قفل گرفته‌شده)؛ خروجی: لیست (شناسه چانک، شباهت)"""
+        candidate_ids = self._ids_for_files(selected_files)
+        fetch_k = k * self.rescore_factor if self._should_rescore() else k
+        if candidate_ids is None:
+            scores, ids = self._index_search(query_embedding, min(fetch_k, self.get_chunk_count()), ef_search, nprobe,
+                                             selector=self._get_tombstone_selector())
+            scores, ids = self._rescore(query_embedding, scores, ids, k)
+        elif len(candidate_ids) == 0:
+            return []
+        elif self._index_kind(self.index) == 'flat' or len(candidate_ids) <= self.filter_exact_limit:
+            # جستجوی دقیق فقط روی بردارهای فایل‌های انتخاب‌شده (هزینه متناسب با اندازه زیرمجموعه)
+            scores, ids = self._exact_subset_search(query_embedding, candidate_ids, k)
         else:
-            self.index = None
+            selector = faiss.IDSelectorBatch(len(candidate_ids), faiss.swig_ptr(candidate_ids))
+            scores, ids = self._index_search(query_embedding, min(fetch_k, len(candidate_ids)), ef_search, nprobe, selector)
+            scores, ids = self._rescore(query_embedding, scores, ids, k)
+            # جستجوی تقریبی با فیلتر ممکن است کمتر از k نتیجه بدهد؛ در این حالت از جستجوی دقیق استفاده می‌شود
+            if np.count_nonzero(ids[0] >= 0) < min(k, len(candidate_ids)):
+                scores, ids = self._exact_subset_search(query_embedding, candidate_ids, k)
         
-        self.save_database()
+        return [(int(chunk_id), float(score)) for score, chunk_id in zip(scores[0], ids[0]) if chunk_id >= 0]
     
-    def save_database(self):
-        """ذخیره پایگاه داده"""
-        try:
-            db_data = {
-                'documents': self.documents,
-                'metadata': self.metadata,
-                'index': faiss.serialize_index(self.index) if self.index else None
+    def _fuse(self, dense_hits: List[tuple], lexical_hits: List[tuple], k: int) -> List[tuple]:
+        """ترکیب رتبه نتایج برداری و واژگانی با reciprocal rank fusion
+
+        خروجی: لیست (شناسه چانک، امتیاز RRF نرمال‌شده، امتیاز هر روش) برای k نتیجه برتر
+        """
+        fused = {}
+        for score_key, hits in (('dense_score', dense_hits), ('lexical_score', lexical_hits)):
+            for rank, (chunk_id, score) in enumerate(hits, 1):
+                entry = fused.setdefault(chunk_id, [0.0, {}])
+                entry[0] += 1.0 / (self.rrf_k + rank)
+                entry[1][score_key] = score
+        
+        best_possible = 2.0 / (self.rrf_k + 1)
+        ranked = sorted(fused.items(), key=lambda item: -item[1][0])[:k]
+        return [(chunk_id, rrf / best_possible, component_scores) for chunk_id, (rrf, component_scores) in ranked]
+    
+    def remove_documents_by_file(self, file_name: str):
+        """حذف اسناد مربوط به یک فایل خاص
+
+        فقط چانک‌های همین فایل علامت‌گذاری می‌شوند (بدون embedding مجدد سایر چانک‌ها)؛
+        بردارهای آن‌ها تا زمان فشرده‌سازی بعدی از نتایج جستجو کنار گذاشته می‌شوند.
+        """
+        with self._lock:
+            removed_ids = self.file_ids.pop(file_name, [])
+            if not removed_ids:
+                return
+            
+            self.store.mark_deleted(removed_ids)
+            self.lexical_index.remove(removed_ids)
+            self.deleted_ids.update(removed_ids)
+            self._tombstone_selector = None
+            
+            if self.get_chunk_count() == 0:
+                # پایگاه داده خالی شده است؛ نیازی به نگه داشتن ایندکس نیست
+                self.index = None
+                self.store.drop_index()
+        
+        self._maybe_schedule_compaction()
+    
+    def get_file_names(self) -> List[str]:
+        """نام فایل‌هایی که چانک زنده در پایگاه داده دارند"""
+        with self._lock:
+            return sorted(self.file_ids)
+    
+    def checkpoint(self):
+        """فشرده‌سازی چانک‌های حذف‌شده، ادغام سگمنت‌های کوچک و ذخیره ایندکس ANN تا شروع بعدی نیازی به ساخت مجدد ایندکس نداشته باشد"""
+        self.compact()
+        self.merge_segments()
+        with self._lock:
+            if self.index is not None and self.store.index_covered_id < self.next_chunk_id:
+                self._persist_index()
+    
+    def export(self, target_dir: str):
+        """نوشتن نسخه سازگار پوشه vector_store (سگمنت‌ها، ایندکس، متن چانک‌ها و ایندکس واژگانی) در target_dir"""
+        self.checkpoint()
+        with self._lock:
+            self.store.export(target_dir)
+            self.lexical_index.export(os.path.join(target_dir, "lexical.sqlite"))
+    
+    def get_chunk_count(self) -> int:
+        """تعداد چانک‌های زنده (حذف‌نشده)"""
+        return sum(len(ids) for ids in self.file_ids.values())
+    
+    def compact(self):
+        """فشرده‌سازی: بازنویسی سگمنت‌ها و بازسازی ایندکس بدون چانک‌های حذف‌شده
+
+        نوشتن سگمنت جدید و ساخت ایندکس خارج از قفل انجام می‌شود تا جستجو و افزودن اسناد متوقف نشود؛
+        تغییراتی که در حین ساخت رخ می‌دهند پیش از جایگزینی ایندکس اعمال می‌شوند.
+        """
+        with self._maintenance_lock:
+            self._compact()
+    
+    def merge_segments(self):
+        """ادغام size-tiered سگمنت‌های کوچک (بدون تغییر ایندکس؛ شناسه و بردار چانک‌ها ثابت می‌ماند)"""
+        with self._maintenance_lock:
+            segments = self.store.plan_merge()
+            while segments and self.store.merge_segments(segments):
+                segments = self.store.plan_merge()
+    
+    def _compact(self):
+        """اجرای فشرده‌سازی (با قفل نگهداری گرفته‌شده)"""
+        with self._lock:
+            if not self.deleted_ids:
+                return
+            compacted_ids = set(self.deleted_ids)
+            live_ids = self._live_ids()
+            segments = self.store.snapshot_segments()
+            snapshot_index = self.index
+            snapshot_next_id = self.next_chunk_id
+        
+        new_segment, ids, vectors = self.store.write_compacted_segment(segments, live_ids)
+        new_index = self._build_index(vectors, ids) if len(ids) else None
+        
+        with self._lock:
+            if self.index is not snapshot_index:
+                # ایندکس در این فاصله جایگزین شده است (ارتقا یا خالی شدن پایگاه داده)
+                self.store.discard_segment(new_segment)
+                return
+            
+            # افزودن چانک‌هایی که در حین ساخت اضافه شده‌اند
+            added_ids = np.array(
+                [i for i in range(snapshot_next_id, self.next_chunk_id) if i not in self.deleted_ids],
+                dtype='int64'
+            )
+            if len(added_ids):
+                added_vectors = self.store.get_vectors(added_ids)
+                if new_index is None:
+                    new_index = self._build_index(added_vectors, added_ids)
+                else:
+                    new_index.add_with_ids(added_vectors, added_ids)
+            
+            # چانک‌هایی که در حین ساخت حذف شده‌اند همچنان علامت‌گذاری‌شده باقی می‌مانند
+            self.store.commit_compaction(segments, new_segment, list(compacted_ids))
+            self.index = new_index
+            self.deleted_ids -= compacted_ids
+            self._tombstone_selector = None
+            self._persist_index()
+    
+    def get_index_info(self) -> Dict:
+        """اطلاعات ایندکس فعال (نوع، تعداد بردارها و پارامترهای جستجو)"""
+        with self._lock:
+            return {
+                'type': self._index_kind(self.index),
+                'target_type': self.index_type,
+                'ntotal': self.index.ntotal if self.index is not None else 0,
+                'tombstones': len(self.deleted_ids),
+                'segments': len(self.store.segments),
+                'promotion_threshold': self.promotion_threshold,
+                'ef_search': self.ef_search,
+                'nprobe': self.nprobe,
+                'quantization': self._quantization_kind(self.index),
+                'rescore_factor': self.rescore_factor if self._should_rescore() else 0,
+                'retrieval_mode': self.retrieval_mode,
+                'lexical_terms': self.lexical_index.get_stats()['terms']
             }
-            with open(self.db_path, 'wb') as f:
-                pickle.dump(db_data, f)
-        except Exception as e:
-            st.error(f"خطا در ذخیره پایگاه داده: {str(e)}")
     
-    def load_database(self):
-        """بارگذاری پایگاه داده"""
-        try:
-            if os.path.exists(self.db_path):
-                with open(self.db_path, 'rb') as f:
-                    db_data = pickle.load(f)
-                
-                self.documents = db_data.get('documents', [])
-                self.metadata = db_data.get('metadata', [])
+    def benchmark_indexes(self, configs: Optional[List[tuple]] = None, n_queries: int = 200, k: int = 10,
+                          max_vectors: int = 100000) -> List[Dict]:
+        """مقایسه دقت، تأخیر و حافظه انواع ایندکس و فشرده‌سازی روی بردارهای همین پایگاه داده
+
+        configs لیست (نوع ایندکس، نوع فشرده‌سازی) است. پرسش‌ها بردارهای تصادفی خود پیکره هستند
+        و recall@k نسبت به جستجوی دقیق محاسبه می‌شود. ایندکس فعال تغییر نمی‌کند.
+        """
+        configs = configs or [(index_type, quantization) for index_type in INDEX_TYPES for quantization in QUANTIZATION_TYPES]
+        with self._lock:
+            live_ids = self._live_ids()
+        if len(live_ids) == 0:
+            return []
+        
+        rng = np.random.default_rng(0)
+        if len(live_ids) > max_vectors:
+            live_ids = np.sort(rng.choice(live_ids, max_vectors, replace=False))
+        vectors = self.store.get_vectors(live_ids)
+        queries = vectors[rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)]
+        k = min(k, len(vectors))
+        
+        exact = faiss.IndexFlatIP(vectors.shape[1])
+        exact.add(vectors)
+        _, truth = exact.search(queries, k)
+        truth_ids = live_ids[truth]
+        
+        results = []
+        for index_type, quantization in configs:
+            build_start = time.perf_counter()
+            index = faiss.IndexIDMap2(self._create_index(vectors, index_type, quantization))
+            index.add_with_ids(vectors, live_ids)
+            build_seconds = time.perf_counter() - build_start
+            memory_mb = faiss.serialize_index(index).nbytes / 1024 / 1024
+            actual_quantization = self._quantization_kind(index)
+            
+            for rescore in ([False, True] if actual_quantization != 'none' and self.rescore_factor > 0 else [False]):
+                fetch_k = k * self.rescore_factor if rescore else k
+                params = self._search_params(fetch_k, None, None, index=index)
+                latencies = []
+                hits = 0
+                for query, expected in zip(queries, truth_ids):
+                    query = query[np.newaxis, :]
+                    search_start = time.perf_counter()
+                    scores, ids = index.search(query, fetch_k, params=params) if params is not None else index.search(query, fetch_k)
+                    if rescore:
+                        candidates = ids[0][ids[0] >= 0]
+                        scores, ids = self._exact_subset_search(query, candidates, k)
+                    latencies.append(time.perf_counter() - search_start)
+                    hits += len(set(ids[0][:k].tolist()) & set(expected.tolist()))
                 
-                index_data = db_data.get('index')
-                if index_data is not None:
-                    self.index = faiss.deserialize_index(index_data)
-                else:
-                    self.index = None
-        except Exception as e:
-            st.error(f"خطا در بارگذاری پایگاه داده: {str(e)}")
-            self.documents = []
-            self.metadata = []
-            self.index = None
\ No newline at end of file
+                results.append({
+                    'index_type': index_type,
+                    'quantization': actual_quantization,
+                    'rescore': rescore,
+                    'recall': hits / (len(queries) * k),
+                    'latency_ms': float(np.mean(latencies) * 1000),
+                    'p95_latency_ms': float(np.percentile(latencies, 95) * 1000),
+                    'memory_mb': memory_mb,
+                    'build_seconds': build_seconds
+                })
+        return results
+    
+    def _maybe_schedule_compaction(self):
+        """شروع فشرده‌سازی در پس‌زمینه در صورت انباشته شدن چانک‌های حذف‌شده (در ایندکس برداری یا واژگانی) یا سگمنت‌های کوچک"""
+        with self._lock:
+            if self._compaction_thread is not None and self._compaction_thread.is_alive():
+                return
+            if (not self._needs_compaction() and not self.lexical_index.needs_compaction()
+                    and self.store.plan_merge() is None):
+                return
+            self._compaction_thread = threading.Thread(target=self._run_compaction, name="vector-db-compaction", daemon=True)
+            self._compaction_thread.start()
+    
+    def _needs_compaction(self) -> bool:
+        """آیا نسبت چانک‌های حذف‌شده ایندکس برداری برای شروع فشرده‌سازی کافی است (با قفل گرفته‌شده)"""
+        deleted = len(self.deleted_ids)
+        total = deleted + self.get_chunk_count()
+        if deleted == 0 or (deleted < self.compaction_min_deleted and total > deleted):
+            return False
+        return deleted >= self.compaction_ratio * total
+    
+    def _run_compaction(self):
+        """اجرای فشرده‌سازی ایندکس برداری و ایندکس واژگانی و ادغام سگمنت‌ها در ترد پس‌زمینه"""
+        try:
+            with self._lock:
+                compact_vectors = self._needs_compaction()
+            if compact_vectors:
+                self.compact()
+            if self.lexical_index.needs_compaction():
+                self.lexical_index.compact()
+            self.merge_segments()
+        except Exception:
+            logger.exception("خطا در فشرده‌سازی پایگاه داده برداری")
+    
+    def _persist_index(self):
+        """ذخیره ایندکس‌های ANN روی دیسک؛ ایندکس flat در شروع برنامه از سگمنت‌ها ساخته می‌شود"""
+        if self.index is None or self._index_kind(self.index) == 'flat':
+            self.store.drop_index()
+        else:
+            self.store.save_index(self.index, self.next_chunk_id)
+    
+    def _live_ids(self) -> np.ndarray:
+        """شناسه چانک‌های زنده (مرتب‌شده)"""
+        if not self.file_ids:
+            return np.zeros(0, dtype='int64')
+        return np.sort(np.concatenate([np.asarray(ids, dtype='int64') for ids in self.file_ids.values()]))
+    
+    def _should_promote(self, count: int) -> bool:
+        """بررسی نیاز به ارتقای ایندکس flat به ANN"""
+        return (
+            self.index_type != 'flat'
+            and self._index_kind(self.index) == 'flat'
+            and count >= self.promotion_threshold
+        )
+    
+    def _build_index(self, embeddings: np.ndarray, ids: np.ndarray):
+        """ساخت ایندکس مناسب بر اساس تعداد بردارها و نوع ایندکس تنظیم‌شده"""
+        if self.index_type == 'flat' or len(embeddings) < self.promotion_threshold:
+            base = self._create_index(embeddings, 'flat', 'none')
+        else:
+            base = self._create_index(embeddings, self.index_type, self.quantization)
+        
+        # نگاشت شناسه‌های پایدار چانک‌ها روی ایندکس پایه
+        index = faiss.IndexIDMap2(base)
+        index.add_with_ids(embeddings, ids)
+        return index
+    
+    def _create_index(self, embeddings: np.ndarray, index_type: str, quantization: str):
+        """ساخت و آموزش ایندکس پایه خالی از نوع و فشرده‌سازی داده‌شده"""
+        count, dimension = embeddings.shape
+        if quantization == 'pq' and count < 256:
+            # آموزش PQ به دست‌کم ۲۵۶ بردار (یک مرکز برای هر کد) نیاز دارد
+            quantization = 'none'
+        
+        if index_type == 'ivf':
+            return self._train_ivf_index(embeddings, quantization)
+        
+        if index_type == 'hnsw':
+            if quantization == 'sq8':
+                base = faiss.IndexHNSWSQ(dimension, faiss.ScalarQuantizer.QT_8bit, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            elif quantization == 'pq':
+                # HNSW+PQ با متریک inner product در ساخت گراف با efConstruction بالا دقت خود را از دست می‌دهد؛
+                # برای بردارهای نرمال‌شده ترتیب فاصله L2 با cosine یکسان است و امتیازها در جستجو تبدیل می‌شوند
+                base = faiss.IndexHNSWPQ(dimension, self._pq_subvectors(dimension), self.hnsw_m, 8, faiss.METRIC_L2)
+            else:
+                base = faiss.IndexHNSWFlat(dimension, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            base.hnsw.efConstruction = self.hnsw_ef_construction
+            base.hnsw.efSearch = self.ef_search
+        elif quantization == 'sq8':
+            base = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+        elif quantization == 'pq':
+            base = faiss.IndexPQ(dimension, self._pq_subvectors(dimension), 8, faiss.METRIC_INNER_PRODUCT)
+        else:
+            base = faiss.IndexFlatIP(dimension)  # Inner Product for similarity
+        
+        if not base.is_trained:
+            base.train(self._training_sample(embeddings, 65536))
+        return base
+    
+    def _train_ivf_index(self, embeddings: np.ndarray, quantization: str = 'none'):
+        """ساخت و آموزش ایندکس IVF روی نمونه‌ای از بردارها"""
+        count, dimension = embeddings.shape
+        nlist = self.ivf_nlist or int(4 * np.sqrt(count))
+        # FAISS برای هر خوشه حداقل ۳۹ نمونه آموزشی توصیه می‌کند
+        nlist = max(1, min(nlist, count // 39))
+        
+        quantizer = faiss.IndexFlatIP(dimension)
+        if quantization == 'sq8':
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dimension, nlist, faiss.ScalarQuantizer.QT_8bit,
+                                                  faiss.METRIC_INNER_PRODUCT)
+        elif quantization == 'pq':
+            index = faiss.IndexIVFPQ(quantizer, dimension, nlist, self._pq_subvectors(dimension), 8,
+                                     faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+        
+        # آموزش روی نمونه تصادفی (حداکثر ۲۵۶ نمونه برای هر خوشه؛ کدهای PQ به نمونه بیشتری نیاز دارند)
+        sample_size = nlist * 256 if quantization == 'none' else max(nlist * 256, 65536)
+        index.train(self._training_sample(embeddings, sample_size))
+        index.nprobe = self.nprobe
+        return index
+    
+    @staticmethod
+    def _training_sample(embeddings: np.ndarray, sample_size: int) -> np.ndarray:
+        """نمونه تصادفی (قابل تکرار) از بردارها برای آموزش ایندکس"""
+        count = len(embeddings)
+        if sample_size >= count:
+            return embeddings
+        sample_ids = np.random.default_rng(0).choice(count, sample_size, replace=False)
+        return embeddings[np.sort(sample_ids)]
+    
+    def _pq_subvectors(self, dimension: int) -> int:
+        """بزرگ‌ترین تعداد زیربردار PQ تا سقف pq_m که بعد بردار بر آن بخش‌پذیر باشد"""
+        m = max(1, min(self.pq_m, dimension))
+        while dimension % m:
+            m -= 1
+        return m
+    
+    def _should_rescore(self) -> bool:
+        """آیا نتایج ایندکس فشرده باید با بردارهای کامل دوباره امتیازدهی شوند"""
+        return self.rescore_factor > 0 and self._quantization_kind(self.index) != 'none'
+    
+    def _rescore(self, query_embedding: np.ndarray, scores: np.ndarray, ids: np.ndarray, k: int):
+        """امتیازدهی دوباره نامزدهای ایندکس فشرده با بردارهای float32 سگمنت‌ها و انتخاب k نتیجه برتر"""
+        if not self._should_rescore():
+            return scores, ids
+        candidates = ids[0][ids[0] >= 0]
+        if len(candidates) == 0:
+            return scores, ids
+        return self._exact_subset_search(query_embedding, candidates, k)
+    
+    def _search_params(self, k: int, ef_search: Optional[int], nprobe: Optional[int], selector=None, index=None):
+        """ساخت پارامترهای زمان جستجو بر اساس نوع ایندکس"""
+        index = index if index is not None else self.index
+        kind = self._index_kind(index)
+        if kind == 'hnsw':
+            params = faiss.SearchParametersHNSW()
+            params.efSearch = max(ef_search or self.ef_search, k)
+        elif kind == 'ivf':
+            params = faiss.SearchParametersIVF()
+            params.nprobe = min(nprobe or self.nprobe, self._base_index(index).nlist)
+        elif selector is not None:
+            params = faiss.SearchParameters()
+        else:
+            return None
+        
+        if selector is not None:
+            params.sel = selector
+        return params
+    
+    def _index_search(self, query_embedding: np.ndarray, k: int, ef_search: Optional[int] = None,
+                      nprobe: Optional[int] = None, selector=None):
+        """جستجو در ایندکس FAISS، در صورت نیاز با ماسک IDSelector برای محدود کردن نتایج"""
+        params = self._search_params(k, ef_search, nprobe, selector)
+        if params is not None:
+            scores, ids = self.index.search(query_embedding, k, params=params)
+        else:
+            scores, ids = self.index.search(query_embedding, k)
+        if self.index.metric_type == faiss.METRIC_L2:
+            # تبدیل مجذور فاصله L2 بردارهای نرمال‌شده به cosine similarity
+            scores = 1 - scores / 2
+        return scores, ids
+    
+    def _exact_subset_search(self, query_embedding: np.ndarray, ids: np.ndarray, k: int):
+        """جستجوی دقیق روی زیرمجموعه‌ای از بردارها (خوانده‌شده از سگمنت‌های روی دیسک)"""
+        vectors = self.store.get_vectors(ids)
+        similarities = vectors @ query_embedding[0]
+        
+        k = min(k, len(ids))
+        if k < len(ids):
+            top = np.argpartition(-similarities, k - 1)[:k]
+        else:
+            top = np.arange(len(ids))
+        top = top[np.argsort(-similarities[top])]
+        return similarities[top][np.newaxis, :], ids[top][np.newaxis, :]
+    
+    def _get_tombstone_selector(self):
+        """ماسک IDSelector برای کنار گذاشتن چانک‌های حذف‌شده از نتایج جستجو"""
+        if not self.deleted_ids:
+            return None
+        if self._tombstone_selector is None:
+            deleted = np.array(sorted(self.deleted_ids), dtype='int64')
+            batch = faiss.IDSelectorBatch(len(deleted), faiss.swig_ptr(deleted))
+            # نگه داشتن ارجاع به اشیای داخلی تا زمان استفاده از ماسک
+            self._tombstone_selector = (faiss.IDSelectorNot(batch), batch, deleted)
+        return self._tombstone_selector[0]
+    
+    def _ids_for_files(self, selected_files: Optional[List[str]]) -> Optional[np.ndarray]:
+        """شناسه چانک‌های زنده فایل‌های انتخاب‌شده با قفل گرفته‌شده (None یعنی بدون فیلتر)"""
+        if selected_files is None:
+            return None
+        
+        selected = set(selected_files)
+        if selected.issuperset(self.file_ids.keys()):
+            return None
+        
+        ids = [self.file_ids[name] for name in selected if name in self.file_ids]
+        if not ids:
+            return np.zeros(0, dtype='int64')
+        return np.sort(np.concatenate([np.asarray(i, dtype='int64') for i in ids]))
+    
+    @staticmethod
+    def _base_index(index):
+        """ایندکس پایه زیر IndexIDMap"""
+        if isinstance(index, faiss.IndexIDMap2):
+            return faiss.downcast_index(index.index)
+        return index
+    
+    @classmethod
+    def _index_kind(cls, index) -> Optional[str]:
+        """تشخیص نوع ایندکس FAISS"""
+        if index is None:
+            return None
+        base = cls._base_index(index)
+        if isinstance(base, faiss.IndexHNSW):
+            return 'hnsw'
+        if isinstance(base, faiss.IndexIVF):
+            return 'ivf'
+        return 'flat'
+    
+    @classmethod
+    def _quantization_kind(cls, index) -> str:
+        """تشخیص نوع فشرده‌سازی بردارهای ایندکس FAISS"""
+        if index is None:
+            return 'none'
+        base = cls._base_index(index)
+        if isinstance(base, faiss.IndexHNSW):
+            base = faiss.downcast_index(base.storage)
+        if isinstance(base, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+            return 'sq8'
+        if isinstance(base, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+            return 'pq'
+        return 'none'
+    
+    def load_database(self):
+        """بارگذاری پایگاه داده
+
+        سگمنت‌های بردار mmap می‌شوند و فقط شناسه‌ها و نام فایل چانک‌ها در حافظه بارگذاری می‌شود.
+        اگر ایندکس ANN ذخیره‌شده‌ای وجود داشته باشد، فقط چانک‌های جدیدتر از آن به ایندکس اضافه می‌شوند.
+        خطای بارگذاری به فراخواننده منتقل می‌شود تا به جای یک پایگاه داده خالی گزارش شود.
+        """
+        self.store = VectorStore(self.store_dir)
+        if self.store.is_empty() and os.path.exists(self.legacy_db_path):
+            self._migrate_legacy_pickle()
+        
+        self.next_chunk_id = self.store.next_chunk_id
+        self.file_ids, self.deleted_ids = self.store.load_id_maps()
+        live_ids = self._live_ids()
+        
+        self.index = self.store.load_index()
+        if self.index is not None:
+            tail_ids = live_ids[live_ids >= self.store.index_covered_id]
+            if len(tail_ids):
+                self.index.add_with_ids(self.store.get_vectors(tail_ids), tail_ids)
+        elif len(live_ids):
+            self.index = self._build_index(self.store.get_vectors(live_ids), live_ids)
+        
+        # اعمال ارتقای معوق برای پایگاه‌های داده‌ای که از آستانه عبور کرده‌اند
+        if self._should_promote(len(live_ids)):
+            self.index = self._build_index(self.store.get_vectors(live_ids), live_ids)
+            self._persist_index()
+        
+        self._backfill_lexical_index(live_ids)
+    
+    def _backfill_lexical_index(self, live_ids: np.ndarray):
+        """افزودن چانک‌هایی که هنوز در ایندکس واژگانی نیستند (پایگاه‌های داده ساخته‌شده پیش از آن)"""
+        missing_ids = live_ids[live_ids >= self.lexical_index.next_chunk_id].tolist()
+        for start in range(0, len(missing_ids), 5000):
+            chunks = self.store.get_chunks(missing_ids[start:start + 5000])
+            by_file = {}
+            for chunk_id, (text, metadata) in sorted(chunks.items()):
+                ids, texts = by_file.setdefault(metadata['file_name'], ([], []))
+                ids.append(chunk_id)
+                texts.append(text)
+            for file_name, (ids, texts) in by_file.items():
+                self.lexical_index.add(ids, texts, file_name)
+    
+    def _migrate_legacy_pickle(self):
+        """انتقال یک‌باره داده‌های فایل vector_db.pkl قدیمی به موتور ذخیره‌سازی جدید"""
+        with open(self.legacy_db_path, 'rb') as f:
+            db_data = pickle.load(f)
+        
+        documents = db_data.get('documents', [])
+        metadata = db_data.get('metadata', [])
+        index_data = db_data.get('index')
+        if index_data is None or not documents:
+            os.replace(self.legacy_db_path, self.legacy_db_path + ".migrated")
+            return
+        
+        index = faiss.deserialize_index(index_data)
+        if 'row_ids' in db_data:
+            row_ids = db_data['row_ids']
+            vectors_by_row = None
+        else:
+            # قالب قدیمی: شناسه هر چانک همان شماره سطر آن است
+            row_ids = list(range(len(documents)))
+            vectors_by_row = index.reconstruct_n(0, index.ntotal)
+        
+        # نوشتن چانک‌های زنده به ترتیب شناسه، در سگمنت‌های پیوسته برای هر فایل
+        live_rows = [row for row in range(len(documents)) if documents[row] is not None]
+        start = 0
+        while start < len(live_rows):
+            file_name = metadata[live_rows[start]]['file_name']
+            end = start
+            while end < len(live_rows) and metadata[live_rows[end]]['file_name'] == file_name:
+                end += 1
+            rows = live_rows[start:end]
+            ids = np.array([row_ids[row] for row in rows], dtype='int64')
+            if vectors_by_row is None:
+                vectors = index.reconstruct_batch(ids)
+            else:
+                vectors = vectors_by_row[rows]
+            metadatas = [dict(metadata[row], chunk_id=int(chunk_id)) for row, chunk_id in zip(rows, ids.tolist())]
+            self.store.append(ids, vectors, file_name, [documents[row] for row in rows], metadatas)
+            start = end
+        
+        os.replace(self.legacy_db_path, self.legacy_db_path + ".migrated")
\ No newline at end of file
@@ -0,0 +1,419 @@
+import os
+import json
+import shutil
+import sqlite3
+import threading
+import numpy as np
+from typing import List, Dict, Optional, Tuple
+import faiss
+
+MANIFEST_VERSION = 1
+
+class VectorStore:
+    """موتور ذخیره‌سازی افزایشی پایگاه داده برداری
+
+    ساختار پوشه ذخیره‌سازی:
+    - manifest.json: فهرست سگمنت‌ها، بعد بردارها، شناسه بعدی و فایل ایندکس ذخیره‌شده
+    - seg_XXXXXX.vec / seg_XXXXXX.ids: بردارهای float32 خام و شناسه‌های int64 هر سگمنت (قابل mmap)
+    - chunks.sqlite: متن و متادیتای چانک‌ها به همراه علامت حذف
+
+    هر افزودن فقط یک سگمنت جدید می‌نویسد و manifest به صورت اتمیک جایگزین می‌شود؛
+    بنابراین قطع شدن برنامه در حین نوشتن، نسخه قبلی را خراب نمی‌کند.
+    
+    سگمنت‌ها به صورت size-tiered ادغام می‌شوند (حتی بدون چانک حذف‌شده). ردیف هر سگمنت
+    floor(log(تعداد بردارها، `merge_factor`)) است. وقتی یک دنباله مجاور از سگمنت‌های هم‌ردیف یا کوچک‌تر
+    شامل `merge_factor` سگمنت هم‌ردیف باشد، کل دنباله در یک سگمنت ردیف بالاتر ادغام می‌شود.
+    بنابراین هر بردار در هر ردیف حداکثر یک‌بار بازنویسی می‌شود و تعداد سگمنت‌ها و فایل‌های mmap‌شده
+    با تعداد افزودن‌ها به صورت لگاریتمی رشد می‌کند.
+    """
+    
+    def __init__(self, store_dir: str = "data/vector_store"):
+        self.store_dir = store_dir
+        self.manifest_path = os.path.join(store_dir, "manifest.json")
+        os.makedirs(store_dir, exist_ok=True)
+        self._lock = threading.RLock()
+        # تعداد سگمنت‌های هم‌ردیف برای ادغام (و ضریب اندازه ردیف‌ها)
+        self.merge_factor = int(os.getenv("VECTOR_SEGMENT_MERGE_FACTOR", "10"))
+        
+        self.manifest = self._read_manifest()
+        self.segments = []
+        self._all_ids = np.zeros(0, dtype='int64')
+        # بافر با ظرفیت رزروشده برای افزودن شناسه‌های سگمنت جدید بدون کپی کل آرایه
+        self._id_buffer = self._all_ids
+        self._segment_starts = np.zeros(0, dtype='int64')
+        
+        self._conn = sqlite3.connect(os.path.join(store_dir, "chunks.sqlite"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                chunk_id INTEGER PRIMARY KEY,
+                file_name TEXT NOT NULL,
+                text TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                deleted INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_file ON chunks(file_name)")
+        # حذف سطرهایی که پس از آخرین manifest معتبر نوشته شده‌اند (قطع شدن برنامه در حین افزودن)
+        self._conn.execute("DELETE FROM chunks WHERE chunk_id >= ?", (self.next_chunk_id,))
+        self._conn.commit()
+        
+        self._open_segments()
+    
+    @property
+    def next_chunk_id(self) -> int:
+        return self.manifest['next_chunk_id']
+    
+    @property
+    def dimension(self) -> Optional[int]:
+        return self.manifest['dimension']
+    
+    @property
+    def index_covered_id(self) -> int:
+        """شناسه‌های کوچک‌تر از این مقدار در فایل ایندکس ذخیره‌شده وجود دارند"""
+        index_info = self.manifest.get('index')
+        return index_info['next_chunk_id'] if index_info else 0
+    
+    def is_empty(self) -> bool:
+        return not self.manifest['segments']
+    
+    def append(self, ids: np.ndarray, vectors: np.ndarray, file_name: str, texts: List[str], metadatas: List[Dict]):
+        """افزودن چانک‌های جدید در یک سگمنت جدید (فقط داده جدید نوشته می‌شود)"""
+        with self._lock:
+            if self.dimension is None:
+                self.manifest['dimension'] = int(vectors.shape[1])
+            
+            self._conn.executemany(
+                "INSERT INTO chunks (chunk_id, file_name, text, metadata) VALUES (?, ?, ?, ?)",
+                [
+                    (int(chunk_id), file_name, text, json.dumps(meta, ensure_ascii=False))
+                    for chunk_id, text, meta in zip(ids.tolist(), texts, metadatas)
+                ]
+            )
+            self._conn.commit()
+            
+            name = self._next_segment_name()
+            self._write_segment(name, ids, vectors)
+            
+            segment = {'name': name, 'count': int(len(ids))}
+            manifest = dict(self.manifest)
+            manifest['segments'] = self.manifest['segments'] + [segment]
+            manifest['next_chunk_id'] = max(self.next_chunk_id, int(ids[-1]) + 1)
+            self._write_manifest(manifest)
+            
+            # فقط سگمنت جدید mmap می‌شود و شناسه‌های آن به انتهای آرایه شناسه‌ها افزوده می‌شوند
+            segment_ids, segment_vectors = self._map_segment(segment)
+            self.segments.append({'name': name, 'ids': segment_ids, 'vectors': segment_vectors})
+            self._segment_starts = np.append(self._segment_starts, len(self._all_ids))
+            self._extend_ids(np.asarray(segment_ids))
+    
+    def mark_deleted(self, ids: List[int]):
+        """علامت‌گذاری چانک‌ها به عنوان حذف‌شده (O(تعداد حذف‌شده‌ها))"""
+        with self._lock:
+            self._conn.executemany("UPDATE chunks SET deleted = 1 WHERE chunk_id = ?", [(int(i),) for i in ids])
+            self._conn.commit()
+    
+    def get_vectors(self, ids: np.ndarray) -> np.ndarray:
+        """خواندن بردارهای float32 چند چانک از سگمنت‌های mmap‌شده"""
+        with self._lock:
+            ids = np.asarray(ids, dtype='int64')
+            vectors = np.empty((len(ids), self.dimension or 0), dtype='float32')
+            if len(ids) == 0:
+                return vectors
+            
+            rows = np.searchsorted(self._all_ids, ids)
+            if np.any(rows >= len(self._all_ids)) or np.any(self._all_ids[np.minimum(rows, len(self._all_ids) - 1)] != ids):
+                raise KeyError("بردار برخی از چانک‌ها در سگمنت‌ها یافت نشد")
+            
+            segment_of_row = np.searchsorted(self._segment_starts, rows, side='right') - 1
+            for segment_index in np.unique(segment_of_row):
+                mask = segment_of_row == segment_index
+                segment = self.segments[segment_index]
+                vectors[mask] = segment['vectors'][rows[mask] - self._segment_starts[segment_index]]
+            return vectors
+    
+    def get_chunks(self, ids: List[int]) -> Dict[int, Tuple[str, Dict]]:
+        """خواندن متن و متادیتای چند چانک"""
+        chunks = {}
+        ids = [int(i) for i in ids]
+        with self._lock:
+            # محدودیت تعداد پارامترهای SQLite
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                for chunk_id, text, metadata in self._conn.execute(
+                    f"SELECT chunk_id, text, metadata FROM chunks WHERE chunk_id IN ({placeholders}) AND deleted = 0",
+                    batch
+                ):
+                    chunks[chunk_id] = (text, json.loads(metadata))
+        return chunks
+    
+    def load_id_maps(self) -> Tuple[Dict[str, List[int]], set]:
+        """بارگذاری نگاشت فایل به چانک‌های زنده و مجموعه چانک‌های حذف‌شده"""
+        file_ids = {}
+        deleted_ids = set()
+        with self._lock:
+            for chunk_id, file_name, deleted in self._conn.execute(
+                "SELECT chunk_id, file_name, deleted FROM chunks ORDER BY chunk_id"
+            ):
+                if deleted:
+                    deleted_ids.add(chunk_id)
+                else:
+                    file_ids.setdefault(file_name, []).append(chunk_id)
+        return file_ids, deleted_ids
+    
+    def save_index(self, index, covered_id: int):
+        """ذخیره ایندکس FAISS تا شناسه covered_id تا در شروع بعدی نیازی به ساخت مجدد نباشد"""
+        with self._lock:
+            name = f"index_{covered_id:012d}.faiss"
+            tmp_path = os.path.join(self.store_dir, name + ".tmp")
+            faiss.write_index(index, tmp_path)
+            os.replace(tmp_path, os.path.join(self.store_dir, name))
+            
+            old_index = self.manifest.get('index')
+            manifest = dict(self.manifest)
+            manifest['index'] = {'file': name, 'next_chunk_id': int(covered_id)}
+            self._write_manifest(manifest)
+            
+            if old_index and old_index['file'] != name:
+                self._remove_file(old_index['file'])
+    
+    def load_index(self):
+        """بارگذاری ایندکس ذخیره‌شده (در صورت وجود)"""
+        index_info = self.manifest.get('index')
+        if not index_info:
+            return None
+        path = os.path.join(self.store_dir, index_info['file'])
+        if not os.path.exists(path):
+            return None
+        return faiss.read_index(path)
+    
+    def drop_index(self):
+        """حذف ایندکس ذخیره‌شده (مثلاً وقتی پایگاه داده خالی می‌شود)"""
+        with self._lock:
+            old_index = self.manifest.get('index')
+            if old_index:
+                manifest = dict(self.manifest)
+                manifest['index'] = None
+                self._write_manifest(manifest)
+                self._remove_file(old_index['file'])
+    
+    def export(self, target_dir: str):
+        """کپی نسخه سازگار پوشه ذخیره‌سازی (فقط سگمنت‌ها و ایندکس ثبت‌شده در manifest) در target_dir"""
+        with self._lock:
+            os.makedirs(target_dir, exist_ok=True)
+            names = [segment['name'] + suffix for segment in self.manifest['segments'] for suffix in (".vec", ".ids")]
+            if self.manifest.get('index'):
+                names.append(self.manifest['index']['file'])
+            for name in names:
+                shutil.copyfile(os.path.join(self.store_dir, name), os.path.join(target_dir, name))
+            
+            target = sqlite3.connect(os.path.join(target_dir, "chunks.sqlite"))
+            try:
+                self._conn.backup(target)
+            finally:
+                target.close()
+            with open(os.path.join(target_dir, "manifest.json"), 'w', encoding='utf-8') as f:
+                json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+    
+    def snapshot_segments(self) -> List[Dict]:
+        """کپی فهرست سگمنت‌های فعلی برای فشرده‌سازی خارج از قفل"""
+        with self._lock:
+            return list(self.manifest['segments'])
+    
+    def write_compacted_segment(self, segments: List[Dict], keep_ids: np.ndarray) -> Tuple[Optional[Dict], np.ndarray, np.ndarray]:
+        """نوشتن یک سگمنت جدید شامل فقط چانک‌های زنده از سگمنت‌های داده‌شده
+
+        این متد فقط فایل‌های تغییرناپذیر سگمنت‌ها را می‌خواند و می‌تواند خارج از قفل اجرا شود.
+        خروجی: اطلاعات سگمنت جدید (یا None اگر چانک زنده‌ای نماند)، شناسه‌ها و بردارهای آن
+        """
+        with self._lock:
+            # شمارنده سگمنت‌ها یکنواخت است، پس افزودن‌های هم‌زمان نام دیگری می‌گیرند
+            name = self._next_segment_name()
+        
+        vector_parts = []
+        id_parts = []
+        for segment in segments:
+            ids, vectors = self._map_segment(segment)
+            mask = np.isin(ids, keep_ids, assume_unique=True)
+            id_parts.append(np.asarray(ids[mask]))
+            vector_parts.append(np.asarray(vectors[mask]))
+        
+        ids = np.concatenate(id_parts) if id_parts else np.zeros(0, dtype='int64')
+        if len(ids) == 0:
+            return None, ids, np.zeros((0, self.dimension or 0), dtype='float32')
+        vectors = np.vstack(vector_parts)
+        self._write_segment(name, ids, vectors)
+        return {'name': name, 'count': int(len(ids))}, ids, vectors
+    
+    def plan_merge(self) -> Optional[List[Dict]]:
+        """انتخاب سگمنت‌های مجاوری که باید ادغام شوند (None اگر ادغامی لازم نباشد)
+
+        از پایین‌ترین ردیف شروع می‌شود و اولین دنباله مجاور از سگمنت‌های با ردیف کمتر یا برابر که
+        `merge_factor` سگمنت از همان ردیف دارد برگردانده می‌شود (سگمنت‌های کوچک‌تر بین آن‌ها نیز ادغام می‌شوند).
+        """
+        with self._lock:
+            segments = self.manifest['segments']
+            if self.merge_factor < 2 or len(segments) < self.merge_factor:
+                return None
+            tiers = [self._tier(segment['count']) for segment in segments]
+            for tier in sorted(set(tiers)):
+                run_start, same_tier = 0, 0
+                for position, segment_tier in enumerate(tiers):
+                    if segment_tier > tier:
+                        run_start, same_tier = position + 1, 0
+                    elif segment_tier == tier:
+                        same_tier += 1
+                        if same_tier >= self.merge_factor:
+                            return list(segments[run_start:position + 1])
+            return None
+    
+    def merge_segments(self, segments: List[Dict]) -> bool:
+        """ادغام سگمنت‌های مجاور در یک سگمنت (همه بردارها، شامل چانک‌های حذف‌شده، حفظ می‌شوند)
+
+        خواندن و نوشتن خارج از قفل انجام می‌شود؛ شناسه‌ها و ترتیب آن‌ها تغییر نمی‌کند و فقط فهرست سگمنت‌ها عوض می‌شود.
+        خروجی: False اگر سگمنت‌ها در این فاصله تغییر کرده باشند (سگمنت جدید حذف می‌شود)
+        """
+        with self._lock:
+            name = self._next_segment_name()
+        
+        parts = [self._map_segment(segment) for segment in segments]
+        ids = np.concatenate([np.asarray(part_ids) for part_ids, _ in parts])
+        vectors = np.vstack([np.asarray(part_vectors) for _, part_vectors in parts])
+        del parts
+        self._write_segment(name, ids, vectors)
+        merged = {'name': name, 'count': int(len(ids))}
+        
+        with self._lock:
+            names = [segment['name'] for segment in self.manifest['segments']]
+            replaced = [segment['name'] for segment in segments]
+            start = names.index(replaced[0]) if replaced[0] in names else -1
+            if start < 0 or names[start:start + len(replaced)] != replaced:
+                self.discard_segment(merged)
+                return False
+            
+            manifest = dict(self.manifest)
+            manifest['segments'] = (self.manifest['segments'][:start] + [merged]
+                                    + self.manifest['segments'][start + len(replaced):])
+            self._write_manifest(manifest)
+            
+            merged_ids, merged_vectors = self._map_segment(merged)
+            self.segments[start:start + len(replaced)] = [{'name': name, 'ids': merged_ids, 'vectors': merged_vectors}]
+            # شناسه‌ها و ترتیب آن‌ها ثابت است؛ فقط ابتدای سگمنت‌ها دوباره محاسبه می‌شود
+            counts = [segment['count'] for segment in self.manifest['segments']]
+            self._segment_starts = np.concatenate(([0], np.cumsum(counts)[:-1])).astype('int64')
+            for old_name in replaced:
+                self._remove_file(old_name + ".vec")
+                self._remove_file(old_name + ".ids")
+            return True
+    
+    def discard_segment(self, segment: Optional[Dict]):
+        """حذف سگمنتی که نوشته شده ولی در manifest ثبت نشده است"""
+        if segment:
+            self._remove_file(segment['name'] + ".vec")
+            self._remove_file(segment['name'] + ".ids")
+    
+    def commit_compaction(self, replaced: List[Dict], new_segment: Optional[Dict], purged_ids: List[int]):
+        """جایگزینی سگمنت‌های فشرده‌شده در manifest و پاک‌سازی چانک‌های حذف‌شده"""
+        with self._lock:
+            replaced_names = {segment['name'] for segment in replaced}
+            remaining = [segment for segment in self.manifest['segments'] if segment['name'] not in replaced_names]
+            
+            manifest = dict(self.manifest)
+            manifest['segments'] = ([new_segment] if new_segment else []) + remaining
+            self._write_manifest(manifest)
+            
+            self._conn.executemany("DELETE FROM chunks WHERE chunk_id = ?", [(int(i),) for i in purged_ids])
+            self._conn.commit()
+            
+            self._open_segments()
+            for name in replaced_names:
+                self._remove_file(name + ".vec")
+                self._remove_file(name + ".ids")
+    
+    def _open_segments(self):
+        """mmap کردن سگمنت‌های موجود در manifest"""
+        self.segments = []
+        id_parts = []
+        starts = []
+        total = 0
+        for segment in self.manifest['segments']:
+            ids, vectors = self._map_segment(segment)
+            self.segments.append({'name': segment['name'], 'ids': ids, 'vectors': vectors})
+            id_parts.append(np.asarray(ids))
+            starts.append(total)
+            total += segment['count']
+        # شناسه‌ها در سگمنت‌ها صعودی نوشته می‌شوند، پس آرایه کل نیز مرتب است
+        self._all_ids = np.concatenate(id_parts) if id_parts else np.zeros(0, dtype='int64')
+        self._id_buffer = self._all_ids
+        self._segment_starts = np.array(starts, dtype='int64')
+    
+    def _extend_ids(self, ids: np.ndarray):
+        """افزودن شناسه‌ها به انتهای آرایه شناسه‌ها (ظرفیت بافر دوبرابر می‌شود تا هزینه افزودن ثابت سرشکن شود)"""
+        used = len(self._all_ids)
+        if used + len(ids) > len(self._id_buffer):
+            buffer = np.empty(max(2 * len(self._id_buffer), used + len(ids), 1024), dtype='int64')
+            buffer[:used] = self._all_ids
+            self._id_buffer = buffer
+        self._id_buffer[used:used + len(ids)] = ids
+        self._all_ids = self._id_buffer[:used + len(ids)]
+    
+    def _tier(self, count: int) -> int:
+        """ردیف اندازه یک سگمنت: floor(log(count، merge_factor))"""
+        tier = 0
+        while count >= self.merge_factor ** (tier + 1):
+            tier += 1
+        return tier
+    
+    def _map_segment(self, segment: Dict):
+        """باز کردن فایل‌های یک سگمنت به صورت memory-mapped"""
+        base = os.path.join(self.store_dir, segment['name'])
+        ids = np.memmap(base + ".ids", dtype='int64', mode='r', shape=(segment['count'],))
+        vectors = np.memmap(base + ".vec", dtype='float32', mode='r', shape=(segment['count'], self.dimension))
+        return ids, vectors
+    
+    def _write_segment(self, name: str, ids: np.ndarray, vectors: np.ndarray):
+        """نوشتن فایل‌های سگمنت و اطمینان از ثبت آن‌ها روی دیسک"""
+        base = os.path.join(self.store_dir, name)
+        for path, data in ((base + ".vec", np.ascontiguousarray(vectors, dtype='float32')),
+                           (base + ".ids", np.ascontiguousarray(ids, dtype='int64'))):
+            with open(path, 'wb') as f:
+                f.write(data.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+    
+    def _next_segment_name(self) -> str:
+        """نام سگمنت بعدی"""
+        self.manifest['segment_counter'] = self.manifest.get('segment_counter', 0) + 1
+        return f"seg_{self.manifest['segment_counter']:06d}"
+    
+    def _read_manifest(self) -> Dict:
+        """خواندن manifest (یا ایجاد manifest خالی)"""
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {
+            'version': MANIFEST_VERSION,
+            'dimension': None,
+            'next_chunk_id': 0,
+            'segment_counter': 0,
+            'segments': [],
+            'index': None
+        }
+    
+    def _write_manifest(self, manifest: Dict):
+        """جایگزینی اتمیک manifest"""
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+        self.manifest = manifest
+    
+    def _remove_file(self, name: str):
+        """حذف یک فایل از پوشه ذخیره‌سازی (در صورت وجود)"""
+        path = os.path.join(self.store_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
\ No newline at end of file
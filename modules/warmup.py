@@ -0,0 +1,47 @@
+import time
+import threading
+from typing import Callable, Any, Optional
+
+class BackgroundLoader:
+    """بارگذاری یک منبع سنگین (مانند مدل embedding و ایندکس) در نخ پس‌زمینه
+
+    بارگذاری بلافاصله پس از ساخت شروع می‌شود تا صفحه بدون انتظار برای آن نمایش داده شود؛
+    `ready` بدون انتظار وضعیت را برمی‌گرداند و `result` تا پایان بارگذاری منتظر می‌ماند.
+    خطای بارگذاری در `error` نگه داشته می‌شود و در `result` دوباره رخ می‌دهد.
+    """
+    
+    def __init__(self, factory: Callable[[], Any], name: str = "warmup"):
+        self._factory = factory
+        self._done = threading.Event()
+        self._value = None
+        self.error: Optional[BaseException] = None
+        self.started_at = time.perf_counter()
+        self.seconds: Optional[float] = None
+        threading.Thread(target=self._run, name=name, daemon=True).start()
+    
+    @property
+    def ready(self) -> bool:
+        """آیا بارگذاری (موفق یا ناموفق) تمام شده است"""
+        return self._done.is_set()
+    
+    @property
+    def elapsed(self) -> float:
+        """زمان سپری‌شده از شروع بارگذاری (ثانیه)"""
+        return self.seconds if self.seconds is not None else time.perf_counter() - self.started_at
+    
+    def result(self, timeout: Optional[float] = None) -> Any:
+        """منبع بارگذاری‌شده (در صورت نیاز تا پایان بارگذاری منتظر می‌ماند)"""
+        if not self._done.wait(timeout):
+            raise TimeoutError("بارگذاری هنوز تمام نشده است")
+        if self.error is not None:
+            raise self.error
+        return self._value
+    
+    def _run(self):
+        try:
+            self._value = self._factory()
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.seconds = time.perf_counter() - self.started_at
+            self._done.set()
\ No newline at end of file
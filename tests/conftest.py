@@ -0,0 +1,49 @@
+"""ابزارهای مشترک تست‌های پایگاه داده برداری
+
+مدل embedding واقعی (sentence-transformers) در تست‌ها بارگذاری نمی‌شود؛ به جای آن یک مدل قطعی
+ساده استفاده می‌شود که بردار هر متن را از واژه‌های آن می‌سازد تا متن‌های هم‌واژه به هم نزدیک باشند.
+"""
+
+import os
+import sys
+import hashlib
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DIMENSION = 32
+
+class FakeEmbeddingModel:
+    """مدل embedding قطعی: مجموع بردارهای تصادفی ثابت واژه‌های متن"""
+    
+    def get_sentence_embedding_dimension(self) -> int:
+        return DIMENSION
+    
+    def encode(self, texts, **kwargs) -> np.ndarray:
+        embeddings = np.zeros((len(texts), DIMENSION), dtype='float32')
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                seed = int(hashlib.md5(word.encode('utf-8')).hexdigest()[:8], 16)
+                embeddings[row] += np.random.default_rng(seed).standard_normal(DIMENSION).astype('float32')
+        return embeddings
+
+@pytest.fixture
+def make_database(tmp_path, monkeypatch):
+    """سازنده VectorDatabase روی یک پوشه موقت؛ فراخوانی دوباره همان پوشه را دوباره بارگذاری می‌کند"""
+    import modules.vector_database as vector_database
+    
+    monkeypatch.setattr(vector_database, "get_embedding_model", lambda model_name=None: FakeEmbeddingModel())
+    databases = []
+    
+    def make(**kwargs):
+        database = vector_database.VectorDatabase(data_dir=str(tmp_path / "data"), **kwargs)
+        databases.append(database)
+        return database
+    
+    yield make
+    
+    # فشرده‌سازی پس‌زمینه پیش از حذف پوشه موقت تمام می‌شود
+    for database in databases:
+        if database._compaction_thread is not None:
+            database._compaction_thread.join()
\ No newline at end of file
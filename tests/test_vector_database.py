@@ -0,0 +1,66 @@
+"""تست‌های جستجو، حذف و فشرده‌سازی VectorDatabase"""
+
+import pytest
+
+pytest.importorskip("faiss")
+
+FILES = {
+    'apples.pdf': ["apple orchard harvest", "red apple pie recipe", "apple tree pruning"],
+    'oceans.pdf': ["ocean waves and tides", "deep ocean currents"],
+    'stars.pdf': ["star formation in galaxies", "apple shaped star cluster"],
+}
+
+def add_files(database, files=FILES):
+    for file_name, texts in files.items():
+        database.add_documents(texts, file_name)
+
+def result_files(results):
+    return [result['metadata']['file_name'] for result in results]
+
+@pytest.mark.parametrize("retrieval_mode", ["dense", "hybrid"])
+def test_search_selected_files(make_database, monkeypatch, retrieval_mode):
+    monkeypatch.setenv("VECTOR_RETRIEVAL_MODE", retrieval_mode)
+    database = make_database()
+    add_files(database)
+    
+    # نتایج فقط از فایل‌های انتخاب‌شده و تا جایی که چانک دارند، k نتیجه
+    results = database.search("apple", k=3, selected_files=['stars.pdf', 'oceans.pdf'])
+    assert len(results) == 3
+    assert set(result_files(results)) <= {'stars.pdf', 'oceans.pdf'}
+    assert results[0]['text'] == "apple shaped star cluster"
+    
+    results = database.search("apple", k=10, selected_files=['stars.pdf'])
+    assert sorted(result['text'] for result in results) == sorted(FILES['stars.pdf'])
+    
+    # انتخاب همه فایل‌ها همان نتایج جستجوی بدون فیلتر را می‌دهد
+    all_files = database.search("apple", k=4, selected_files=list(FILES))
+    assert result_files(all_files) == result_files(database.search("apple", k=4))
+    
+    assert database.search("apple", k=3, selected_files=['missing.pdf']) == []
+    assert database.search("apple", k=3, selected_files=[]) == []
+
+def test_delete_compact_reload(make_database):
+    database = make_database()
+    add_files(database)
+    database.remove_documents_by_file('apples.pdf')
+    
+    # چانک‌های حذف‌شده پیش از فشرده‌سازی هم در نتایج نمی‌آیند
+    assert 'apples.pdf' not in result_files(database.search("apple", k=10))
+    
+    database.checkpoint()
+    assert not database.deleted_ids
+    assert database.get_chunk_count() == 4
+    assert database.store.get_chunks(range(len(FILES['apples.pdf']))) == {}
+    
+    reloaded = make_database()
+    assert reloaded.get_file_names() == ['oceans.pdf', 'stars.pdf']
+    assert reloaded.get_chunk_count() == 4
+    assert not reloaded.deleted_ids
+    results = reloaded.search("apple", k=10)
+    assert len(results) == 4
+    assert 'apples.pdf' not in result_files(results)
+    assert results[0]['text'] == "apple shaped star cluster"
+    
+    # شناسه‌های جدید پس از بارگذاری مجدد با شناسه‌های قبلی تداخل ندارند
+    reloaded.add_documents(["green apple"], 'apples.pdf')
+    assert result_files(reloaded.search("green apple", k=1)) == ['apples.pdf']
\ No newline at end of file
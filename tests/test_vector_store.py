@@ -0,0 +1,69 @@
+"""تست‌های بازیابی و ادغام سگمنت‌های VectorStore"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip("faiss")
+
+import modules.vector_store as vector_store
+from modules.vector_store import VectorStore
+
+DIMENSION = 8
+
+def append_chunks(store, first_id, count, file_name="a.pdf"):
+    ids = np.arange(first_id, first_id + count, dtype='int64')
+    vectors = np.random.default_rng(first_id).standard_normal((count, DIMENSION)).astype('float32')
+    texts = [f"chunk {chunk_id}" for chunk_id in ids]
+    store.append(ids, vectors, file_name, texts, [{} for _ in ids])
+    return ids, vectors
+
+def test_recovery_after_partial_append(tmp_path, monkeypatch):
+    store_dir = str(tmp_path / "vector_store")
+    store = VectorStore(store_dir)
+    ids, vectors = append_chunks(store, 0, 5)
+    
+    # قطع شدن برنامه پس از نوشتن سطرهای SQLite و فایل‌های سگمنت و پیش از جایگزینی manifest
+    def crash(*args):
+        raise OSError("crash")
+    monkeypatch.setattr(vector_store.os, "replace", crash)
+    with pytest.raises(OSError):
+        append_chunks(store, 5, 3, "b.pdf")
+    monkeypatch.undo()
+    
+    recovered = VectorStore(store_dir)
+    assert recovered.next_chunk_id == 5
+    assert [segment['count'] for segment in recovered.manifest['segments']] == [5]
+    file_ids, deleted_ids = recovered.load_id_maps()
+    assert file_ids == {'a.pdf': ids.tolist()} and not deleted_ids
+    assert recovered.get_chunks([5, 6, 7]) == {}
+    np.testing.assert_array_equal(recovered.get_vectors(ids), vectors)
+    
+    # افزودن دوباره همان شناسه‌ها پس از بازیابی
+    new_ids, new_vectors = append_chunks(recovered, 5, 3, "b.pdf")
+    np.testing.assert_array_equal(recovered.get_vectors(new_ids), new_vectors)
+    assert VectorStore(store_dir).load_id_maps()[0]['b.pdf'] == new_ids.tolist()
+
+def test_small_segments_are_merged(tmp_path, monkeypatch):
+    monkeypatch.setenv("VECTOR_SEGMENT_MERGE_FACTOR", "4")
+    store_dir = str(tmp_path / "vector_store")
+    store = VectorStore(store_dir)
+    expected = {}
+    next_id = 0
+    for count in [1, 2, 3] * 20:
+        ids, vectors = append_chunks(store, next_id, count)
+        expected.update(zip(ids.tolist(), vectors))
+        next_id += count
+        segments = store.plan_merge()
+        while segments and store.merge_segments(segments):
+            segments = store.plan_merge()
+    
+    assert len(store.segments) < 10
+    all_ids = np.array(sorted(expected), dtype='int64')
+    expected_vectors = np.stack([expected[chunk_id] for chunk_id in all_ids.tolist()])
+    np.testing.assert_array_equal(store.get_vectors(all_ids), expected_vectors)
+    
+    reopened = VectorStore(store_dir)
+    np.testing.assert_array_equal(reopened.get_vectors(all_ids), expected_vectors)
+    # فایل سگمنت‌های ادغام‌شده حذف شده‌اند
+    segment_files = {name for name in tmp_path.joinpath("vector_store").iterdir() if name.suffix in ('.vec', '.ids')}
+    assert len(segment_files) == 2 * len(reopened.segments)
\ No newline at end of file